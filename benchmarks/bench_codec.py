@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""
+Microbenchmark of the json decoding of a large job events listing: the
+standard library (json.loads on response.text, what tower companion used to
+do) against lib.codec (raw bytes, orjson/ujson when installed).
+
+usage: python benchmarks/bench_codec.py [events per page] [repetitions]
+"""
+from __future__ import print_function, absolute_import
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+from lib import codec  # noqa: E402
+
+
+class Response(object):
+    """
+    The bits of requests.Response used by the decoders
+    """
+    def __init__(self, content):
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+
+def listing(size):
+    """
+    A job_events page with size events
+    """
+    results = []
+    for counter in range(size):
+        results.append({
+            'id': counter, 'counter': counter, 'event': 'runner_on_ok',
+            'created': '2017-03-28T10:00:00.123456Z', 'failed': False,
+            'changed': counter % 3 == 0, 'host_name': 'web-%04d' % counter,
+            'task': 'install packages', 'play': 'webservers',
+            'stdout': u'ok: [web-%04d] => (item=nginx) \u2713' % counter,
+            'event_data': {'res': {'msg': 'All items completed',
+                                   'results': [{'item': 'nginx',
+                                                'changed': False}]}},
+            'summary_fields': {'host': {'id': counter,
+                                        'name': 'web-%04d' % counter}}})
+    return json.dumps({'count': size, 'next': None, 'previous': None,
+                       'results': results}).encode('utf-8')
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    response = Response(listing(size))
+    assert json.loads(response.text) == codec.decode_response(response)
+    stdlib = min(timeit.repeat(lambda: json.loads(response.text),
+                               number=1, repeat=repeat))
+    fast = min(timeit.repeat(lambda: codec.decode_response(response),
+                             number=1, repeat=repeat))
+    print('{0} events, {1:.1f} MB'.format(size,
+                                          len(response.content) / 1e6))
+    print('json.loads(text)         {0:8.2f} ms'.format(stdlib * 1000))
+    print('codec ({0:<6}) on bytes  {1:8.2f} ms  ({2:.1f}x)'.format(
+        codec.BACKEND, fast * 1000, stdlib / fast))
+
+
+if __name__ == '__main__':
+    main()
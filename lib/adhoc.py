@@ -29,6 +29,8 @@ class AdHoc(object):
         self.module_args = None
         self.become = None
         self.limit = None
+        self.forks = None
+        self.verbosity = None
         self.job_type = self.JOB_TYPE
         self.job_explanation = self.JOB_EXPLANATION
 
@@ -41,6 +43,7 @@ class AdHoc(object):
         """
         self._is_valid_module_name()
         self._is_valid_job_type()
+        self._is_valid_tuning()
 
         if self.inventory_id is None:
             raise AdHocError('inventory_id cannot be None')
@@ -71,6 +74,21 @@ class AdHoc(object):
             msg = "{0}: is not a valid job type".format(self.job_type)
             raise AdHocError(msg)
 
+    def _is_valid_tuning(self):
+        """
+        Checks forks and verbosity, when they are set. forks can be a non
+        negative integer or 'auto', verbosity goes from 0 to 4.
+
+        Raises: AdHocError
+        """
+        if self.forks is not None and not validate.forks(self.forks):
+            msg = "{0}: is not a valid number of forks".format(self.forks)
+            raise AdHocError(msg)
+        if self.verbosity is not None and \
+                not validate.verbosity(self.verbosity):
+            msg = "{0}: is not a valid verbosity".format(self.verbosity)
+            raise AdHocError(msg)
+
     def data(self):
         """
         Transforms the ad hoc command into a data structure that can be used by
@@ -91,5 +109,10 @@ class AdHoc(object):
                 'limit': self.limit,
                 'job_type': self.job_type,
                 'job_explanation': self.job_explanation}
+        # do not override tower defaults, unless asked to
+        if self.forks is not None:
+            data['forks'] = self.forks
+        if self.verbosity is not None:
+            data['verbosity'] = self.verbosity
 
         return data
@@ -3,11 +3,21 @@ This module manages the interaction with the remote service. Just ask, we will
 do our best to satisfy your request
 """
 from __future__ import absolute_import
-import copy
 import json
+import time
 import requests
+from lib import codec
 from lib.adhoc import AdHocError
+from lib.concurrency import AIMDLimiter, parallel_map
 from lib.configuration import ConfigError
+from lib.nodes import NodePool, NodeError
+
+# final statuses of a job (or update), error means tower could not run it
+FINISHED_STATUSES = ('successful', 'failed', 'error', 'canceled')
+# final statuses of a job that did not do its work
+FAILED_STATUSES = ('failed', 'error')
+# statuses of a job (or update) that is queued or running
+ACTIVE_STATUSES = ('new', 'pending', 'waiting', 'running')
 
 
 class APIError(Exception):
@@ -22,6 +32,20 @@ class APIv1(object):
     APIv1
     """
     LONG_PAGING = 10000
+    # default ceiling for the 'auto' forks of ad hoc commands
+    MAX_FORKS = 50
+    EVENTS_PAGING = 200
+    # max url encoded length of the names of a single name__in filter, keeps
+    # the query string well below the usual url length limits
+    MAX_FILTER_LENGTH = 2000
+    # ceiling of the adaptive number of concurrent requests
+    MAX_CONCURRENCY = 32
+    # responses telling the client to slow down: throttling and server errors
+    OVERLOADED_CODES = frozenset([429] + list(range(500, 600)))
+    # seconds, a healthy node answers quickly
+    PING_TIMEOUT = 5
+    # bytes read at a time from streamed responses
+    STREAM_CHUNK_SIZE = 64 * 1024
     # pylint: disable=E1101
     # disables:
     # E: Instance of 'LookupDict' has no 'ok' member (no-member)
@@ -36,6 +60,38 @@ class APIv1(object):
             raise APIError(msg)
 
         self.api_url = "https://{0}/api/v1".format(self.host)
+        # (endpoint, name) -> id and (endpoint, id) -> data, names do not
+        # change during the life of a command
+        self._id_cache = {}
+        self._data_cache = {}
+        # job url -> last status polled, monitors report its changes
+        self._statuses = {}
+        # shared by all the threads using this api
+        self.limiter = AIMDLimiter(maximum=self._max_concurrency())
+        # requests to host can be sent directly to the nodes of the cluster
+        nodes = [self.host]
+        if config.has_option('nodes'):
+            nodes = [node.strip() for node in config.get('nodes').split(',')
+                     if node.strip()] or nodes
+        self.nodes = NodePool(nodes, self.ping)
+
+    def _max_concurrency(self):
+        """
+        Returns the ceiling of concurrent requests, from the max_concurrency
+        configuration option, defaults to MAX_CONCURRENCY
+
+        Raises:
+            APIError
+        """
+        config = self.config
+        if not config.has_option('max_concurrency'):
+            return self.MAX_CONCURRENCY
+        try:
+            return max(1, int(config.get('max_concurrency')))
+        except ValueError as error:
+            msg = "Invalid max_concurrency in configuration, {0}.".format(
+                error)
+            raise APIError(msg)
 
     def _authentication(self):
         """
@@ -64,11 +120,95 @@ class APIv1(object):
             msg = "{0} Please check your configuration.".format(msg)
             raise APIError(msg)
 
-    def _get(self, url, params, data):
+    def _request(self, method, url, failover=False, **kwargs):
+        """
+        Sends a request to one of the tower nodes, when the limiter allows
+        it. Server errors, throttled requests and connection errors tell the
+        limiter to slow down.
+        When a node cannot be reached, it is not used for a while and, if
+        failover is set, the request is sent again to another node. Only
+        idempotent requests (GET) should fail over.
+
+        Args:
+            method (callable): requests.get, requests.post
+            url (str): url to request
+            failover (bool): retry on another node on connection errors
+            kwargs: any other argument for method
+
+        Returns:
+            (requests.Response)
+
+        Raises:
+            APIError, requests.exceptions.RequestException
+        """
+        prefix = "https://{0}/".format(self.host)
+        tried = []
+        while True:
+            try:
+                node = self.nodes.pick(exclude=tried)
+            except NodeError as error:
+                msg = "Failed to get {0} - {1}".format(url, error)
+                raise APIError(msg)
+            node_url = url
+            if url.startswith(prefix):
+                node_url = "https://{0}/{1}".format(node, url[len(prefix):])
+
+            token = self.limiter.acquire()
+            start = time.time()
+            overloaded = True
+            try:
+                response = method(node_url, **kwargs)
+                overloaded = response.status_code in self.OVERLOADED_CODES
+                return response
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout):
+                if len(self.nodes.hosts) == 1:
+                    raise
+                self.nodes.failed(node)
+                if not failover:
+                    raise
+                tried.append(node)
+            finally:
+                self.limiter.release(token, time.time() - start, overloaded)
+
+    def ping(self, host):
+        """
+        Pings a tower node
+
+        Args:
+            host (str): node host name
+
+        Returns:
+            (float): response time, in seconds
+
+        Raises:
+            APIError, requests.exceptions.RequestException
+        """
+        url = "https://{0}/api/v1/ping/".format(host)
+        start = time.time()
+        request = requests.get(url, verify=self._verify_ssl(),
+                               timeout=self.PING_TIMEOUT)
+        if request.status_code != requests.codes.ok:
+            msg = "Failed to ping {0} - {1}".format(host, request.reason)
+            raise APIError(msg)
+        return time.time() - start
+
+    def concurrency_stats(self):
+        """
+        Returns the state of the concurrency limiter: current limit, requests
+        in flight, completed requests and number of backoffs
+
+        Returns:
+            (dict)
+        """
+        return self.limiter.snapshot()
+
+    def _get(self, url, params, data, stream=False):
         auth = self._authentication()
         verify = self._verify_ssl()
-        request = requests.get(url, auth=auth, verify=verify, params=params,
-                               data=data)
+        request = self._request(requests.get, url, failover=True, auth=auth,
+                                verify=verify, params=params, data=data,
+                                stream=stream)
         if request.status_code == requests.codes.ok:
             return request
         else:
@@ -79,8 +219,9 @@ class APIv1(object):
         auth = self._authentication()
         verify = self._verify_ssl()
         headers = {'Content-type': 'application/json'}
-        request = requests.post(url, auth=auth, verify=verify, params=params,
-                                data=json.dumps(data), headers=headers)
+        request = self._request(requests.post, url, auth=auth, verify=verify,
+                                params=params, data=json.dumps(data),
+                                headers=headers)
         if request.status_code in (requests.codes.ok,
                                    requests.codes.created,
                                    requests.codes.no_content,
@@ -108,11 +249,74 @@ class APIv1(object):
         params['format'] = 'json'
         request = self._get(url, params=params, data=data)
         try:
-            return json.loads(request.text)
+            return codec.decode_response(request)
         except ValueError as error:
             msg = "Failed to get {0} - {1}".format(url, error)
             raise APIError(msg)
 
+    def _get_all_results(self, url, params):
+        """
+        Follows the 'next' links of a paginated listing and returns the
+        results of all the pages
+
+        Args:
+            url (str): url of the first page
+            params (dict): url encoded parameters
+
+        Returns:
+            (list): results from all the pages
+
+        Raises:
+            APIError
+        """
+        results = []
+        while url:
+            data = self._get_json(url, params=params)
+            results.extend(data['results'])
+            url = data.get('next')
+            if url:
+                # next is an absolute path, its query string already contains
+                # the parameters
+                url = "https://{0}{1}".format(self.host, url)
+                params = {}
+        return results
+
+    def iter_results(self, endpoint, params):
+        """
+        Streaming version of _get_all_results: the pages are decoded while
+        they are downloaded and the results are yielded one at a time. Only
+        one result is decoded at a time and, when the caller stops early, the
+        rest of the listing is not downloaded.
+
+        Args:
+            endpoint (str): name of the list endpoint
+            params (dict): url encoded parameters
+
+        Yields:
+            (dict): results of all the pages
+
+        Raises:
+            APIError
+        """
+        url = "{0}/{1}/".format(self.api_url, endpoint)
+        params = dict(params, format='json')
+        while url:
+            request = self._get(url, params=params, data=None, stream=True)
+            page = {}
+            try:
+                chunks = request.iter_content(self.STREAM_CHUNK_SIZE)
+                for result in codec.iter_results(chunks, page):
+                    yield result
+            except ValueError as error:
+                msg = "Failed to get {0} - {1}".format(url, error)
+                raise APIError(msg)
+            finally:
+                request.close()
+            url = page.get('next')
+            if url:
+                url = "https://{0}{1}".format(self.host, url)
+                params = {}
+
     def job_info(self, job_id):
         """
         returns a lot of data (json format) about job_is
@@ -131,11 +335,122 @@ class APIv1(object):
         request = self._get_json(url, params=params)
         return request
 
+    def job_data(self, job_id):
+        """
+        Returns the details of a (playbook) job
+
+        Args:
+            job_id (str): job_id
+
+        Returns:
+            (json object): response from remote service
+
+        Raises:
+            APIError
+        """
+        url = "{0}/jobs/{1}/".format(self.api_url, job_id)
+        return self._get_json(url, params={})
+
+    def active_jobs(self, template_id):
+        """
+        Returns the jobs of a template that are not complete yet: pending,
+        waiting or running, newest first
+
+        Args:
+            template_id (int): id of the template
+
+        Returns:
+            (list): jobs data
+
+        Raises:
+            APIError
+        """
+        url = "{0}/jobs/".format(self.api_url)
+        params = {'job_template': template_id,
+                  'status__in': 'pending,waiting,running',
+                  'order_by': '-id',
+                  'page_size': self.EVENTS_PAGING}
+        return self._get_all_results(url, params=params)
+
+    def jobs_count(self, statuses):
+        """
+        Returns the number of jobs (of any kind) in one of the statuses
+
+        Args:
+            statuses (list): e.g. ['pending', 'waiting']
+
+        Returns:
+            (int): number of jobs
+
+        Raises:
+            APIError
+        """
+        url = "{0}/unified_jobs/".format(self.api_url)
+        params = {'status__in': ','.join(statuses), 'page_size': 1}
+        return int(self._get_json(url, params=params)['count'])
+
+    def instances(self):
+        """
+        Returns the tower instances, with their capacity
+
+        Returns:
+            (list): instances data
+
+        Raises:
+            APIError
+        """
+        url = "{0}/instances/".format(self.api_url)
+        params = {'page_size': self.EVENTS_PAGING}
+        return self._get_all_results(url, params=params)
+
+    def instance_group_data(self, name):
+        """
+        Returns the details of an instance group, with its capacity
+
+        Args:
+            name (str): name of the instance group
+
+        Returns:
+            (json object)
+
+        Raises:
+            APIError
+        """
+        result = self._get_data_by_name(name=name, endpoint='instance_groups')
+        if result['count'] != 1:
+            msg = 'Could not find instance group "{0}"'.format(name)
+            raise APIError(msg)
+        return result['results'][0]
+
+    def job_failed_hosts(self, job_id):
+        """
+        Returns the host summaries of the hosts that failed or were
+        unreachable during a job
+
+        Args:
+            job_id (str): job_id
+
+        Returns:
+            (list): host summaries
+
+        Raises:
+            APIError
+        """
+        url = "{0}/jobs/{1}/job_host_summaries/".format(self.api_url, job_id)
+        params = {'failed': 'true', 'page_size': self.EVENTS_PAGING}
+        return self._get_all_results(url, params=params)
+
     def _get_id(self, name, endpoint):
+        key = (endpoint, name)
+        if key in self._id_cache:
+            return self._id_cache[key]
         result = self._get_data_by_name(name=name, endpoint=endpoint)
         count = result['count']
         if result['count'] == 1:
-            return result['results'][0]['id']
+            data = result['results'][0]
+            self._id_cache[key] = data['id']
+            self._data_cache[(endpoint, data['id'])] = data
+            return data['id']
 
         # no results or too many results are returned by the previous call
         msg = 'Could not find any id related to "{0}"'.format(name)
@@ -143,6 +458,89 @@ class APIv1(object):
             msg = 'Multiple id related to "{0}"'.format(name)
         raise APIError(msg)
 
+    def _get_ids(self, names, endpoint, field='name'):
+        """
+        Bulk version of _get_id, resolves many names with a few name__in
+        queries instead of one query per name. Names containing a comma
+        cannot be part of a name__in filter, they are looked up one by one.
+
+        Args:
+            names (iterable): names to resolve
+            endpoint (str): name of the endpoint to query
+            field (str): field holding the name, e.g. username for users
+
+        Returns:
+            (dict): name -> id
+
+        Raises:
+            APIError: listing all the missing and ambiguous names
+        """
+        ids = {}
+        chunks = []
+        chunk = []
+        length = 0
+        for name in sorted(set(names)):
+            key = (endpoint, name)
+            if key in self._id_cache:
+                ids[name] = self._id_cache[key]
+                continue
+            if ',' in name:
+                chunks.append([name])
+                continue
+            size = len(requests.utils.quote(name)) + 1
+            if chunk and length + size > self.MAX_FILTER_LENGTH:
+                chunks.append(chunk)
+                chunk = []
+                length = 0
+            chunk.append(name)
+            length += size
+        if chunk:
+            chunks.append(chunk)
+
+        url = "{0}/{1}/".format(self.api_url, endpoint)
+
+        def query(chunk):
+            """
+            Returns all the results matching the names of chunk
+            """
+            params = {'page_size': self.EVENTS_PAGING}
+            if len(chunk) == 1:
+                params[field] = chunk[0]
+            else:
+                params['{0}__in'.format(field)] = ','.join(chunk)
+            return self._get_all_results(url, params=params)
+
+        matches = {}
+        for results in parallel_map(query, chunks):
+            for data in results:
+                matches.setdefault(data[field], []).append(data)
+
+        missing = []
+        ambiguous = []
+        for chunk in chunks:
+            for name in chunk:
+                found = matches.get(name, [])
+                if len(found) == 1:
+                    data = found[0]
+                    ids[name] = data['id']
+                    self._id_cache[(endpoint, name)] = data['id']
+                    self._data_cache[(endpoint, data['id'])] = data
+                elif found:
+                    ambiguous.append('"{0}"'.format(name))
+                else:
+                    missing.append('"{0}"'.format(name))
+
+        msgs = []
+        if missing:
+            msgs.append('Could not find any id related to {0}'.format(
+                ', '.join(missing)))
+        if ambiguous:
+            msgs.append('Multiple id related to {0}'.format(
+                ', '.join(ambiguous)))
+        if msgs:
+            raise APIError('; '.join(msgs))
+        return ids
+
     def _get_data(self, endpoint, params):
         """
         Returns a json object with data
@@ -191,6 +589,21 @@ class APIv1(object):
         """
         return self._get_data_by_name(name=name, endpoint='job_templates')
 
+    def template_ids(self, names):
+        """
+        Returns the ids of many templates, see _get_ids
+
+        Args:
+            names (list): names of the templates
+
+        Returns:
+            (dict): name -> id
+
+        Raises:
+            APIError
+        """
+        return self._get_ids(names=names, endpoint='job_templates')
+
     def role_data(self):
         """
         Returns a json object with data about all roles
@@ -207,6 +620,19 @@ class APIv1(object):
         params = {'page_size': self.LONG_PAGING}
         return self._get_data(endpoint='roles', params=params)
 
+    def roles(self):
+        """
+        Yields all the roles, as they are downloaded, see iter_results
+
+        Yields:
+            (dict): role
+
+        Raises:
+            APIError
+        """
+        params = {'page_size': self.LONG_PAGING}
+        return self.iter_results(endpoint='roles', params=params)
+
     def user_data(self, username):
         """
         Returns a json object with data about the user
@@ -223,6 +649,22 @@ class APIv1(object):
         params = {'username': username}
         return self._get_data(endpoint='users', params=params)
 
+    def user_ids(self, usernames):
+        """
+        Returns the ids of many users, see _get_ids
+
+        Args:
+            usernames (list): names of the users
+
+        Returns:
+            (dict): username -> id
+
+        Raises:
+            APIError
+        """
+        return self._get_ids(names=usernames, endpoint='users',
+                             field='username')
+
     def project_data(self, name):
         """
         Returns a json object with data about name
@@ -238,6 +680,38 @@ class APIv1(object):
         """
         return self._get_data_by_name(name=name, endpoint='projects')
 
+    def project_ids(self, names):
+        """
+        Returns the ids of many projects, see _get_ids
+
+        Args:
+            names (list): names of the projects
+
+        Returns:
+            (dict): name -> id
+
+        Raises:
+            APIError
+        """
+        return self._get_ids(names=names, endpoint='projects')
+
+    def project_details(self, project_id):
+        """
+        Returns the details of a project, e.g. its scm_revision, status and
+        last_updated
+
+        Args:
+            project_id (int): id of the project
+
+        Returns:
+            (json object): response from remote service
+
+        Raises:
+            APIError
+        """
+        url = "{0}/projects/{1}/".format(self.api_url, project_id)
+        return self._get_json(url, params={})
+
     def launch_template_id(self, template_id, extra_vars, limit):
         """
         Launch a template job
@@ -256,7 +730,7 @@ class APIv1(object):
                                                      template_id)
         data = {'limit': limit, 'extra_vars': extra_vars}
         request = self._post(url, params={}, data=data)
-        return json.loads(request.text)
+        return codec.decode_response(request)
 
     def update_user_role(self, user_id, role_id):
         """
@@ -276,6 +750,23 @@ class APIv1(object):
         role_data = {'id': role_id}
         return self._post(url, params={}, data=role_data)
 
+    def user_roles(self, user_id):
+        """
+        Returns all the roles granted to a user, following the pagination
+
+        Params:
+            user_id (int): id of the user
+
+        Returns:
+            (list): roles data
+
+        Raises:
+            APIError
+        """
+        url = "{0}/users/{1}/roles/".format(self.api_url, user_id)
+        params = {'page_size': self.EVENTS_PAGING}
+        return self._get_all_results(url, params=params)
+
     def update_project_id(self, project_id):
         """
         Updates project
@@ -292,7 +783,101 @@ class APIv1(object):
         url = "{0}/projects/{1}/update/".format(self.api_url,
                                                      project_id)
         request = self._post(url, params={}, data={})
-        return json.loads(request.text)
+        return codec.decode_response(request)
+
+    def _update_url(self, update_data, kind):
+        """
+        Returns the url of an update started by project or inventory source
+        update requests
+
+        Args:
+            update_data (dict): data returned by the update request
+            kind (str): project_update or inventory_update
+
+        Returns:
+            (str): url of the update
+
+        Raises:
+            APIError
+        """
+        update_id = update_data.get('id') or update_data.get(kind)
+        if not update_id:
+            msg = 'No {0} id in {1}'.format(kind, update_data)
+            raise APIError(msg)
+        return "{0}/{1}s/{2}/".format(self.api_url, kind, update_id)
+
+    def project_update_url(self, update_data):
+        """
+        Returns the url of a project update
+
+        Args:
+            update_data (dict): data returned by update_project_id
+
+        Returns:
+            (str): url of the project update
+
+        Raises:
+            APIError
+        """
+        return self._update_url(update_data, 'project_update')
+
+    def inventory_sources(self, inventory_id):
+        """
+        Returns all the inventory sources of an inventory
+
+        Args:
+            inventory_id (int): id of the inventory
+
+        Returns:
+            (list): inventory sources data
+
+        Raises:
+            APIError
+        """
+        url = "{0}/inventories/{1}/inventory_sources/".format(self.api_url,
+                                                              inventory_id)
+        params = {'page_size': self.EVENTS_PAGING}
+        return self._get_all_results(url, params=params)
+
+    def update_inventory_source(self, source_id):
+        """
+        Starts the sync of an inventory source
+
+        Params:
+            source_id (int): id of the inventory source
+
+        Returns:
+            (str): url of the inventory update
+
+        Raises:
+            APIError
+        """
+        url = "{0}/inventory_sources/{1}/update/".format(self.api_url,
+                                                         source_id)
+        request = self._post(url, params={}, data={})
+        return self._update_url(codec.decode_response(request),
+                                'inventory_update')
+
+    def source_update_url(self, source):
+        """
+        Returns the url of the update of an inventory source that is queued
+        or running
+
+        Params:
+            source (dict): inventory source, as returned by
+                           inventory_sources()
+
+        Returns:
+            (str|None): url of the update, None when the source is idle
+        """
+        if source.get('status') not in ACTIVE_STATUSES:
+            return None
+        url = source.get('related', {}).get('current_update')
+        if not url:
+            return None
+        if url.startswith('/'):
+            url = "https://{0}{1}".format(self.host, url)
+        return url
 
     def adhoc_to_api(self, adhoc):
         """
@@ -306,20 +891,76 @@ class APIv1(object):
         Raises:
            APIError
         """
-        data = copy.deepcopy(adhoc)
         try:
-            int(data.inventory_id)
-        except ValueError:
-            data.inventory_id = self.inventory_id(data.inventory_id)
+            data = adhoc.data()
+        except AdHocError as error:
+            raise APIError(error)
+
+        # inventory and credential are resolved at the same time
+        lookups = []
+        for key, resolver in (('inventory', self.inventory_id),
+                              ('credential', self.credential_id)):
+            try:
+                int(data[key])
+            except ValueError:
+                lookups.append((key, resolver))
+
+        def resolve(lookup):
+            """
+            name -> id
+            """
+            key, resolver = lookup
+            return resolver(data[key])
+
+        for (key, _), value in zip(lookups, parallel_map(resolve, lookups)):
+            data[key] = value
+
+        if data.get('forks') == 'auto':
+            data['forks'] = self.auto_forks(data['inventory'])
+        return data
+
+    def max_forks(self):
+        """
+        Returns the ceiling for the 'auto' forks, from the max_forks
+        configuration option, defaults to MAX_FORKS
 
+        Raises:
+            APIError
+        """
+        config = self.config
+        if not config.has_option('max_forks'):
+            return self.MAX_FORKS
         try:
-            int(data.credential_id)
-        except ValueError:
-            data.credential_id = self.credential_id(data.credential_id)
+            return int(config.get('max_forks'))
+        except ValueError as error:
+            msg = "Invalid max_forks in configuration, {0}.".format(error)
+            raise APIError(msg)
+
+    def auto_forks(self, inventory_id):
+        """
+        Picks a number of forks for an ad hoc command: one fork per host of
+        the inventory, up to max_forks
+
+        Args:
+            inventory_id (int): id of the inventory
+
+        Returns:
+            (int): number of forks
+
+        Raises:
+            APIError
+        """
+        inventory = self._data_cache.get(('inventories', inventory_id))
+        if inventory is None:
+            url = "{0}/inventories/{1}/".format(self.api_url, inventory_id)
+            inventory = self._get_json(url, params={})
         try:
-            return data.data()
-        except AdHocError as error:
-            raise APIError(error)
+            hosts = int(inventory['total_hosts'])
+        except (KeyError, TypeError, ValueError):
+            msg = "Cannot read the host count of inventory {0}".format(
+                inventory_id)
+            raise APIError(msg)
+        return max(1, min(self.max_forks(), hosts))
 
     def launch_ad_hoc(self, ad_hoc):
         """
@@ -368,6 +1009,109 @@ class APIv1(object):
         result = self._get(url, params=params, data={})
         return result.text
 
+    def download_stdout(self, job_id, offset=0,
+                        chunk_size=STREAM_CHUNK_SIZE):
+        """
+        Downloads the whole output of a (finished) job, as plain text
+
+        Args:
+            job_id (int): id of the job
+            offset (int): only ask for the output after offset (http Range)
+            chunk_size (int): bytes read at a time
+        Returns:
+            (tuple): offset of the first chunk, 0 when tower ignores the
+                     range, and a generator of chunks of bytes
+        Raises:
+            APIError
+        """
+        url = "{0}/jobs/{1}/stdout/".format(self.api_url, job_id)
+        headers = {}
+        if offset:
+            headers['Range'] = 'bytes={0}-'.format(offset)
+        try:
+            request = self._request(requests.get, url, failover=True,
+                                    auth=self._authentication(),
+                                    verify=self._verify_ssl(),
+                                    params={'format': 'txt_download'},
+                                    headers=headers, stream=True)
+        except requests.exceptions.RequestException as error:
+            msg = "Failed to get {0} - {1}".format(url, error)
+            raise APIError(msg)
+        if offset and request.status_code == \
+                requests.codes.requested_range_not_satisfiable:
+            # nothing after offset, the download was already complete
+            request.close()
+            return offset, iter([])
+        if request.status_code == requests.codes.partial_content:
+            start = offset
+        elif request.status_code == requests.codes.ok:
+            start = 0
+        else:
+            request.close()
+            msg = "Failed to get {0} - {1}".format(url, request.reason)
+            raise APIError(msg)
+
+        def chunks():
+            """
+            Yields the body of the response, a broken transfer is an APIError
+            """
+            try:
+                for chunk in request.iter_content(chunk_size):
+                    yield chunk
+            except requests.exceptions.RequestException as error:
+                msg = "Failed to get {0} - {1}".format(url, error)
+                raise APIError(msg)
+            finally:
+                request.close()
+        return start, chunks()
+
+    def job_ids(self, filters):
+        """
+        Returns the ids of the jobs matching filters, newest first
+
+        Args:
+            filters (dict): jobs endpoint filters, e.g. {'status': 'failed'}
+        Returns:
+            (list): job ids
+        Raises:
+            APIError
+        """
+        params = dict(filters, page_size=self.LONG_PAGING, order_by='-id')
+        return [job['id'] for job in self.iter_results('jobs', params)]
+
+    def job_events_url(self, job_url):
+        """
+        Returns the events endpoint of a job. Jobs expose their events under
+        'job_events', ad hoc commands under 'events'
+
+        Args:
+            job_url (str): job url
+        Returns:
+            (str): events url
+        """
+        job_url = job_url.rstrip('/')
+        if '/ad_hoc_commands/' in job_url:
+            return '{0}/events/'.format(job_url)
+        return '{0}/job_events/'.format(job_url)
+
+    def job_events(self, job_url, last_id=0, page_size=EVENTS_PAGING):
+        """
+        Returns a page of events of a job, only the events with an id greater
+        than last_id are returned, sorted by id.
+
+        Args:
+            job_url (str): job url
+            last_id (int): id of the last event already processed
+            page_size (int): max number of events to return
+        Returns:
+            (json object): response from remote service
+        Raises:
+            APIError
+        """
+        url = self.job_events_url(job_url)
+        params = {'id__gt': last_id, 'order_by': 'id', 'page_size': page_size}
+        return self._get_json(url, params=params)
+
     def job_status(self, job_url):
         """
         Returns the job status string from the job_url
@@ -377,8 +1121,17 @@ class APIv1(object):
             (bool): job running status
         """
         result = self._get_json(job_url, params={}, data={})
+        self._statuses[job_url] = result['status']
         return result['status']
 
+    def last_status(self, job_url):
+        """
+        Returns the status of a job seen by the last job_status() or
+        job_finished() call, without asking tower; None if the job has not
+        been polled yet
+        """
+        return self._statuses.get(job_url)
+
     def job_finished(self, job_url):
         """
         Returns True if the job is not running anymore. This method do not care
@@ -389,7 +1142,7 @@ class APIv1(object):
         Returns:
             (bool): job running complete
         """
-        return self.job_status(job_url) in ('successful', 'canceled', 'failed')
+        return self.job_status(job_url) in FINISHED_STATUSES
 
     def job_started(self, job_url):
         """
@@ -430,6 +1183,38 @@ class APIv1(object):
         """
         return self._get_id(name=name, endpoint='inventories')
 
+    def inventory_ids(self, names):
+        """
+        Returns the ids of many inventories, see _get_ids
+
+        Args:
+            names (list): names of the inventories
+
+        Returns:
+            (dict): name -> id
+
+        Raises:
+            APIError
+        """
+        return self._get_ids(names=names, endpoint='inventories')
+
+    def inventory_hosts(self, inventory_id):
+        """
+        Returns all the hosts of an inventory, following the pagination
+
+        Args:
+            inventory_id (int): id of the inventory
+
+        Returns:
+            (list): hosts data
+
+        Raises:
+            APIError
+        """
+        url = "{0}/inventories/{1}/hosts/".format(self.api_url, inventory_id)
+        params = {'page_size': self.EVENTS_PAGING}
+        return self._get_all_results(url, params=params)
+
     def credentials_data(self, name):
         """
         Returns the inventory id of a given name
@@ -457,6 +1242,21 @@ class APIv1(object):
         """
         return self._get_id(name=name, endpoint='credentials')
 
+    def credential_ids(self, names):
+        """
+        Returns the ids of many credentials, see _get_ids
+
+        Args:
+            names (list): names of the credentials
+
+        Returns:
+            (dict): name -> id
+
+        Raises:
+            APIError
+        """
+        return self._get_ids(names=names, endpoint='credentials')
+
     def job_url(self, job_id):
         """
         Returns a job url from a job_id
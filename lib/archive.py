@@ -0,0 +1,159 @@
+"""
+Job outputs archived on disk. Outputs are written while they are downloaded,
+an interrupted download leaves a .part file behind and the next run asks tower
+only for the missing bytes.
+
+Compressed outputs are a sequence of gzip members (gzip, zcat and less read
+them as a single stream); every complete member is recorded in a sidecar
+.offsets file, a download resumes after the last complete member.
+"""
+from __future__ import absolute_import
+import os
+import zlib
+
+# bytes read at a time from the download
+CHUNK_SIZE = 64 * 1024
+# a gzip member is closed every MEMBER_SIZE bytes of output
+MEMBER_SIZE = 4 * 1024 * 1024
+COMPRESS_LEVEL = 6
+# zlib wbits for a gzip header and trailer
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+PART_SUFFIX = '.part'
+OFFSETS_SUFFIX = '.offsets'
+
+
+def archive_path(directory, job_id, compress=False):
+    """
+    Returns the path of the archived output of a job
+
+    Args:
+        directory (str): archive directory
+        job_id (int): id of the job
+        compress (bool): gzip compressed output
+    Returns:
+        (str)
+    """
+    name = 'job-{0}.txt'.format(job_id)
+    if compress:
+        name = '{0}.gz'.format(name)
+    return os.path.join(directory, name)
+
+
+def _compressor():
+    """
+    Returns a compressor for a new gzip member
+    """
+    return zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, GZIP_WBITS)
+
+
+class OutputFile(object):
+    """
+    Output of a job being written to path, through a .part file
+    """
+    def __init__(self, path, compress=False):
+        self.path = path
+        self.compress = compress
+        self.part = path + PART_SUFFIX
+        self.offsets = self.part + OFFSETS_SUFFIX
+
+    def resume_offset(self):
+        """
+        Returns the number of bytes of output already safely on disk, the
+        download can restart from here
+        """
+        if not os.path.exists(self.part):
+            return 0
+        if not self.compress:
+            return os.path.getsize(self.part)
+        return self._last_member()[0]
+
+    def _last_member(self):
+        """
+        Returns the output offset and the file offset at the end of the last
+        complete gzip member
+        """
+        last = (0, 0)
+        if os.path.exists(self.offsets):
+            with open(self.offsets, 'r') as offsets_in:
+                for line in offsets_in:
+                    fields = line.split()
+                    if len(fields) == 2:
+                        last = (int(fields[0]), int(fields[1]))
+        return last
+
+    def write(self, offset, chunks):
+        """
+        Writes the output, starting at offset, anything after offset already
+        on disk is dropped
+
+        Args:
+            offset (int): output offset of the first chunk, 0 or
+                          resume_offset()
+            chunks (iterable): bytes of output
+        Returns:
+            (int): number of bytes of output written
+        """
+        if not self.compress:
+            with open(self.part, 'ab' if offset else 'wb') as part_out:
+                part_out.truncate(offset)
+                written = 0
+                for chunk in chunks:
+                    part_out.write(chunk)
+                    written += len(chunk)
+            return written
+        return self._write_members(offset, chunks)
+
+    def _write_members(self, offset, chunks):
+        """
+        write() for compressed outputs
+        """
+        file_offset = 0
+        if offset:
+            offset, file_offset = self._last_member()
+        else:
+            with open(self.offsets, 'w'):
+                pass
+        mode = 'r+b' if file_offset else 'wb'
+        written = 0
+        with open(self.part, mode) as part_out:
+            part_out.truncate(file_offset)
+            part_out.seek(file_offset)
+            compressor = None
+            member_size = 0
+            for chunk in chunks:
+                if compressor is None:
+                    compressor = _compressor()
+                part_out.write(compressor.compress(chunk))
+                written += len(chunk)
+                member_size += len(chunk)
+                if member_size >= MEMBER_SIZE:
+                    self._close_member(part_out, compressor, offset + written)
+                    compressor = None
+                    member_size = 0
+            if compressor is None and not offset + written:
+                # empty output, still a valid gzip file
+                compressor = _compressor()
+            if compressor is not None:
+                self._close_member(part_out, compressor, offset + written)
+        return written
+
+    def _close_member(self, part_out, compressor, offset):
+        """
+        Completes the current gzip member and records it
+        """
+        part_out.write(compressor.flush())
+        part_out.flush()
+        os.fsync(part_out.fileno())
+        with open(self.offsets, 'a') as offsets_out:
+            offsets_out.write('{0} {1}\n'.format(offset, part_out.tell()))
+
+    def finish(self):
+        """
+        The download is complete, the output gets its final name
+        """
+        if not os.path.exists(self.part):
+            # empty output
+            open(self.part, 'wb').close()
+        os.rename(self.part, self.path)
+        if os.path.exists(self.offsets):
+            os.remove(self.offsets)
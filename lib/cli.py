@@ -3,16 +3,28 @@ Start and monitor ansilbe tower jobs from the command line, in real time.
 Grab your pop corns.
 """
 from __future__ import print_function, absolute_import
+import csv
+import hashlib
+import json
 import os
 import sys
 import click
 import yaml
-from .configuration import Config
-from .tc import Guard, GuardError
+from .configuration import Config, ConfigError
+from .tc import Guard, GuardError, kick_profiles, kick_and_monitor_profiles
 from .adhoc import AdHoc
+from .pager import IndexedOutput, PagerError
+from .reporter import Reporter, JSONReporter
+from .concurrency import DEFAULT_WORKERS
+from .utils import format_table
 
 # default tower-cli configuration file
 DEFAULT_CONFIGURATION = os.path.expanduser('~/.tower_cli.cfg')
+PERMISSIONS = ['read', 'execute', 'admin']
+# libyaml is much faster than the pure python parser, when it's available
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+# parsed @file extra vars, keyed by path, mtime and size
+EXTRA_VARS_CACHE = {}
 
 
 class CLIError(Exception):
@@ -34,15 +46,127 @@ def config_file():
         return DEFAULT_CONFIGURATION
 
 
+def profile_config(profile=None):
+    """
+    Returns the configuration of a profile, the default configuration when
+    profile is None
+
+    Args:
+        profile (str): name of the profile
+    Returns:
+        (Config)
+    Raise:
+        CLIError
+    """
+    try:
+        return Config(config_file(), profile=profile)
+    except ConfigError as error:
+        raise CLIError(error)
+
+
+def profile_guards(profiles, reporter=None):
+    """
+    Returns a Guard, so a client, for each profile
+
+    Args:
+        profiles (list): names of the profiles
+        reporter (Reporter): shared by the guards
+    Returns:
+        (dict): profile -> Guard
+    Raise:
+        CLIError
+    """
+    return dict((profile, Guard(profile_config(profile), reporter=reporter))
+                for profile in profiles)
+
+
+def make_reporter(json_output):
+    """
+    Returns the reporter of a command: json records with --json, text
+    otherwise
+    """
+    if json_output:
+        return JSONReporter()
+    return Reporter()
+
+
+def json_option(func):
+    """
+    Decorator adding the --json option to a command
+    """
+    return click.option('--json', 'json_output', is_flag=True,
+                        help=JSON_HELP)(func)
+
+
+def cache_dir():
+    """
+    Returns the directory of the tower companion cache: TC_CACHE_DIR or
+    ~/.cache/tower-companion
+    """
+    if 'TC_CACHE_DIR' in os.environ:
+        return os.environ['TC_CACHE_DIR']
+    return os.path.expanduser(os.path.join('~', '.cache', 'tower-companion'))
+
+
+def index_path(path):
+    """
+    Returns the path of the line index of an output file, indexes live in
+    the cache directory, keyed by the real path of the output
+    """
+    real_path = os.path.realpath(path).encode('utf-8')
+    name = '{0}.idx'.format(hashlib.sha1(real_path).hexdigest())
+    return os.path.join(cache_dir(), 'index', name)
+
+
+def parse_vars(text):
+    """
+    Parses extra variables: json is parsed directly, anything else goes to
+    the yaml (safe) parser
+
+    Args:
+        text (str): json or yaml
+    Returns:
+        whatever text contains
+    """
+    if text.lstrip().startswith('{'):
+        try:
+            return json.loads(text)
+        except ValueError:
+            # yaml flow mapping, e.g. {version: 1}
+            pass
+    return yaml.load(text, Loader=YAML_LOADER)
+
+
+def vars_from_file(filename):
+    """
+    Parses an extra vars file. Results are cached in memory, keyed by path,
+    modification time and size of the file, so the same file is parsed only
+    once per invocation. They are never written to disk: extra vars are often
+    secrets
+
+    Args:
+        filename (str): path of the file
+    Returns:
+        whatever the file contains
+    """
+    path = os.path.abspath(filename)
+    stat = os.stat(path)
+    key = (path, stat.st_mtime, stat.st_size)
+    if key not in EXTRA_VARS_CACHE:
+        with open(path, 'r') as var_in:
+            EXTRA_VARS_CACHE[key] = parse_vars(var_in.read())
+    return EXTRA_VARS_CACHE[key]
+
+
 def extra_var_to_dict(extra_var):
     """
     Extra variable parser.
     Takes extra_var and returns a dictionary
 
     1. if the extra_var points to a file, read the file and send the content
-    to the yaml parser
+    to the json/yaml parser, see vars_from_file()
 
-    2. if extra_var is a string, send it to the yaml parser
+    2. if extra_var is a string, send it to the json/yaml parser
 
     3. return parsed file/string as a dictionary
 
@@ -56,15 +180,17 @@ def extra_var_to_dict(extra_var):
         CLIError
     """
     value = {}
-    if extra_var.startswith('@'):
-        filename = extra_var.partition('@')[2]
-        if not os.path.isfile(filename):
-            msg = '{0} does not exist'.format(filename)
-            raise CLIError(msg)
-        with open(filename, 'r') as var_in:
-            value = yaml.load(var_in)
-    else:
-        value = yaml.load(extra_var)
+    try:
+        if extra_var.startswith('@'):
+            filename = extra_var.partition('@')[2]
+            if not os.path.isfile(filename):
+                msg = '{0} does not exist'.format(filename)
+                raise CLIError(msg)
+            value = vars_from_file(filename)
+        else:
+            value = parse_vars(extra_var)
+    except yaml.YAMLError as error:
+        raise CLIError('Failed to parse extra var: {0}'.format(error))
 
     if not isinstance(value, dict):
         raise CLIError('Failed to validate extra var: {0}'.format(extra_var))
@@ -72,76 +198,263 @@ def extra_var_to_dict(extra_var):
     return value
 
 
+def grants_from_file(filename):
+    """
+    Reads a permission grants spec. A .csv file has a header with the
+    username, template and permission columns, any other file is a yaml list
+    of dictionaries with the same keys. permission defaults to read.
+
+    Args:
+        filename (str): path of the spec
+    Returns:
+        (list): (username, template, permission) tuples
+    Raise:
+        CLIError
+    """
+    if not os.path.isfile(filename):
+        raise CLIError('{0} does not exist'.format(filename))
+    with open(filename, 'r') as spec_in:
+        if filename.lower().endswith('.csv'):
+            entries = list(csv.DictReader(spec_in))
+        else:
+            entries = yaml.safe_load(spec_in)
+    if not isinstance(entries, list) or not entries:
+        raise CLIError('{0}: expected a list of grants'.format(filename))
+
+    grants = []
+    for number, entry in enumerate(entries, 1):
+        if not isinstance(entry, dict):
+            raise CLIError('{0}: grant #{1} is not a dictionary'.format(
+                filename, number))
+        username = entry.get('username')
+        template = entry.get('template')
+        permission = (entry.get('permission') or 'read').lower()
+        if not username or not template or permission not in PERMISSIONS:
+            msg = '{0}: invalid grant #{1}: {2}'.format(filename, number,
+                                                        entry)
+            raise CLIError(msg)
+        grants.append((str(username), str(template), permission))
+    return grants
+
+
+def parse_filters(filters):
+    """
+    Parses field=value jobs filters
+
+    Args:
+        filters (list): field=value strings
+    Returns:
+        (dict): field -> value
+    Raise:
+        CLIError
+    """
+    parsed = {}
+    for item in filters:
+        field, sep, value = item.partition('=')
+        if not sep or not field.strip():
+            raise CLIError('invalid filter {0}, use field=value'.format(item))
+        parsed[field.strip()] = value
+    return parsed
+
+
+def line_range_option(ctx, param, value):
+    """
+    click callback for the --range option: first:last, first: or :last
+    """
+    # pylint: disable=unused-argument
+    if value is None:
+        return value
+    first, sep, last = value.partition(':')
+    try:
+        first = int(first) if first else 1
+        last = int(last) if last else None
+    except ValueError:
+        sep = None
+    if not sep or first < 1 or (last is not None and last < first):
+        raise click.BadParameter('use first:last, first: or :last')
+    return first, last
+
+
+def forks_option(ctx, param, value):
+    """
+    click callback for the --forks option, it accepts a number or 'auto'
+    """
+    # pylint: disable=unused-argument
+    if value is None or value == 'auto':
+        return value
+    try:
+        forks = int(value)
+    except ValueError:
+        forks = -1
+    if forks < 0:
+        raise click.BadParameter('use a non negative number or auto')
+    return forks
+
+
+FORKS_HELP = 'Number of parallel processes, auto picks it from the inventory'
+VERBOSITY_HELP = 'Verbosity, from 0 (normal) to 4 (connection debug)'
+PROFILE_HELP = ('Configuration profile, repeat it to run on many towers at '
+                'the same time')
+LOG_FILE_HELP = ('Append the output to this file too, as plain text (the '
+                 'output is downloaded once)')
+REFRESH_HELP = ('Sync the inventory sources not synced in the last N seconds '
+                'before the launch')
+JSON_HELP = 'Write newline delimited json records instead of text'
+HOST_LOGS_HELP = ('Split the output by host, from the job events, into this '
+                  'directory (one file per host and index.json)')
+
+
 @click.command()
 @click.option('--template-name', help='Job template name', required=True)
 @click.option('--extra-vars', help='Extra variables', type=str, default='',
               multiple=True)
 @click.option('--limit', help='Limit to hosts', type=str, default='')
-def cli_kick(template_name, extra_vars, limit):
+@click.option('--slices', help='Split the inventory in N parallel jobs',
+              type=click.IntRange(min=1), default=1)
+@click.option('--refresh-inventory', help=REFRESH_HELP,
+              type=click.IntRange(min=0), default=None)
+@click.option('--profile', help=PROFILE_HELP, multiple=True)
+@json_option
+def cli_kick(template_name, extra_vars, limit, slices, refresh_inventory,
+             profile, json_output):
     """
     Start an ansible tower job from the command line
     """
+    reporter = make_reporter(json_output)
     try:
-        # verify configuration
-        config = Config(config_file())
-        guard = Guard(config)
-        template_id = guard.get_template_id(template_name)
         extra_v = {}
         for extra_var in extra_vars:
             extra_v.update(extra_var_to_dict(extra_var))
-        job = guard.kick(template_id=template_id, limit=limit,
-                         extra_vars=extra_v)
-        job_url = guard.launch_data_to_url(job)
-        print('Started job: {0}'.format(job_url))
+        if len(profile) > 1:
+            if slices > 1 or refresh_inventory is not None:
+                raise CLIError('--slices and --refresh-inventory cannot be '
+                               'used together with many profiles')
+            launched = kick_profiles(profile_guards(profile, reporter),
+                                     template_name, extra_vars=extra_v,
+                                     limit=limit)
+            for name, job_url, error in launched:
+                if error is None:
+                    reporter.launch(job_url, '[{0}] Started job: {1}'.format(
+                        name, job_url), label=name)
+                else:
+                    reporter.error(u'{0}'.format(error),
+                                   '[{0}] Error kicking job template: {1} - '
+                                   '{2}'.format(name, template_name, error),
+                                   label=name)
+            if any(error is not None for _, _, error in launched):
+                sys.exit(1)
+            return
+        # verify configuration
+        config = profile_config(profile[0] if profile else None)
+        guard = Guard(config, reporter=reporter)
+        if slices > 1 and limit:
+            raise CLIError('--limit cannot be used together with --slices')
+        if refresh_inventory is not None:
+            refreshed = guard.refresh_inventory(template_name,
+                                                refresh_inventory)
+            if refreshed:
+                reporter.message('Synced inventory sources: {0}'.format(
+                    ', '.join(refreshed)), sources=refreshed)
+        if slices > 1:
+            jobs = guard.kick_slices(template_name=template_name,
+                                     extra_vars=extra_v, slices=slices)
+        else:
+            template_id = guard.get_template_id(template_name)
+            jobs = [guard.kick(template_id=template_id, limit=limit,
+                               extra_vars=extra_v)]
+        for job in jobs:
+            job_url = guard.launch_data_to_url(job)
+            reporter.launch(job_url, 'Started job: {0}'.format(job_url))
     except CLIError as error:
-        print(error)
+        reporter.error(u'{0}'.format(error))
         sys.exit(1)
     except GuardError as error:
         msg = 'Error kicking job tempate: {0} - {1}'.format(template_name,
                                                             error)
-        print(msg)
+        reporter.error(u'{0}'.format(error), msg)
         sys.exit(1)
+    finally:
+        reporter.close()
 
 @click.command()
-@click.option('--project-name', help='Project name', required=True)
-def cli_update_project(project_name):
+@click.option('--project-name', help='Project name (repeatable)',
+              required=True, multiple=True)
+@click.option('--max-age', type=click.IntRange(min=0), default=None,
+              help='skip projects updated less than max-age seconds ago')
+@click.option('--revision', default=None,
+              help='skip projects already at this scm revision')
+@click.option('--wait', help='Monitor the updates until they are complete',
+              is_flag=True)
+@click.option('--output-format', type=click.Choice(['ansi', 'txt']),
+              default='ansi', help='output format, with --wait')
+@click.option('--max-parallel', help='Max number of concurrent updates',
+              type=click.IntRange(min=1), default=DEFAULT_WORKERS)
+@json_option
+def cli_update_project(project_name, max_age, revision, wait, output_format,
+                       max_parallel, json_output):
     """
-    Update a project from the command line
+    Update one or more projects from the command line
     """
+    reporter = make_reporter(json_output)
     try:
         # verify configuration
         config = Config(config_file())
-        guard = Guard(config)
-        project_id = guard.get_project_id(project_name)
-        guard.update_project(project_id=project_id)
-        print('Started updating project: {0}'.format(project_name))
+        guard = Guard(config, reporter=reporter)
+        results = guard.update_projects(project_name, max_age=max_age,
+                                        revision=revision, wait=wait,
+                                        output_format=output_format,
+                                        workers=max_parallel)
+        for name, status, update_url in results:
+            if status == 'started':
+                # the launch record has been reported by update_projects
+                reporter.echo('Started updating project: {0}'.format(name))
+            else:
+                reporter.status(update_url, status, 'Project {0}: {1}'.format(
+                    name, status), project=name)
     except GuardError as error:
-        msg = 'Error updating project: {0} - {1}'.format(project_name,
-                                                            error)
-        print(msg)
+        msg = 'Error updating project: {0} - {1}'.format(
+            ', '.join(project_name), error)
+        reporter.error(u'{0}'.format(error), msg)
         sys.exit(1)
+    finally:
+        reporter.close()
 
 
 @click.command()
 @click.option('--job-id', help='Job id to monitor', required=True)
 @click.option('--output-format',
-              type=click.Choice(['ansi', 'txt']),
+              type=click.Choice(['ansi', 'txt', 'events']),
               default='ansi',
               help='output format')
-def cli_monitor(job_id, output_format):
+@click.option('--summary', type=click.Choice(['text', 'json']),
+              default=None,
+              help='print a summary of the recap and failed tasks at the end')
+@click.option('--log-file', help=LOG_FILE_HELP, default=None,
+              type=click.Path(dir_okay=False))
+@click.option('--host-logs', help=HOST_LOGS_HELP, default=None,
+              type=click.Path(file_okay=False))
+@json_option
+def cli_monitor(job_id, output_format, summary, log_file, host_logs,
+                json_output):
     """
     Monitor the execution of an ansible tower job
     """
+    reporter = make_reporter(json_output)
     try:
         # verify configuration
         config = Config(config_file())
-        guard = Guard(config)
+        guard = Guard(config, reporter=reporter)
         guard.monitor(job_url=guard.job_url(job_id),
-                      output_format=output_format)
+                      output_format=output_format,
+                      summary=summary,
+                      log_file=log_file,
+                      host_logs=host_logs)
     except GuardError as error:
         msg = 'Error monitoring job id: {0} - {1}'.format(job_id, error)
-        print(msg)
+        reporter.error(u'{0}'.format(error), msg)
         sys.exit(1)
+    finally:
+        reporter.close()
 
 
 @click.command()
@@ -150,30 +463,65 @@ def cli_monitor(job_id, output_format):
               multiple=True)
 @click.option('--limit', help='Limit to hosts', type=str, default='')
 @click.option('--output-format',
-              type=click.Choice(['ansi', 'txt']),
+              type=click.Choice(['ansi', 'txt', 'events']),
               default='ansi',
               help='output format')
-def cli_kick_and_monitor(template_name, extra_vars, output_format, limit):
+@click.option('--summary', type=click.Choice(['text', 'json']),
+              default=None,
+              help='print a summary of the recap and failed tasks at the end')
+@click.option('--slices', help='Split the inventory in N parallel jobs',
+              type=click.IntRange(min=1), default=1)
+@click.option('--refresh-inventory', help=REFRESH_HELP,
+              type=click.IntRange(min=0), default=None)
+@click.option('--dedupe', is_flag=True,
+              help='Monitor an identical pending/running job, if any, '
+                   'instead of starting a new one')
+@click.option('--profile', help=PROFILE_HELP, multiple=True)
+@click.option('--log-file', help=LOG_FILE_HELP, default=None,
+              type=click.Path(dir_okay=False))
+@json_option
+def cli_kick_and_monitor(template_name, extra_vars, output_format, limit,
+                         summary, slices, refresh_inventory, dedupe, profile,
+                         log_file, json_output):
     """
     Trigger an ansible tower job and monitor its execution.
     In case of error it returns a bad exit code.
     """
+    reporter = make_reporter(json_output)
     try:
-        config = Config(config_file())
-        guard = Guard(config)
         extra_v = {}
         for extra_var in extra_vars:
             extra_v.update(extra_var_to_dict(extra_var))
+        if len(profile) > 1:
+            if slices > 1 or refresh_inventory is not None or dedupe:
+                raise CLIError('--slices, --refresh-inventory and --dedupe '
+                               'cannot be used together with many profiles')
+            kick_and_monitor_profiles(profile_guards(profile, reporter),
+                                      template_name, extra_vars=extra_v,
+                                      limit=limit,
+                                      output_format=output_format,
+                                      summary=summary, log_file=log_file)
+            return
+        config = profile_config(profile[0] if profile else None)
+        guard = Guard(config, reporter=reporter)
         guard.kick_and_monitor(template_name=template_name,
                                limit=limit,
                                extra_vars=extra_v,
-                               output_format=output_format)
+                               output_format=output_format,
+                               summary=summary,
+                               slices=slices,
+                               refresh_ttl=refresh_inventory,
+                               dedupe=dedupe,
+                               log_file=log_file)
     except CLIError as error:
-        print(error)
+        reporter.error(u'{0}'.format(error))
         sys.exit(1)
     except GuardError as error:
-        print("Execution Error: {0}".format(error))
+        reporter.error(u'{0}'.format(error),
+                       "Execution Error: {0}".format(error))
         sys.exit(1)
+    finally:
+        reporter.close()
 
 
 @click.command()
@@ -186,16 +534,27 @@ def cli_kick_and_monitor(template_name, extra_vars, output_format, limit):
 @click.option('--limit', help='Limit to hosts', type=str, default='')
 @click.option('--become', help='Become root', is_flag=True)
 @click.option('--output-format',
-              type=click.Choice(['ansi', 'txt']),
+              type=click.Choice(['ansi', 'txt', 'events']),
               default='ansi',
               help='output format')
+@click.option('--summary', type=click.Choice(['text', 'json']),
+              default=None,
+              help='print a summary of the recap and failed tasks at the end')
+@click.option('--forks', help=FORKS_HELP, callback=forks_option)
+@click.option('--verbosity', help=VERBOSITY_HELP,
+              type=click.IntRange(0, 4), default=None)
+@click.option('--log-file', help=LOG_FILE_HELP, default=None,
+              type=click.Path(dir_okay=False))
+@json_option
 def cli_ad_hoc_and_monitor(inventory, machine_credential, module_name,
                            module_args, limit,
-                           become, output_format):
+                           become, output_format, summary, forks, verbosity,
+                           log_file, json_output):
     """
     Trigger an ansible tower ad hoc job and monitor its execution.
     In case of error it returns a bad exit code.
     """
+    reporter = make_reporter(json_output)
     try:
         adhoc = AdHoc()
         adhoc.inventory_id = inventory
@@ -204,12 +563,18 @@ def cli_ad_hoc_and_monitor(inventory, machine_credential, module_name,
         adhoc.module_args = module_args
         adhoc.limit = limit
         adhoc.become = become
+        adhoc.forks = forks
+        adhoc.verbosity = verbosity
         config = Config(config_file())
-        guard = Guard(config)
-        guard.ad_hoc_and_monitor(adhoc, output_format=output_format)
+        guard = Guard(config, reporter=reporter)
+        guard.ad_hoc_and_monitor(adhoc, output_format=output_format,
+                                 summary=summary, log_file=log_file)
     except GuardError as error:
-        print("Execution Error: {0}".format(error))
+        reporter.error(u'{0}'.format(error),
+                       "Execution Error: {0}".format(error))
         sys.exit(1)
+    finally:
+        reporter.close()
 
 
 @click.command()
@@ -219,12 +584,17 @@ def cli_ad_hoc_and_monitor(inventory, machine_credential, module_name,
 @click.option('--module-args', help='Arguments for the selected module', type=str, default='')
 @click.option('--limit', help='Limit to hosts', type=str, default='')
 @click.option('--become', help='Become root', is_flag=True)
+@click.option('--forks', help=FORKS_HELP, callback=forks_option)
+@click.option('--verbosity', help=VERBOSITY_HELP,
+              type=click.IntRange(0, 4), default=None)
+@json_option
 def cli_ad_hoc(inventory, machine_credential, module_name,
-               module_args, limit, become):
+               module_args, limit, become, forks, verbosity, json_output):
     """
     Trigger an ansible tower ad hoc job and monitor its execution.
     In case of error it returns a bad exit code.
     """
+    reporter = make_reporter(json_output)
     try:
         adhoc = AdHoc()
         adhoc.inventory_id = inventory
@@ -233,31 +603,320 @@ def cli_ad_hoc(inventory, machine_credential, module_name,
         adhoc.module_args = module_args
         adhoc.limit = limit
         adhoc.become = become
+        adhoc.forks = forks
+        adhoc.verbosity = verbosity
         config = Config(config_file())
-        guard = Guard(config)
+        guard = Guard(config, reporter=reporter)
         result = guard.ad_hoc(adhoc)
-        print('job url: {0}'.format(guard.job_url(result['id'])))
+        job_url = guard.job_url(result['id'])
+        reporter.launch(job_url, 'job url: {0}'.format(job_url))
     except GuardError as error:
-        print("Execution Error: {0}".format(error))
+        reporter.error(u'{0}'.format(error),
+                       "Execution Error: {0}".format(error))
         sys.exit(1)
+    finally:
+        reporter.close()
 
 @click.command()
 @click.option('--username', help='User to grant permissions', required=True)
 @click.option('--template-name', help='Template to grant permissions for',
               required=True)
-@click.option('--permission', type=click.Choice(['read', 'execute', 'admin']),
+@click.option('--permission', type=click.Choice(PERMISSIONS),
               help='Type of permission', default='read')
-def cli_template_permissions(username, template_name, permission):
+@json_option
+def cli_template_permissions(username, template_name, permission,
+                             json_output):
     """
     This sets the template permissions for a user
     """
+    reporter = make_reporter(json_output)
     try:
         config = Config(config_file())
-        guard = Guard(config)
+        guard = Guard(config, reporter=reporter)
         role_id = guard.get_role_id(template_name, permission)
         user_id = guard.get_user_id(username)
         guard.user_role(user_id, role_id)
-        print('User {0} successfully granted {1} permissions for template {2}'.format(username, permission, template_name))
+        msg = 'User {0} successfully granted {1} permissions for template {2}'
+        reporter.emit('result',
+                      msg.format(username, permission, template_name),
+                      user=username, template=template_name,
+                      permission=permission, status='granted')
     except GuardError as error:
-        print("Execution Error: {0}".format(error))
+        reporter.error(u'{0}'.format(error),
+                       "Execution Error: {0}".format(error))
+        sys.exit(1)
+    finally:
+        reporter.close()
+
+
+@click.command()
+@click.option('--spec', help='csv or yaml file with the grants',
+              required=True)
+@click.option('--max-parallel', help='Max number of concurrent requests',
+              type=click.IntRange(min=1), default=DEFAULT_WORKERS)
+@json_option
+def cli_bulk_template_permissions(spec, max_parallel, json_output):
+    """
+    This sets the template permissions for many users, roles that are
+    already granted are skipped
+    """
+    reporter = make_reporter(json_output)
+    try:
+        grants = grants_from_file(spec)
+        config = Config(config_file())
+        guard = Guard(config, reporter=reporter)
+        results = guard.grant_permissions(grants, workers=max_parallel)
+        headers = ('user', 'template', 'permission', 'status')
+        reporter.table(headers, results, format_table(headers, results))
+        if any(row[3].startswith('error') for row in results):
+            sys.exit(1)
+    except (CLIError, GuardError) as error:
+        reporter.error(u'{0}'.format(error),
+                       "Execution Error: {0}".format(error))
+        sys.exit(1)
+    finally:
+        reporter.close()
+
+
+@click.command()
+@click.option('--job-id', help='Job id to relaunch', required=True)
+@click.option('--monitor', help='Monitor the new job', is_flag=True)
+@click.option('--output-format',
+              type=click.Choice(['ansi', 'txt', 'events']),
+              default='ansi',
+              help='output format')
+@json_option
+def cli_relaunch_failed(job_id, monitor, output_format, json_output):
+    """
+    Relaunch the template of a job, with the same extra variables, only on the
+    hosts that failed or were unreachable
+    """
+    reporter = make_reporter(json_output)
+    try:
+        config = Config(config_file())
+        guard = Guard(config, reporter=reporter)
+        job, limit = guard.relaunch_failed(job_id)
+        job_url = guard.launch_data_to_url(job)
+        reporter.launch(job_url, 'Started job: {0} (limit: {1})'.format(
+            job_url, limit), limit=limit)
+        if monitor:
+            guard.monitor(job_url, output_format=output_format)
+    except GuardError as error:
+        msg = 'Error relaunching job id: {0} - {1}'.format(job_id, error)
+        reporter.error(u'{0}'.format(error), msg)
+        sys.exit(1)
+    finally:
+        reporter.close()
+
+
+@click.command()
+@click.option('--inventory', help='Inventory to run on (repeatable)',
+              required=True, multiple=True)
+@click.option('--machine-credential', help='SSH credentials name',
+              required=True)
+@click.option('--module-name', help='Ansible module to run', required=True)
+@click.option('--module-args', help='Arguments for the selected module',
+              type=str, default='')
+@click.option('--limit', help='Limit to hosts (repeatable)', type=str,
+              multiple=True)
+@click.option('--become', help='Become root', is_flag=True)
+@click.option('--max-parallel', help='Max number of concurrent jobs',
+              type=click.IntRange(min=1), default=DEFAULT_WORKERS)
+@click.option('--output-format',
+              type=click.Choice(['ansi', 'txt', 'events']),
+              default='ansi',
+              help='output format')
+@click.option('--forks', help=FORKS_HELP, callback=forks_option)
+@click.option('--verbosity', help=VERBOSITY_HELP,
+              type=click.IntRange(0, 4), default=None)
+@json_option
+def cli_ad_hoc_fan_out(inventory, machine_credential, module_name,
+                       module_args, limit, become, max_parallel,
+                       output_format, forks, verbosity, json_output):
+    """
+    Trigger the same ansible tower ad hoc job on many inventories and/or
+    limits, in parallel, and monitor their execution.
+    In case of error it returns a bad exit code.
+    """
+    reporter = make_reporter(json_output)
+    try:
+        adhoc = AdHoc()
+        adhoc.credential_id = machine_credential
+        adhoc.module_name = module_name
+        adhoc.module_args = module_args
+        adhoc.become = become
+        adhoc.forks = forks
+        adhoc.verbosity = verbosity
+        config = Config(config_file())
+        guard = Guard(config, reporter=reporter)
+        guard.ad_hoc_fan_out(adhoc, inventories=inventory, limits=limit,
+                             output_format=output_format,
+                             workers=max_parallel)
+    except GuardError as error:
+        reporter.error(u'{0}'.format(error),
+                       "Execution Error: {0}".format(error))
+        sys.exit(1)
+    finally:
+        reporter.close()
+
+
+@click.command()
+@click.option('--job-id', help='Job to archive (repeatable)', type=int,
+              multiple=True)
+@click.option('--filter', 'filters', multiple=True,
+              help='Archive the jobs matching field=value (repeatable), e.g. '
+                   'job_template__name=deploy')
+@click.option('--directory', help='Archive directory', default='.',
+              type=click.Path(file_okay=False))
+@click.option('--compress', help='gzip the outputs', is_flag=True)
+@click.option('--max-parallel', help='Max number of concurrent downloads',
+              type=click.IntRange(min=1), default=DEFAULT_WORKERS)
+@click.option('--host-logs', is_flag=True,
+              help='Split the outputs by host too, into job-<id>.hosts')
+@json_option
+def cli_archive(job_id, filters, directory, compress, max_parallel,
+                host_logs, json_output):
+    """
+    Download the output of many finished jobs, interrupted downloads are
+    resumed when archive runs again
+    """
+    reporter = make_reporter(json_output)
+    try:
+        filters = parse_filters(filters)
+        if not job_id and not filters:
+            raise CLIError('use --job-id and/or --filter')
+        config = Config(config_file())
+        guard = Guard(config, reporter=reporter)
+        results = guard.archive(job_ids=job_id, filters=filters,
+                                directory=directory, compress=compress,
+                                workers=max_parallel, host_logs=host_logs)
+        headers = ('job', 'status', 'bytes', 'path')
+        reporter.table(headers, results, format_table(
+            headers, [(job, status, '' if size is None else size,
+                       path or '')
+                      for job, status, size, path in results]))
+        if any(status.startswith('error') for _, status, _, _ in results):
+            sys.exit(1)
+    except (CLIError, GuardError) as error:
+        reporter.error(u'{0}'.format(error),
+                       "Execution Error: {0}".format(error))
+        sys.exit(1)
+    finally:
+        reporter.close()
+
+
+@click.command()
+@click.option('--pattern', help='Regular expression to search',
+              required=True)
+@click.option('--job-id', help='Job to search (repeatable), defaults to all '
+                               'the stored jobs', multiple=True)
+@click.option('--context', '-C', help='Lines of context around the matches',
+              type=click.IntRange(min=0), default=0)
+@click.option('--ignore-case', '-i', help='Case insensitive search',
+              is_flag=True)
+@click.option('--processes', help='Number of processes, defaults to the '
+                                  'number of cpus',
+              type=click.IntRange(min=1), default=None)
+@json_option
+def cli_grep_jobs(pattern, job_id, context, ignore_case, processes,
+                  json_output):
+    """
+    Search the outputs of the jobs in the output store, matching lines are
+    printed as job:line number:line. Exits with 1 when nothing matches
+    """
+    reporter = make_reporter(json_output)
+    try:
+        config = Config(config_file())
+        guard = Guard(config, reporter=reporter)
+        results = guard.grep(pattern, job_ids=job_id, context=context,
+                             ignore_case=ignore_case, processes=processes)
+        lines = []
+        for key, matches in results:
+            if context and lines:
+                lines.append('--')
+            for match in matches:
+                if match is None:
+                    lines.append('--')
+                    continue
+                number, line, matched = match
+                reporter.emit('match', job=key, line=number, text=line,
+                              match=matched)
+                separator = ':' if matched else '-'
+                lines.append(u'{0}{1}{2}{1}{3}'.format(key, separator,
+                                                       number, line))
+        if lines:
+            reporter.echo(u'\n'.join(lines))
+    except GuardError as error:
+        reporter.error(u'{0}'.format(error),
+                       "Execution Error: {0}".format(error))
+        sys.exit(1)
+    finally:
+        reporter.close()
+    sys.exit(0 if results else 1)
+
+
+@click.command()
+@click.option('--job-id', help='Job in the output store')
+@click.option('--file', 'filename', help='Output file, e.g. from archive',
+              type=click.Path(exists=True, dir_okay=False))
+@click.option('--head', help='Print the first N lines',
+              type=click.IntRange(min=0), default=None)
+@click.option('--tail', help='Print the last N lines (default: 10)',
+              type=click.IntRange(min=0), default=None)
+@click.option('--line', help='Print line N', type=click.IntRange(min=1),
+              default=None)
+@click.option('--range', 'line_range', help='Print lines first:last',
+              callback=line_range_option)
+@json_option
+def cli_view_output(job_id, filename, head, tail, line, line_range,
+                    json_output):
+    """
+    Print parts of a (huge) job output without reading all of it. The output
+    is memory mapped and its lines are indexed once
+    """
+    modes = [mode for mode in (head, tail, line, line_range)
+             if mode is not None]
+    reporter = make_reporter(json_output)
+    try:
+        if bool(job_id) == bool(filename):
+            raise CLIError('use either --job-id or --file')
+        if len(modes) > 1:
+            raise CLIError('use only one of --head, --tail, --line, --range')
+        if filename is None:
+            guard = Guard(Config(config_file()), reporter=reporter)
+            filename = guard.stored_output(job_id)
+        elif filename.endswith('.gz'):
+            raise CLIError('{0} is compressed, use --job-id with the '
+                           'output_store'.format(filename))
+        with IndexedOutput(filename, index_path(filename)) as output:
+            if head is not None:
+                first, last = 1, head
+            elif line is not None:
+                first, last = line, line
+            elif line_range is not None:
+                first, last = line_range
+                last = last or output.count
+            else:
+                last = output.count
+                first = last - (10 if tail is None else tail) + 1
+            text = output.lines(first, last)
+            if json_output:
+                # lines end with a new line, but the last one can miss it
+                text_lines = text.split(b'\n')
+                if text.endswith(b'\n') or not text:
+                    text_lines.pop()
+                for number, text_line in enumerate(text_lines, max(first, 1)):
+                    reporter.emit('line', line=number,
+                                  text=text_line.decode('utf-8', 'replace'))
+            else:
+                stdout = click.get_binary_stream('stdout')
+                stdout.write(text)
+                if text and not text.endswith(b'\n'):
+                    stdout.write(b'\n')
+                stdout.flush()
+    except (CLIError, GuardError, PagerError) as error:
+        reporter.error(u'{0}'.format(error),
+                       "Execution Error: {0}".format(error))
         sys.exit(1)
+    finally:
+        reporter.close()
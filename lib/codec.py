@@ -0,0 +1,222 @@
+"""
+JSON decoding of the api responses. Tower listings can be big, when a faster
+json library (orjson, ujson) is installed it's used instead of the standard
+library. Responses are decoded from their raw bytes, without building an
+intermediate unicode string.
+
+Big listings can be decoded as a stream too: iter_results yields the items of
+'results' one at a time, while the page is still being downloaded.
+"""
+from __future__ import absolute_import
+import json
+import re
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+def _stdlib_loads(data):
+    """
+    json.loads, python 3 < 3.6 does not accept bytes
+    """
+    if isinstance(data, bytes) and not isinstance(data, str):
+        data = data.decode('utf-8')
+    return json.loads(data)
+
+
+if orjson is not None:
+    BACKEND = 'orjson'
+    _loads = orjson.loads
+elif ujson is not None:
+    BACKEND = 'ujson'
+    _loads = ujson.loads
+else:
+    BACKEND = 'json'
+    _loads = _stdlib_loads
+
+# characters that matter when looking for the end of a value
+STRUCTURE = re.compile(br'[\[\]{}"]')
+STRING_END = re.compile(br'["\\]')
+SCALAR_END = re.compile(br'[,\]}\s]')
+SEPARATORS = re.compile(br'[\s,]*')
+
+
+def loads(data):
+    """
+    Decodes a json document
+
+    Args:
+        data (bytes|str): json document
+
+    Returns:
+        whatever data contains
+
+    Raises:
+        ValueError
+    """
+    return _loads(data)
+
+
+def decode_response(response):
+    """
+    Decodes the json body of a response, from its raw bytes
+
+    Args:
+        response (requests.Response): a response with a json body
+
+    Returns:
+        whatever the response contains
+
+    Raises:
+        ValueError
+    """
+    return _loads(response.content)
+
+
+def _string_end(buf, start):
+    """
+    Returns the index after the closing quote of the string starting at
+    start, None when the string is not complete yet
+    """
+    pos = start + 1
+    while True:
+        match = STRING_END.search(buf, pos)
+        if match is None:
+            return None
+        if match.group() == b'"':
+            return match.end()
+        # escaped character
+        pos = match.end() + 1
+
+
+def _value_end(buf, start, final):
+    """
+    Returns the index after the json value starting at start, None when the
+    value is not complete yet. Only the structure is checked, the value is
+    validated when it's decoded.
+    """
+    first = buf[start:start + 1]
+    if first == b'"':
+        return _string_end(buf, start)
+    if first not in (b'{', b'['):
+        match = SCALAR_END.search(buf, start)
+        if match is not None:
+            return match.start()
+        return len(buf) if final else None
+    depth = 0
+    pos = start
+    while True:
+        match = STRUCTURE.search(buf, pos)
+        if match is None:
+            return None
+        char = match.group()
+        pos = match.end()
+        if char == b'"':
+            pos = _string_end(buf, match.start())
+            if pos is None:
+                return None
+        elif char in (b'{', b'['):
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return pos
+
+
+class _Reader(object):
+    """
+    Bytes of a document read chunk by chunk, only the part that has not been
+    consumed yet is kept
+    """
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buf = b''
+        self.pos = 0
+        self.final = False
+
+    def more(self):
+        """
+        Reads the next chunk, drops what has been consumed
+        """
+        for chunk in self.chunks:
+            if chunk:
+                self.buf = self.buf[self.pos:] + chunk
+                self.pos = 0
+                return
+        if self.final:
+            raise ValueError('Unexpected end of json document')
+        self.final = True
+
+    def skip(self):
+        """
+        Skips white spaces and commas, returns the next character
+        """
+        while True:
+            self.pos = SEPARATORS.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos:self.pos + 1]
+            self.more()
+
+    def expect(self, char):
+        """
+        Consumes char
+        """
+        if self.skip() != char:
+            raise ValueError('Expecting {0!r} at {1!r}'.format(
+                char, self.buf[self.pos:self.pos + 20]))
+        self.pos += 1
+
+    def value(self):
+        """
+        Consumes and decodes the next value
+        """
+        self.skip()
+        while True:
+            end = _value_end(self.buf, self.pos, self.final)
+            if end is not None:
+                break
+            self.more()
+        value = _loads(self.buf[self.pos:end])
+        self.pos = end
+        return value
+
+
+def iter_results(chunks, page=None):
+    """
+    Decodes a tower listing as a stream: yields the items of 'results' as
+    soon as they are complete, at most an item and a chunk are in memory.
+    Stopping the iteration stops reading the chunks.
+
+    Args:
+        chunks (iterable): bytes of the json document, e.g.
+                           response.iter_content()
+        page (dict): if not None, receives the other members of the listing
+                     (count, next, previous)
+
+    Yields:
+        items of results
+
+    Raises:
+        ValueError
+    """
+    reader = _Reader(chunks)
+    reader.expect(b'{')
+    while reader.skip() != b'}':
+        key = reader.value()
+        reader.expect(b':')
+        if key != 'results':
+            value = reader.value()
+            if page is not None:
+                page[key] = value
+            continue
+        reader.expect(b'[')
+        while reader.skip() != b']':
+            yield reader.value()
+        reader.pos += 1
@@ -0,0 +1,175 @@
+"""
+Run things in parallel. Tower is happy to serve many requests at the same
+time, tower companion is happy to ask for them.
+"""
+from __future__ import absolute_import
+import threading
+
+# in python 3, Queue has been renamed queue
+try:
+    from Queue import Queue, Empty
+except ImportError:
+    # python 3
+    from queue import Queue, Empty
+
+# default number of threads used by parallel operations
+DEFAULT_WORKERS = 8
+
+
+def parallel_map(func, items, workers=DEFAULT_WORKERS):
+    """
+    Calls func on every item, using a pool of threads. Results are returned in
+    the same order of items. All the items are processed even when some of
+    the calls fail, then the first exception is raised again.
+
+    Args:
+        func (callable): function to call, it takes a single argument
+        items (iterable): arguments for func
+        workers (int): max number of concurrent calls
+
+    Returns:
+        (list): results of func
+
+    Raises:
+        whatever func raises
+    """
+    items = list(items)
+    if len(items) <= 1 or workers <= 1:
+        # no need to spawn threads
+        return [func(item) for item in items]
+
+    results = [None] * len(items)
+    errors = []
+    queue = Queue()
+    for index, item in enumerate(items):
+        queue.put((index, item))
+
+    def worker():
+        """
+        Consumes items from the queue until it is empty
+        """
+        while True:
+            try:
+                index, item = queue.get_nowait()
+            except Empty:
+                return
+            try:
+                results[index] = func(item)
+            except Exception as error:  # pylint: disable=broad-except
+                errors.append((index, error))
+
+    threads = [threading.Thread(target=worker)
+               for _ in range(min(workers, len(items)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        # raise the error of the first failing item
+        raise sorted(errors, key=lambda error: error[0])[0][1]
+    return results
+
+
+class AIMDLimiter(object):
+    """
+    Adaptive limit of concurrent requests. The limit grows by one every time
+    a full window of requests completes without trouble (additive increase)
+    and it is halved when a request fails because tower is overloaded or it
+    takes too long (multiplicative decrease). The requests already in flight
+    when the limit is decreased cannot decrease it again, so a burst of
+    errors counts as a single one.
+
+    Too long is relative to the usual latency of tower: the baseline is an
+    exponentially weighted moving average of the latency of the requests
+    that succeed, a request takes too long when its latency is more than
+    latency_factor times the baseline (and more than min_latency, fast
+    towers have a jittery baseline).
+    """
+    def __init__(self, initial=DEFAULT_WORKERS, minimum=1, maximum=64,
+                 latency_factor=3.0, min_latency=0.5, smoothing=0.1,
+                 decrease=0.5):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_factor = latency_factor
+        self.min_latency = min_latency
+        self.smoothing = smoothing
+        self.decrease = decrease
+        self.baseline = None
+        self.in_flight = 0
+        self.requests = 0
+        self.backoffs = 0
+        self._epoch = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """
+        Waits until a new request can start
+
+        Returns:
+            (int): a token, to pass to release()
+        """
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+            return self._epoch
+
+    def release(self, token, latency, overloaded=False):
+        """
+        A request is complete, update the limit
+
+        Args:
+            token (int): as returned by acquire()
+            latency (float): duration of the request, in seconds
+            overloaded (bool): the request failed because of tower (5xx, 429,
+                               connection errors)
+        """
+        with self._condition:
+            self.in_flight -= 1
+            self.requests += 1
+            if overloaded or self._slow(latency):
+                if token == self._epoch:
+                    self._epoch += 1
+                    self.backoffs += 1
+                    self.limit = max(self.minimum, self.limit * self.decrease)
+            else:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            if not overloaded:
+                # slow requests move the baseline too, a tower that is slower
+                # for good is not overloaded forever
+                if self.baseline is None:
+                    self.baseline = latency
+                else:
+                    self.baseline += self.smoothing * (latency - self.baseline)
+            self._condition.notify_all()
+
+    def _slow(self, latency):
+        """
+        Tells if a request took too long, compared with the baseline. The
+        lock must be held
+        """
+        if self.baseline is None:
+            return False
+        return latency > max(self.min_latency,
+                             self.latency_factor * self.baseline)
+
+    def snapshot(self):
+        """
+        Returns the current state of the limiter, for instrumentation
+
+        Returns:
+            (dict): limit, in_flight, requests, backoffs and baseline
+                    latency (None before the first request)
+        """
+        with self._condition:
+            baseline = self.baseline
+            if baseline is not None:
+                baseline = round(baseline, 3)
+            return {'limit': int(self.limit),
+                    'in_flight': self.in_flight,
+                    'requests': self.requests,
+                    'backoffs': self.backoffs,
+                    'baseline': baseline}
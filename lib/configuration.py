@@ -12,6 +12,9 @@ except ImportError:
     # python 3
     from configparser import ConfigParser, NoOptionError, DuplicateSectionError
 
+# profiles live in [profile <name>] sections
+PROFILE_PREFIX = 'profile '
+
 
 class ConfigError(Exception):
     """
@@ -24,13 +27,21 @@ class Config(object):
     """
     Manages your configuration
     """
-    def __init__(self, config_file):
+    def __init__(self, config_file, profile=None):
         configparser = ConfigParser()
         if config_file:
             configparser.read(config_file)
         self.config_file = config_file
         self.configparser = configparser
         self._add_general_section()
+        # options of the profile take precedence over the 'general' ones
+        self.profile = profile
+        self.section = 'general'
+        if profile:
+            self.section = PROFILE_PREFIX + profile
+            if not configparser.has_section(self.section):
+                msg = "No such profile: {0}".format(profile)
+                raise ConfigError(msg)
         # now the configuration is initialized with the content of the
         # configuration file. Next step is to read the environment and check
         # if there are any values provided by th
@@ -60,7 +71,7 @@ class Config(object):
         """
         config = self.configparser
         try:
-            return config.get('general', option)
+            return config.get(self._section_of(option), option)
         except NoOptionError as error:
             raise ConfigError(error)
 
@@ -80,7 +91,7 @@ class Config(object):
         """
         config = self.configparser
         try:
-            return config.getboolean('general', option)
+            return config.getboolean(self._section_of(option), option)
         except (NoOptionError, ValueError) as error:
             raise ConfigError(error)
 
@@ -89,12 +100,32 @@ class Config(object):
         Checks whatever config has 'option'
         """
         config = self.configparser
-        return config.has_option('general', option)
+        return config.has_option(self._section_of(option), option)
+
+    def _section_of(self, option):
+        """
+        Returns the section to read option from: the profile section, if it
+        defines option, 'general' otherwise
+        """
+        if self.configparser.has_option(self.section, option):
+            return self.section
+        return 'general'
+
+    def profiles(self):
+        """
+        Returns the names of the profiles defined in the configuration
+
+        Returns:
+            (list): sorted profile names
+        """
+        return sorted(section[len(PROFILE_PREFIX):]
+                      for section in self.configparser.sections()
+                      if section.startswith(PROFILE_PREFIX))
 
     def update(self, option, value):
         """
-        Updates a configuration value
-        section is hardcoded to 'general'
+        Updates a configuration value, in the section of the profile or in
+        'general' when there is no profile
         Params:
             option (str): option you want to value from in memory configuration
 
@@ -109,7 +140,7 @@ class Config(object):
             raise ConfigError(msg)
 
         config = self.configparser
-        config.set(section='general', option=option, value=value)
+        config.set(section=self.section, option=option, value=value)
 
     def write(self):
         """
@@ -134,8 +165,10 @@ class Config(object):
     def _update_from_env(self, env_variable, option):
         """
         Gets configuration from the current environment, values set in the
-        environment take precedence on the one configured in the standard
-        configuration file.
+        environment take precedence on the one configured in the 'general'
+        section of the configuration file. They go to 'general', not to the
+        profile: TC_HOST must not send every profile to the same tower, the
+        options of a profile still take precedence.
 
         Params:
             env_variable (str): name of the environmental variable to use
@@ -144,7 +177,8 @@ class Config(object):
         """
         value = os.environ.get(env_variable)
         if value:
-            self.update(option=option, value=value)
+            self.configparser.set(section='general', option=option,
+                                  value=value)
 
     def _reckless_mode(self):
         """
@@ -157,7 +191,8 @@ class Config(object):
         """
         config = self.configparser
         try:
-            if config.getboolean('general', 'reckless_mode'):
+            if config.getboolean(self._section_of('reckless_mode'),
+                                 'reckless_mode'):
                 # look reckless mode!
                 urllib3.disable_warnings()
         except NoOptionError:
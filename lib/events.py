@@ -0,0 +1,52 @@
+"""
+Job events helpers. Tower records every task of every host as an event, this
+module turns those events into small, machine readable records.
+"""
+from __future__ import absolute_import
+
+
+def event_host(event):
+    """
+    Returns the host name of an event or None for events that are not related
+    to a host (playbook_on_start, playbook_on_stats, ...)
+
+    Args:
+        event (dict): event as returned by the job_events endpoint
+
+    Returns:
+        (str|None): host name
+    """
+    host = event.get('host_name')
+    if host:
+        return host
+    summary = event.get('summary_fields') or {}
+    return (summary.get('host') or {}).get('name')
+
+
+def event_record(event):
+    """
+    Transforms a raw tower event into a flat dictionary, ready to be dumped as
+    json
+
+    Args:
+        event (dict): event as returned by the job_events endpoint
+
+    Returns:
+        (dict)
+    """
+    event_data = event.get('event_data') or {}
+    result = event_data.get('res')
+    msg = None
+    if isinstance(result, dict):
+        msg = result.get('msg')
+    return {'id': event.get('id'),
+            'counter': event.get('counter'),
+            'created': event.get('created'),
+            'event': event.get('event'),
+            'play': event.get('play') or event_data.get('play'),
+            'task': event.get('task') or event_data.get('task'),
+            'role': event.get('role') or event_data.get('role'),
+            'host': event_host(event),
+            'failed': bool(event.get('failed')),
+            'changed': bool(event.get('changed')),
+            'msg': msg}
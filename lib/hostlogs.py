@@ -0,0 +1,269 @@
+"""
+Job output split by host. The output of a job running on many hosts
+interleaves all of them; the job events know the host of every line, so the
+output of each host is written to its own file, as the events arrive, and an
+index records the final state of every host.
+
+    <directory>/<host>.log
+    <directory>/index.json
+
+The index maps every host to its log file, its number of events, changed
+and failed tasks and its state: ok, failed or unreachable. The state is
+unknown until the host fails or the recap of the playbook (the stats event)
+gives it: a job canceled before the recap leaves the hosts that did not fail
+unknown.
+
+Lines are buffered per host and written in batches, when the buffers hold
+BUFFER_SIZE bytes: a job on thousands of hosts interleaves them, a write per
+event would close and reopen a file per event. Only a bounded number of host
+files is open at the same time, the least recently written one is closed
+(and reopened for appending when needed).
+"""
+from __future__ import absolute_import
+import io
+import json
+import os
+import re
+import tempfile
+from collections import OrderedDict
+from .events import event_host, event_record
+from .utils import strip_ansi
+
+# max number of host files open at the same time
+MAX_OPEN_FILES = 64
+# bytes of output buffered before the host files are written
+BUFFER_SIZE = 1024 * 1024
+INDEX_NAME = 'index.json'
+HOSTS_SUFFIX = '.hosts'
+# characters allowed in the file name of a host
+UNSAFE = re.compile(r'[^A-Za-z0-9._-]')
+FAILED_EVENTS = ('runner_on_failed', 'runner_on_unreachable')
+
+
+class HostLogsError(Exception):
+    """
+    The host logs cannot be written
+    """
+    pass
+
+
+def host_logs_path(directory, job_id):
+    """
+    Returns the directory of the host logs of an archived job
+
+    Args:
+        directory (str): archive directory
+        job_id (int): id of the job
+    Returns:
+        (str)
+    """
+    return os.path.join(directory, 'job-{0}{1}'.format(job_id, HOSTS_SUFFIX))
+
+
+def host_file_name(host):
+    """
+    Returns the file name of a host log, unsafe characters become _
+    """
+    name = UNSAFE.sub('_', host).lstrip('.') or '_'
+    return '{0}.log'.format(name)
+
+
+class HostLogs(object):
+    """
+    Writes the events of a job to one file per host, see write()
+    """
+    def __init__(self, directory, job_url=None, max_open=MAX_OPEN_FILES,
+                 buffer_size=BUFFER_SIZE):
+        self.directory = directory
+        self.job_url = job_url
+        self.max_open = max_open
+        self.buffer_size = buffer_size
+        # host -> summary, the content of the index
+        self.hosts = {}
+        # host -> lines not written yet, in order of first write
+        self._buffers = OrderedDict()
+        self._buffered = 0
+        # host -> open file, least recently written first
+        self._files = OrderedDict()
+        # host -> last task written to its file
+        self._tasks = {}
+        # hosts whose file has been opened, reopened files are appended to
+        self._opened = set()
+        self._names = set()
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+        except OSError as error:
+            raise HostLogsError('cannot create {0}: {1}'.format(directory,
+                                                                error))
+
+    def _file(self, host):
+        """
+        Returns the open file of a host, files are truncated the first time
+        they are opened and appended to when they are reopened
+        """
+        host_file = self._files.pop(host, None)
+        if host_file is None:
+            if len(self._files) >= self.max_open:
+                _, oldest = self._files.popitem(last=False)
+                oldest.close()
+            mode = 'a' if host in self._opened else 'w'
+            host_file = io.open(os.path.join(self.directory,
+                                             self.hosts[host]['file']),
+                                mode, encoding='utf-8')
+            self._opened.add(host)
+        # most recently written last
+        self._files[host] = host_file
+        return host_file
+
+    def _add_host(self, host, with_file=True):
+        """
+        Starts the summary of a new host, hosts with the same safe name get
+        a numbered file
+        """
+        name = None
+        if with_file:
+            name = host_file_name(host)
+            number = 1
+            while name in self._names:
+                number += 1
+                name = host_file_name('{0}-{1}'.format(host, number))
+            self._names.add(name)
+        self.hosts[host] = {'file': name, 'events': 0, 'changed': 0,
+                            'failed': 0, 'state': 'unknown'}
+
+    def write(self, event):
+        """
+        Appends the output of an event to the log of its host and updates
+        the state of the host. Events not related to a host are ignored,
+        except playbook_on_stats: its counters give the final states.
+
+        Args:
+            event (dict): raw tower event
+        Raises:
+            HostLogsError
+        """
+        if event.get('event') == 'playbook_on_stats':
+            self._stats(event.get('event_data') or {})
+            return
+        host = event_host(event)
+        if host is None:
+            return
+        if host not in self.hosts:
+            self._add_host(host)
+        summary = self.hosts[host]
+        record = event_record(event)
+        lines = []
+        if record['task'] and record['task'] != self._tasks.get(host):
+            self._tasks[host] = record['task']
+            lines.append(u'TASK [{0}]'.format(record['task']))
+        if 'stdout' in event:
+            stdout = strip_ansi(event['stdout'] or u'').strip('\r\n')
+            if stdout:
+                lines.append(stdout)
+        else:
+            # old towers, no stdout in the events
+            lines.append(json.dumps(record, sort_keys=True))
+        if lines:
+            text = u'\n'.join(lines) + u'\n'
+            self._buffers.setdefault(host, []).append(text)
+            self._buffered += len(text)
+            if self._buffered >= self.buffer_size:
+                self.flush()
+        summary['events'] += 1
+        if record['changed']:
+            summary['changed'] += 1
+        event_data = event.get('event_data') or {}
+        if record['event'] in FAILED_EVENTS and \
+                not event_data.get('ignore_errors'):
+            summary['failed'] += 1
+            summary['state'] = ('unreachable' if
+                                record['event'] == 'runner_on_unreachable'
+                                else 'failed')
+
+    def _stats(self, event_data):
+        """
+        The recap of the playbook, final state of every host
+        """
+        failures = event_data.get('failures') or {}
+        dark = event_data.get('dark') or {}
+        for stat in ('ok', 'changed', 'failures', 'dark', 'skipped'):
+            for host in event_data.get(stat) or {}:
+                if host not in self.hosts:
+                    # a host without output
+                    self._add_host(host, with_file=False)
+                summary = self.hosts[host]
+                if dark.get(host):
+                    summary['state'] = 'unreachable'
+                elif failures.get(host):
+                    summary['state'] = 'failed'
+                else:
+                    summary['state'] = 'ok'
+
+    def flush(self):
+        """
+        Writes the buffered lines, a single write per host
+
+        Raises:
+            HostLogsError
+        """
+        while self._buffers:
+            host, texts = self._buffers.popitem(last=False)
+            self._buffered -= sum(len(text) for text in texts)
+            try:
+                self._file(host).write(u''.join(texts))
+            except (IOError, OSError) as error:
+                raise HostLogsError('cannot write the log of {0}: {1}'.format(
+                    host, error))
+
+    def close(self):
+        """
+        Writes what is still buffered, if it can, and closes the host files.
+        It's called when something went wrong too, write errors are ignored,
+        finish() reports them
+        """
+        try:
+            self.flush()
+        except HostLogsError:
+            self._buffers.clear()
+            self._buffered = 0
+        while self._files:
+            _, host_file = self._files.popitem()
+            host_file.close()
+
+    def finish(self):
+        """
+        All the events have been written: writes the buffered lines, closes
+        the host files and writes the index, replaced atomically
+
+        Raises:
+            HostLogsError
+        """
+        try:
+            self.flush()
+        finally:
+            self.close()
+        index = {'job': self.job_url, 'hosts': self.hosts}
+        try:
+            handle, tmp_path = tempfile.mkstemp(dir=self.directory)
+            with os.fdopen(handle, 'w') as index_out:
+                json.dump(index, index_out, sort_keys=True, indent=1)
+            os.rename(tmp_path, os.path.join(self.directory, INDEX_NAME))
+        except (IOError, OSError) as error:
+            raise HostLogsError('cannot write the host index: {0}'.format(
+                error))
+
+
+def read_index(directory):
+    """
+    Returns the index of the host logs in directory, None if there's none
+    (the split is not complete)
+
+    Returns:
+        (dict|None): job url and host -> summary
+    """
+    try:
+        with open(os.path.join(directory, INDEX_NAME), 'r') as index_in:
+            return json.load(index_in)
+    except (IOError, OSError, ValueError):
+        return None
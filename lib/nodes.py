@@ -0,0 +1,127 @@
+"""
+Tower clusters have many nodes, any of them can serve api requests. Instead of
+sending everything through a (slow) load balancer, tower companion can talk to
+the nodes directly: the nodes are probed with the ping endpoint, requests go
+to the fastest ones and a node that does not answer is left alone for a while.
+"""
+from __future__ import absolute_import
+import itertools
+import threading
+import time
+from .concurrency import parallel_map
+
+# a node is considered as fast as the best one if its ping is within this
+# factor, requests are spread over all the fast nodes
+LATENCY_SPREAD = 1.5
+# seconds before probing again the nodes
+PROBE_INTERVAL = 60.0
+# seconds before trying again a node that failed
+RETRY_INTERVAL = 30.0
+
+
+class NodeError(Exception):
+    """
+    No node available
+    """
+    pass
+
+
+class NodePool(object):
+    """
+    Picks the node for the next request. probe is a function taking a host
+    name and returning its ping time in seconds, it raises an exception when
+    the node is not healthy.
+    """
+    def __init__(self, hosts, probe, clock=time.time):
+        self.hosts = list(hosts)
+        self.probe = probe
+        self.clock = clock
+        self.latencies = {}
+        self.failures = {}
+        self._probed_at = None
+        self._cycle = itertools.count()
+        self._lock = threading.Lock()
+
+    def probe_all(self):
+        """
+        Pings all the nodes in parallel, records their latency
+        """
+        def ping(host):
+            """
+            Returns the latency of host, None if it's not healthy
+            """
+            try:
+                return self.probe(host)
+            except Exception:  # pylint: disable=broad-except
+                return None
+
+        latencies = parallel_map(ping, self.hosts)
+        now = self.clock()
+        with self._lock:
+            self._probed_at = now
+            for host, latency in zip(self.hosts, latencies):
+                if latency is None:
+                    self.failures[host] = now
+                    self.latencies.pop(host, None)
+                else:
+                    self.failures.pop(host, None)
+                    self.latencies[host] = latency
+
+    def healthy(self):
+        """
+        Returns the healthy nodes, fastest first. Nodes that failed more than
+        RETRY_INTERVAL seconds ago are healthy again
+
+        Returns:
+            (list): host names
+        """
+        now = self.clock()
+        with self._lock:
+            hosts = [host for host in self.hosts
+                     if now - self.failures.get(host, now - RETRY_INTERVAL)
+                     >= RETRY_INTERVAL]
+            worst = max(self.latencies.values() or [0.0])
+            return sorted(hosts,
+                          key=lambda host: self.latencies.get(host, worst))
+
+    def pick(self, exclude=()):
+        """
+        Returns the node for the next request: one of the healthy nodes whose
+        latency is close to the best one, in turn
+
+        Args:
+            exclude (iterable): nodes not to use, e.g. already failed for the
+                                current request
+        Returns:
+            (str): host name
+        Raises:
+            NodeError
+        """
+        if len(self.hosts) == 1:
+            return self.hosts[0]
+        now = self.clock()
+        with self._lock:
+            due = self._probed_at is None or \
+                now - self._probed_at >= PROBE_INTERVAL
+            if due:
+                # other threads keep going with the current latencies
+                self._probed_at = now
+        if due:
+            self.probe_all()
+        hosts = [host for host in self.healthy() if host not in exclude]
+        if not hosts:
+            raise NodeError('no tower node available')
+        best = self.latencies.get(hosts[0])
+        if best is not None:
+            hosts = [host for host in hosts
+                     if self.latencies.get(host, best) <=
+                     best * LATENCY_SPREAD]
+        return hosts[next(self._cycle) % len(hosts)]
+
+    def failed(self, host):
+        """
+        A request to host failed because the node is not reachable
+        """
+        with self._lock:
+            self.failures[host] = self.clock()
+            self.latencies.pop(host, None)
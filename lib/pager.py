@@ -0,0 +1,170 @@
+"""
+Random access to the lines of huge outputs. The output is memory mapped and
+the offsets of its lines are saved in an index file, built with a single pass
+over the output; the index is memory mapped too, so jumping to a line, head,
+tail and ranges cost the same on a 1KB and on a 1GB output.
+
+Index file: MAGIC, size and mtime of the output, number of lines, then the
+offset of every line plus the size of the output, little endian uint64.
+"""
+from __future__ import absolute_import
+import mmap
+import os
+import re
+import struct
+import tempfile
+
+MAGIC = b'TCIDX1\n\x00'
+HEADER = struct.Struct('<QQQ')
+OFFSET = struct.Struct('<Q')
+# offsets written at a time while building the index
+BATCH_SIZE = 64 * 1024
+NEWLINE = re.compile(b'\n')
+
+
+class PagerError(Exception):
+    """
+    The output cannot be read
+    """
+    pass
+
+
+def _stat(path):
+    """
+    Returns size and mtime of a file, the index is valid only for them
+    """
+    stat = os.stat(path)
+    return stat.st_size, int(stat.st_mtime * 1000000)
+
+
+def build_index(data, index_path, size, mtime):
+    """
+    Writes the line index of data, in a single pass
+
+    Args:
+        data (mmap|bytes): the output
+        index_path (str): index file, replaced atomically
+        size (int): size of the output
+        mtime (int): modification time of the output, microseconds
+    """
+    directory = os.path.dirname(index_path) or '.'
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    handle, tmp_path = tempfile.mkstemp(dir=directory)
+    try:
+        with os.fdopen(handle, 'wb') as index_out:
+            # the number of lines is known at the end
+            index_out.write(MAGIC + HEADER.pack(size, mtime, 0))
+            batch = [0] if size else []
+            count = 0
+            for match in NEWLINE.finditer(data):
+                if match.end() < size:
+                    batch.append(match.end())
+                if len(batch) >= BATCH_SIZE:
+                    index_out.write(struct.pack('<{0}Q'.format(len(batch)),
+                                                *batch))
+                    count += len(batch)
+                    batch = []
+            batch.append(size)
+            index_out.write(struct.pack('<{0}Q'.format(len(batch)), *batch))
+            count += len(batch) - 1
+            index_out.seek(len(MAGIC))
+            index_out.write(HEADER.pack(size, mtime, count))
+        os.rename(tmp_path, index_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class IndexedOutput(object):
+    """
+    A memory mapped output with its line index. Lines are numbered from 1,
+    they keep their trailing new line.
+    """
+    def __init__(self, path, index_path):
+        self.path = path
+        self.index_path = index_path
+        self._files = []
+        try:
+            size, mtime = _stat(path)
+            self.data = self._map(path, size)
+            if not self._index_is_valid(size, mtime):
+                build_index(self.data, index_path, size, mtime)
+            self.index = self._map(index_path, os.path.getsize(index_path))
+        except (IOError, OSError, ValueError) as error:
+            self.close()
+            raise PagerError('cannot read {0}: {1}'.format(path, error))
+        self.size = size
+        self.count = HEADER.unpack_from(self.index, len(MAGIC))[2]
+
+    def _map(self, path, size):
+        """
+        Memory maps a file, read only. Empty files cannot be mapped, they
+        are just empty
+        """
+        if not size:
+            return b''
+        file_in = open(path, 'rb')
+        self._files.append(file_in)
+        return mmap.mmap(file_in.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _index_is_valid(self, size, mtime):
+        """
+        True if the index has been built for this version of the output
+        """
+        try:
+            with open(self.index_path, 'rb') as index_in:
+                header = index_in.read(len(MAGIC) + HEADER.size)
+        except (IOError, OSError):
+            return False
+        if len(header) < len(MAGIC) + HEADER.size or \
+                not header.startswith(MAGIC):
+            return False
+        indexed_size, indexed_mtime, count = HEADER.unpack_from(header,
+                                                                len(MAGIC))
+        expected = len(MAGIC) + HEADER.size + (count + 1) * OFFSET.size
+        return (indexed_size, indexed_mtime) == (size, mtime) and \
+            os.path.getsize(self.index_path) == expected
+
+    def offset(self, number):
+        """
+        Returns the offset of a line, number can be count + 1: the end of
+        the output
+        """
+        position = len(MAGIC) + HEADER.size + (number - 1) * OFFSET.size
+        return OFFSET.unpack_from(self.index, position)[0]
+
+    def lines(self, first, last):
+        """
+        Returns the lines from first to last, included, as a single slice of
+        the output. Numbers out of the output are clipped.
+
+        Args:
+            first (int): first line, from 1
+            last (int): last line
+        Returns:
+            (bytes)
+        """
+        first = max(first, 1)
+        last = min(last, self.count)
+        if first > last:
+            return b''
+        return self.data[self.offset(first):self.offset(last + 1)]
+
+    def close(self):
+        """
+        Unmaps the output and its index
+        """
+        for name in ('data', 'index'):
+            mapped = getattr(self, name, None)
+            if isinstance(mapped, mmap.mmap):
+                mapped.close()
+        for file_in in self._files:
+            file_in.close()
+        self._files = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
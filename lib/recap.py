@@ -0,0 +1,233 @@
+"""
+Streaming parser for ansible output. It reads the job output chunk by chunk,
+as monitor receives it, and extracts the PLAY RECAP counters and the failed
+tasks without keeping the whole output in memory.
+"""
+from __future__ import absolute_import
+import json
+import re
+from .events import event_host
+from .utils import strip_ansi
+
+# TASK [name] *****
+TASK_LINE = re.compile(r'^TASK \[(?P<task>.*)\]')
+# fatal: [host]: FAILED! => ... / failed: [host] (item=...) => ...
+FAILED_LINE = re.compile(r'^(?:fatal|failed): \[(?P<host>[^\]]+)\]')
+# ok: [host], changed: [host], skipping: [host], ...
+RESULT_LINE = re.compile(r'^(?:ok|changed|skipping|included|fatal|failed|'
+                         r'\.\.\.ignoring)[:\s]')
+# host : ok=2 changed=1 unreachable=0 failed=0
+RECAP_LINE = re.compile(r'^(?P<host>\S+?)\s*:\s*(?P<counters>ok=.*)$')
+COUNTER = re.compile(r'(\w+)=(\d+)')
+# recap counters and their name in the playbook_on_stats event
+STATS_COUNTERS = (('ok', 'ok'), ('changed', 'changed'),
+                  ('unreachable', 'dark'), ('failed', 'failures'),
+                  ('skipped', 'skipped'))
+
+
+class RecapParser(object):
+    """
+    Incremental state machine over the output of a job. Feed it with chunks
+    of output, when the job is over, ask for the summary.
+
+    Memory usage does not depend on the size of the output: only the current
+    line, the recap counters and a limited number of failed task blocks are
+    kept around.
+    """
+    OUTPUT = 'output'
+    FAILURE = 'failure'
+    RECAP = 'recap'
+    MAX_LINE_LENGTH = 4096
+    MAX_BLOCK_LINES = 20
+    MAX_BLOCKS = 50
+
+    def __init__(self):
+        self.state = self.OUTPUT
+        self.task = None
+        self.hosts = {}
+        self.failures = []
+        self.dropped_failures = 0
+        self._partial = u''
+        self._block = None
+
+    def feed(self, chunk):
+        """
+        Process a new chunk of output. Chunks do not need to be aligned to
+        lines, an incomplete line is kept until the next chunk arrives.
+
+        Args:
+            chunk (str): output, ansi or plain text
+        """
+        lines = (self._partial + chunk).split('\n')
+        self._partial = lines.pop()[:self.MAX_LINE_LENGTH]
+        for line in lines:
+            self._line(line)
+
+    def close(self):
+        """
+        No more output, process what is left in the buffer
+        """
+        if self._partial:
+            self._line(self._partial)
+            self._partial = u''
+        self._end_block()
+
+    def feed_event(self, event):
+        """
+        Process a raw job event, as returned by the job_events endpoint. This
+        is the counterpart of feed() for monitors following the job events:
+        playbook_on_stats carries the recap counters, failed and unreachable
+        runner events the failed tasks.
+
+        Args:
+            event (dict): raw tower event
+        """
+        event_data = event.get('event_data') or {}
+        name = event.get('event')
+        if name == 'playbook_on_stats':
+            for key, stat in STATS_COUNTERS:
+                for host, value in (event_data.get(stat) or {}).items():
+                    counters = self.hosts.setdefault(host, {})
+                    counters[key] = int(value)
+            for counters in self.hosts.values():
+                for key, _ in STATS_COUNTERS:
+                    counters.setdefault(key, 0)
+            return
+        if name in ('runner_on_failed', 'runner_on_unreachable') and \
+                not event_data.get('ignore_errors'):
+            result = event_data.get('res')
+            if isinstance(result, dict):
+                result = result.get('msg') or json.dumps(result,
+                                                          sort_keys=True)
+            line = u'{0}: {1}'.format(name, result)[:self.MAX_LINE_LENGTH]
+            self.task = event.get('task') or event_data.get('task')
+            self._start_block(event_host(event), line)
+            self._end_block()
+
+    def _line(self, line):
+        """
+        Moves the state machine by one line
+        """
+        line = strip_ansi(line[:self.MAX_LINE_LENGTH]).rstrip()
+        if line.startswith('PLAY RECAP'):
+            self._end_block()
+            self.state = self.RECAP
+            return
+
+        if self.state == self.RECAP:
+            match = RECAP_LINE.match(line)
+            if match:
+                counters = dict((key, int(value)) for key, value in
+                                COUNTER.findall(match.group('counters')))
+                self.hosts[match.group('host')] = counters
+                return
+            if not line:
+                return
+            # something else than a recap, a new playbook is starting
+            self.state = self.OUTPUT
+
+        match = TASK_LINE.match(line)
+        if match:
+            self._end_block()
+            self.task = match.group('task')
+            return
+
+        match = FAILED_LINE.match(line)
+        if match:
+            self._end_block()
+            self._start_block(match.group('host'), line)
+            return
+
+        if self.state == self.FAILURE:
+            if not line or RESULT_LINE.match(line) or line.startswith('PLAY'):
+                self._end_block()
+            elif len(self._block['lines']) < self.MAX_BLOCK_LINES:
+                self._block['lines'].append(line)
+
+    def _start_block(self, host, line):
+        """
+        A task failed, start collecting its output
+        """
+        self.state = self.FAILURE
+        self._block = {'host': host, 'task': self.task, 'lines': [line]}
+
+    def _end_block(self):
+        """
+        Stores the current failed task block, if any
+        """
+        if self._block is not None:
+            if len(self.failures) < self.MAX_BLOCKS:
+                self.failures.append(self._block)
+            else:
+                self.dropped_failures += 1
+            self._block = None
+        if self.state == self.FAILURE:
+            self.state = self.OUTPUT
+
+    def merge(self, other):
+        """
+        Adds the results collected by another parser, e.g. the parser of
+        another slice of the same job
+
+        Args:
+            other (RecapParser): a closed parser
+        """
+        self.hosts.update(other.hosts)
+        room = self.MAX_BLOCKS - len(self.failures)
+        self.failures.extend(other.failures[:room])
+        self.dropped_failures += (other.dropped_failures +
+                                  max(0, len(other.failures) - room))
+
+    def failed_hosts(self):
+        """
+        Returns the hosts reported as failed or unreachable in the recap
+
+        Returns:
+            (list): sorted list of host names
+        """
+        return sorted(host for host, counters in self.hosts.items()
+                      if counters.get('failed') or counters.get('unreachable'))
+
+    def summary(self):
+        """
+        Returns the summary of the parsed output
+
+        Returns:
+            (dict)
+        """
+        return {'hosts': self.hosts,
+                'failed_hosts': self.failed_hosts(),
+                'failures': self.failures,
+                'dropped_failures': self.dropped_failures}
+
+    def to_json(self):
+        """
+        Returns the summary as a json string
+        """
+        return json.dumps(self.summary(), sort_keys=True)
+
+    def to_text(self):
+        """
+        Returns a compact, human readable, summary
+        """
+        totals = {}
+        for counters in self.hosts.values():
+            for key in ('ok', 'changed', 'unreachable', 'failed'):
+                totals[key] = totals.get(key, 0) + counters.get(key, 0)
+        lines = ['SUMMARY: {0} hosts, ok={1} changed={2} unreachable={3} '
+                 'failed={4}'.format(len(self.hosts), totals.get('ok', 0),
+                                     totals.get('changed', 0),
+                                     totals.get('unreachable', 0),
+                                     totals.get('failed', 0))]
+        failed_hosts = self.failed_hosts()
+        if failed_hosts:
+            lines.append('failed hosts: {0}'.format(', '.join(failed_hosts)))
+        for block in self.failures:
+            lines.append('')
+            lines.append('TASK [{0}] on {1}'.format(block['task'],
+                                                    block['host']))
+            lines.extend(block['lines'])
+        if self.dropped_failures:
+            lines.append('... and {0} more failed tasks'.format(
+                self.dropped_failures))
+        return '\n'.join(lines)
@@ -0,0 +1,236 @@
+"""
+What the commands tell their users. Reporter prints human readable text,
+JSONReporter writes newline delimited json records (--json) for the tools
+driving tower companion.
+
+Every json record has a type and a time (unix time, in seconds); the other
+fields depend on the type:
+
+    launch   job, label, limit, project: a job (or update) has been started
+    attach   job: an identical job is already running, it's monitored
+    status   job, label, status, project: the status of a job changed
+    output   job, label, text: new output of a job
+    event    job, label, event: a job event (--output-format events)
+    summary  summary: the summary of the recap (--summary)
+    timing   name, seconds, job, concurrency: how long something took; the
+             command record (the last one) has the state of the adaptive
+             request limiter of every tower, host -> limit, in_flight,
+             requests, backoffs and baseline (latency)
+    result   one record per row of the final tables, columns are fields
+    match    job, line, text, match: a line found by grep_jobs
+    line     line, text: a line printed by view_output
+    message  text: anything else
+    warning  message, job: something went wrong, the command goes on
+    error    message: something went wrong
+
+Fields without a value are omitted. New fields can be added, existing fields
+do not change meaning.
+"""
+from __future__ import print_function, absolute_import
+import json
+import threading
+import time
+import click
+
+# json records are written in batches of (about) BUFFER_SIZE bytes
+BUFFER_SIZE = 64 * 1024
+
+
+class Reporter(object):
+    """
+    Human readable output, what tower companion always printed. Only the
+    human readable version of a record is printed, its fields are for
+    JSONReporter
+    """
+    def emit(self, kind, human=None, **fields):
+        """
+        Reports something
+
+        Args:
+            kind (str): type of the record
+            human (str): human readable version, not printed when None
+            fields: the record
+        """
+        # pylint: disable=unused-argument
+        if human is not None:
+            print(human)
+
+    def echo(self, text):
+        """
+        Prints text, only in the human readable output
+        """
+        print(text)
+
+    def message(self, text, **fields):
+        """
+        Anything else
+        """
+        self.emit('message', text, text=text, **fields)
+
+    def launch(self, job, human, **fields):
+        """
+        A job has been started
+        """
+        self.emit('launch', human, job=job, **fields)
+
+    def status(self, job, status, human=None, **fields):
+        """
+        The status of a job changed
+        """
+        self.emit('status', human, job=job, status=status, **fields)
+
+    def output(self, job, chunk, human=None, **fields):
+        """
+        New output of a job, human is the version printed on the terminal
+        """
+        # pylint: disable=unused-argument
+        if human:
+            print(human)
+
+    def event(self, job, record, **fields):
+        """
+        A job event, printed as a json line
+        """
+        # pylint: disable=unused-argument
+        print(json.dumps(record, sort_keys=True))
+
+    def summary(self, parser, summary_format):
+        """
+        Prints the summary collected by a closed RecapParser, as text or
+        json
+        """
+        if summary_format == 'json':
+            print(parser.to_json())
+        else:
+            print(parser.to_text())
+
+    def timing(self, name, seconds, **fields):
+        """
+        How long something took, only in json records
+        """
+        pass
+
+    def track_concurrency(self, host, stats):
+        """
+        Reports the state of the request limiter of a tower when the command
+        is over, only in json records
+
+        Args:
+            host (str): the tower
+            stats (callable): returns the state, see APIv1.concurrency_stats
+        """
+        pass
+
+    def table(self, headers, rows, human):
+        """
+        The final table of a command, a row is a record
+        """
+        # pylint: disable=unused-argument
+        print(human)
+
+    def warning(self, message, human=None, **fields):
+        """
+        Something went wrong but the command goes on, human defaults to
+        message
+        """
+        self.emit('warning', message if human is None else human,
+                  message=message, **fields)
+
+    def error(self, message, human=None, **fields):
+        """
+        Something went wrong, human defaults to message
+        """
+        self.emit('error', message if human is None else human,
+                  message=message, **fields)
+
+    def flush(self):
+        """
+        Writes any pending output
+        """
+        pass
+
+    def close(self):
+        """
+        The command is over
+        """
+        pass
+
+
+class JSONReporter(Reporter):
+    """
+    Newline delimited json records, see the module documentation. Records
+    are encoded by a single encoder and written in batches; the batch is
+    written when it's big enough, when flush() is called (monitors flush at
+    every poll) and when the command is over.
+    """
+    def __init__(self, stream=None, buffer_size=BUFFER_SIZE):
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self.started = time.time()
+        self._encode = json.JSONEncoder(sort_keys=True,
+                                        separators=(',', ':')).encode
+        self._buffer = []
+        self._size = 0
+        self._lock = threading.Lock()
+        self._concurrency = {}
+
+    def emit(self, kind, human=None, **fields):
+        record = dict((key, value) for key, value in fields.items()
+                      if value is not None)
+        record['type'] = kind
+        record['time'] = round(time.time(), 3)
+        line = self._encode(record) + '\n'
+        with self._lock:
+            self._buffer.append(line)
+            self._size += len(line)
+            if self._size >= self.buffer_size:
+                self._write()
+
+    def echo(self, text):
+        pass
+
+    def output(self, job, chunk, human=None, **fields):
+        if chunk:
+            self.emit('output', job=job, text=chunk, **fields)
+
+    def event(self, job, record, **fields):
+        self.emit('event', job=job, event=record, **fields)
+
+    def summary(self, parser, summary_format):
+        self.emit('summary', summary=parser.summary())
+
+    def timing(self, name, seconds, **fields):
+        self.emit('timing', name=name, seconds=round(seconds, 3), **fields)
+
+    def track_concurrency(self, host, stats):
+        self._concurrency[host] = stats
+
+    def table(self, headers, rows, human):
+        for row in rows:
+            self.emit('result', **dict(zip(headers, row)))
+
+    def _write(self):
+        """
+        Writes the buffer, the lock must be held
+        """
+        if not self._buffer:
+            return
+        stream = self.stream
+        if stream is None:
+            stream = click.get_binary_stream('stdout')
+        # ensure_ascii: records are plain ascii
+        stream.write(''.join(self._buffer).encode('ascii'))
+        stream.flush()
+        self._buffer = []
+        self._size = 0
+
+    def flush(self):
+        with self._lock:
+            self._write()
+
+    def close(self):
+        concurrency = dict((host, stats())
+                           for host, stats in self._concurrency.items())
+        self.timing('command', time.time() - self.started,
+                    concurrency=concurrency or None)
+        self.flush()
@@ -0,0 +1,109 @@
+"""
+Client side launch scheduler. Batch operations (slices, fan outs) can start
+many jobs at once, instead of filling the tower queue and starving everybody
+else, launches are released only when tower has some free capacity.
+"""
+from __future__ import print_function, absolute_import
+from time import sleep
+from .concurrency import parallel_map, DEFAULT_WORKERS
+from .reporter import Reporter
+
+# capacity used by a job with the default 5 forks, tower counts forks + 1
+JOB_IMPACT = 6
+SLEEP_INTERVAL = 1.0
+
+
+class LaunchScheduler(object):
+    """
+    Releases launches in batches, as long as the capacity used by tower stays
+    below its share of the total capacity. Tower capacity is read from the
+    instances (or from a single instance group), queued jobs count as used
+    capacity, so the launches already released are taken into account.
+    """
+    def __init__(self, api, share=1.0, job_impact=JOB_IMPACT,
+                 instance_group=None, sleep_interval=SLEEP_INTERVAL,
+                 reporter=None):
+        self.api = api
+        self.share = share
+        self.job_impact = job_impact
+        self.instance_group = instance_group
+        self.sleep_interval = sleep_interval
+        self.reporter = reporter if reporter is not None else Reporter()
+
+    def capacity(self):
+        """
+        Returns the total and the used capacity of tower. The consumed
+        capacity reported by tower includes the running and the waiting jobs,
+        when tower does not report it every one of them counts as job_impact.
+        The pending jobs, not assigned to an instance yet, count as job_impact
+
+        Returns:
+            (tuple): total capacity (int), used capacity (int)
+
+        Raises:
+            APIError
+        """
+        api = self.api
+        if self.instance_group:
+            nodes = [api.instance_group_data(self.instance_group)]
+        else:
+            nodes = api.instances()
+        total = sum(int(node.get('capacity') or 0) for node in nodes)
+        if nodes and all('consumed_capacity' in node for node in nodes):
+            used = sum(int(node['consumed_capacity'] or 0) for node in nodes)
+        else:
+            used = api.jobs_count(['running', 'waiting']) * self.job_impact
+        used += api.jobs_count(['pending']) * self.job_impact
+        return total, used
+
+    def slots(self):
+        """
+        Returns how many launches can be released now
+
+        Returns:
+            (int)
+
+        Raises:
+            APIError
+        """
+        total, used = self.capacity()
+        free = int(total * self.share) - used
+        if free < self.job_impact and used == 0:
+            # tower is idle but smaller than a single job, do not wait forever
+            return 1
+        return max(0, free // self.job_impact)
+
+    def run(self, launch, items, workers=DEFAULT_WORKERS):
+        """
+        Calls launch on every item, at most 'workers' at the same time and
+        only when tower has room for them, see slots()
+
+        Args:
+            launch (callable): function starting a job, it takes a single
+                               argument
+            items (iterable): arguments for launch
+            workers (int): max number of concurrent launches
+
+        Returns:
+            (list): results of launch, in the same order of items
+
+        Raises:
+            APIError, whatever launch raises
+        """
+        items = list(items)
+        results = []
+        waiting = False
+        while len(results) < len(items):
+            slots = min(self.slots(), workers)
+            if slots <= 0:
+                if not waiting:
+                    left = len(items) - len(results)
+                    self.reporter.message('Waiting for tower capacity, {0} '
+                                          'launches left'.format(left))
+                    waiting = True
+                sleep(self.sleep_interval)
+                continue
+            waiting = False
+            batch = items[len(results):len(results) + slots]
+            results.extend(parallel_map(launch, batch, workers=workers))
+        return results
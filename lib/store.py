@@ -0,0 +1,379 @@
+"""
+Local store of job outputs. Outputs are gzip compressed and stored by the
+sha256 of their content, identical outputs (the same check run twice) are
+stored once; every job has a small reference file pointing to its output.
+
+    <store>/objects/ab/cdef0123...gz
+    <store>/jobs/<job key>, e.g. 12@tower.example.com
+    <store>/plain/abcdef0123....txt (uncompressed copies, for view_output)
+
+grep searches many stored outputs at the same time, one process per cpu.
+"""
+from __future__ import absolute_import
+import gzip
+import hashlib
+import io
+import multiprocessing
+import os
+import re
+import tempfile
+import zlib
+from collections import deque
+from .utils import strip_ansi
+
+# in python 3, urlparse has been moved to urllib.parse
+try:
+    from urlparse import urlparse
+except ImportError:
+    # python 3
+    from urllib.parse import urlparse
+
+# bytes read at a time
+CHUNK_SIZE = 64 * 1024
+COMPRESS_LEVEL = 6
+# zlib wbits for a gzip header and trailer
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+# /api/v1/jobs/12/, /api/v1/ad_hoc_commands/3/
+JOB_URL = re.compile(r'/(?P<kind>[a-z_]+)/(?P<id>\d+)/?$')
+# what a key can contain of a tower host name (ports have a colon)
+HOST_UNSAFE = re.compile(r'[^\w.-]')
+# compiled once in every grep process
+_PATTERN = None
+
+
+class StoreError(Exception):
+    """
+    Something wrong with the output store
+    """
+    pass
+
+
+def job_key(job_url):
+    """
+    Returns the store key of a job: its id for playbook jobs, kind-id for
+    ad hoc commands and updates, followed by @ and the tower host, so job
+    ids of different towers do not clash, see host_key()
+
+    Args:
+        job_url (str): job url
+    Returns:
+        (str)
+    """
+    match = JOB_URL.search(job_url)
+    if match is None:
+        raise StoreError('not a job url: {0}'.format(job_url))
+    if match.group('kind') == 'jobs':
+        key = match.group('id')
+    else:
+        key = '{0}-{1}'.format(match.group('kind'), match.group('id'))
+    return host_key(key, urlparse(job_url).netloc)
+
+
+def host_key(key, host):
+    """
+    Returns the store key of a job of host: key@host. Keys that already have
+    a host, and keys without a host, are returned as they are
+
+    Args:
+        key (str): job id or job key
+        host (str): tower host
+    Returns:
+        (str)
+    """
+    key = str(key)
+    if '@' in key or not host:
+        return key
+    return '{0}@{1}'.format(key, HOST_UNSAFE.sub('_', host))
+
+
+class OutputStore(object):
+    """
+    Content addressed, compressed, store of job outputs
+    """
+    def __init__(self, root):
+        self.root = root
+        self.objects = os.path.join(root, 'objects')
+        self.jobs_dir = os.path.join(root, 'jobs')
+        self.plain_dir = os.path.join(root, 'plain')
+
+    def object_path(self, digest):
+        """
+        Returns the path of a stored output
+        """
+        return os.path.join(self.objects, digest[:2],
+                            '{0}.gz'.format(digest[2:]))
+
+    def _ref_path(self, key):
+        """
+        Returns the path of the reference file of a job
+        """
+        return os.path.join(self.jobs_dir, str(key))
+
+    def put(self, key, chunks):
+        """
+        Stores the output of a job, the output is compressed while it's
+        read
+
+        Args:
+            key (str): job key, see job_key()
+            chunks (iterable): output, bytes
+        Returns:
+            (str): sha256 of the output
+        Raises:
+            StoreError
+        """
+        try:
+            for directory in (self.objects, self.jobs_dir):
+                if not os.path.isdir(directory):
+                    os.makedirs(directory)
+            digest = self._write_object(chunks)
+            self._write_atomic(self._ref_path(key), digest.encode('ascii'))
+        except (IOError, OSError) as error:
+            raise StoreError('cannot store job {0}: {1}'.format(key, error))
+        return digest
+
+    def put_file(self, key, path):
+        """
+        Stores an output file, plain text or gzip compressed (.gz)
+
+        Args:
+            key (str): job key
+            path (str): output file
+        Returns:
+            (str): sha256 of the output
+        Raises:
+            StoreError
+        """
+        opener = gzip.open if path.endswith('.gz') else io.open
+        try:
+            with opener(path, 'rb') as output_in:
+                return self.put(key, iter(lambda: output_in.read(CHUNK_SIZE),
+                                          b''))
+        except (IOError, OSError) as error:
+            raise StoreError('cannot store {0}: {1}'.format(path, error))
+
+    def _write_object(self, chunks):
+        """
+        Compresses chunks into a temporary file, it becomes an object unless
+        the same output is already stored
+        """
+        sha = hashlib.sha256()
+        compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED,
+                                      GZIP_WBITS)
+        handle, tmp_path = tempfile.mkstemp(dir=self.objects)
+        try:
+            with os.fdopen(handle, 'wb') as tmp_out:
+                for chunk in chunks:
+                    sha.update(chunk)
+                    tmp_out.write(compressor.compress(chunk))
+                tmp_out.write(compressor.flush())
+            digest = sha.hexdigest()
+            path = self.object_path(digest)
+            if os.path.exists(path):
+                return digest
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            os.rename(tmp_path, path)
+            return digest
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _write_atomic(self, path, data):
+        """
+        Replaces path with data, readers never see a partial file
+        """
+        handle, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(handle, 'wb') as tmp_out:
+            tmp_out.write(data)
+        os.rename(tmp_path, path)
+
+    def digest(self, key):
+        """
+        Returns the sha256 of the output of a job, None if it's not stored
+        """
+        try:
+            with open(self._ref_path(key), 'r') as ref_in:
+                return ref_in.read().strip()
+        except (IOError, OSError):
+            return None
+
+    def has(self, key):
+        """
+        True if the output of the job is stored
+        """
+        digest = self.digest(key)
+        return digest is not None and os.path.exists(self.object_path(digest))
+
+    def keys(self):
+        """
+        Returns the keys of the stored jobs, sorted by host, numbers first
+        """
+        if not os.path.isdir(self.jobs_dir):
+            return []
+        keys = [name for name in os.listdir(self.jobs_dir)
+                if not name.startswith('tmp')]
+
+        def order(key):
+            """
+            host, then playbook jobs by id, then the other jobs
+            """
+            name, _, host = key.partition('@')
+            return (host, not name.isdigit(),
+                    int(name) if name.isdigit() else 0, name)
+        return sorted(keys, key=order)
+
+    def open(self, key):
+        """
+        Opens the output of a job, for reading (bytes)
+
+        Raises:
+            StoreError
+        """
+        digest = self.digest(key)
+        if digest is None:
+            raise StoreError('job {0} is not in the store'.format(key))
+        try:
+            return gzip.open(self.object_path(digest), 'rb')
+        except (IOError, OSError) as error:
+            raise StoreError('cannot read job {0}: {1}'.format(key, error))
+
+    def plain(self, key):
+        """
+        Returns the path of an uncompressed copy of the output of a job,
+        the copy is made the first time it's needed and it's shared by the
+        jobs with the same output
+
+        Args:
+            key (str): job key
+        Returns:
+            (str): path of the copy
+        Raises:
+            StoreError
+        """
+        digest = self.digest(key)
+        if digest is None:
+            raise StoreError('job {0} is not in the store'.format(key))
+        path = os.path.join(self.plain_dir, '{0}.txt'.format(digest))
+        if os.path.exists(path):
+            return path
+        try:
+            if not os.path.isdir(self.plain_dir):
+                os.makedirs(self.plain_dir)
+            handle, tmp_path = tempfile.mkstemp(dir=self.plain_dir)
+            with os.fdopen(handle, 'wb') as plain_out:
+                with self.open(key) as output_in:
+                    for chunk in iter(lambda: output_in.read(CHUNK_SIZE),
+                                      b''):
+                        plain_out.write(chunk)
+            os.rename(tmp_path, path)
+        except (IOError, OSError) as error:
+            raise StoreError('cannot uncompress job {0}: {1}'.format(key,
+                                                                   error))
+        return path
+
+    def grep(self, pattern, keys=None, context=0, ignore_case=False,
+             processes=None):
+        """
+        Searches the stored outputs, identical outputs are searched once
+
+        Args:
+            pattern (str): regular expression
+            keys (list): jobs to search, defaults to all the stored jobs
+            context (int): lines of context around every match
+            ignore_case (bool): case insensitive search
+            processes (int): number of processes, defaults to the number of
+                             cpus
+        Returns:
+            (list): (job key, matches) tuples, matches are lists of
+                    (line number, line, matched) tuples, separate groups of
+                    lines are separated by None
+        Raises:
+            StoreError
+        """
+        flags = re.IGNORECASE if ignore_case else 0
+        try:
+            re.compile(pattern, flags)
+        except re.error as error:
+            raise StoreError('invalid pattern {0}: {1}'.format(pattern,
+                                                               error))
+        if keys is None:
+            keys = self.keys()
+        digests = [self.digest(key) for key in keys]
+        if None in digests:
+            missing = keys[digests.index(None)]
+            raise StoreError('job {0} is not in the store'.format(missing))
+        unique = sorted(set(digests))
+        tasks = [(self.object_path(digest), context) for digest in unique]
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        if len(tasks) <= 1 or processes <= 1:
+            _compile_pattern(pattern, flags)
+            found = [_grep_object(task) for task in tasks]
+        else:
+            pool = multiprocessing.Pool(min(processes, len(tasks)),
+                                        _compile_pattern, (pattern, flags))
+            try:
+                found = pool.map(_grep_object, tasks, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        found = dict(zip(unique, found))
+        results = []
+        for key, digest in zip(keys, digests):
+            matches = found[digest]
+            if isinstance(matches, Exception):
+                raise StoreError(matches)
+            if matches:
+                results.append((key, matches))
+        return results
+
+
+def _compile_pattern(pattern, flags):
+    """
+    Compiles the grep pattern, once per process
+    """
+    global _PATTERN  # pylint: disable=global-statement
+    _PATTERN = re.compile(pattern, flags)
+
+
+def _grep_object(task):
+    """
+    Searches a stored output, runs in a worker process
+
+    Args:
+        task (tuple): path of the object, lines of context
+    Returns:
+        (list|Exception): see OutputStore.grep
+    """
+    path, context = task
+    search = _PATTERN.search
+    matches = []
+    before = deque(maxlen=context)
+    # line number of the last line added to matches
+    last = 0
+    after = 0
+    try:
+        with gzip.open(path, 'rb') as output_in:
+            for number, line in enumerate(output_in, 1):
+                line = strip_ansi(line.decode('utf-8', 'replace')).rstrip()
+                if search(line):
+                    first = number - len(before)
+                    if context and matches and first > last + 1:
+                        matches.append(None)
+                    matches.extend((number - len(before) + index, text, False)
+                                   for index, text in enumerate(before))
+                    matches.append((number, line, True))
+                    before.clear()
+                    last = number
+                    after = context
+                elif after:
+                    matches.append((number, line, False))
+                    last = number
+                    after -= 1
+                elif context:
+                    before.append(line)
+    except (IOError, OSError, EOFError, zlib.error) as error:
+        # exceptions are pickled back to the parent
+        return StoreError('cannot read {0}: {1}'.format(path, error))
+    return matches
@@ -4,12 +4,221 @@ Start and monitor ansilbe tower jobs from the command line, in real time.
 Grab your pop corns.
 """
 from __future__ import print_function, absolute_import
+import copy
+import hashlib
+import io
 import json
-from time import sleep
-from .api import APIv1, APIError
+import os
+import re
+from time import sleep, time
+import yaml
+from . import codec
+from .api import APIv1, APIError, FINISHED_STATUSES, FAILED_STATUSES
+from .api import ACTIVE_STATUSES
+from .archive import OutputFile, archive_path, CHUNK_SIZE
+from .concurrency import parallel_map, DEFAULT_WORKERS
+from .events import event_record
+from .hostlogs import HostLogs, HostLogsError, host_logs_path, read_index
+from .recap import RecapParser
+from .reporter import Reporter
+from .scheduler import LaunchScheduler, JOB_IMPACT
+from .store import OutputStore, StoreError, job_key, host_key
+from .utils import format_table, seconds_since, strip_ansi
 
 # some constants
 SLEEP_INTERVAL = 1.0  # sleep interval
+# tower replaces secrets (survey passwords) with this placeholder
+ENCRYPTED = '$encrypted$'
+# host name split in a prefix and a numeric suffix: web-(01)
+NUMBERED_HOST = re.compile(r'^(?P<prefix>[^:,]*?)(?P<number>\d+)$')
+
+
+def write_log(log, text):
+    """
+    Appends text to the log of a monitor, the log is flushed so it can be
+    followed (tail -f) while the job runs
+
+    Args:
+        log (file): log open in text mode
+        text (str): plain text
+    """
+    log.write(u'{0}'.format(text))
+    log.flush()
+
+
+def split_hosts(hosts, slices):
+    """
+    Partitions hosts into disjoint, similarly sized, slices
+
+    Args:
+        hosts (iterable): host names
+        slices (int): number of slices
+
+    Returns:
+        (list): list of lists of host names, empty slices are dropped
+    """
+    hosts = sorted(set(hosts))
+    return [hosts[index::slices] for index in range(slices)
+            if hosts[index::slices]]
+
+
+def hosts_to_limit(hosts):
+    """
+    Builds a compact limit expression from a list of hosts, duplicates are
+    removed. Hosts sharing a prefix and ending with a number are collapsed in
+    a single ansible regex pattern, when it is shorter than the plain list:
+    web01, web02, web10 becomes '~^web(01|02|10)$'
+
+    Args:
+        hosts (iterable): host names
+
+    Returns:
+        (str): limit expression
+    """
+    groups = {}
+    patterns = []
+    for host in sorted(set(hosts)):
+        match = NUMBERED_HOST.match(host)
+        if match:
+            groups.setdefault(match.group('prefix'), []).append(host)
+        else:
+            patterns.append(host)
+    for prefix, names in groups.items():
+        plain = ':'.join(names)
+        numbers = '|'.join(name[len(prefix):] for name in names)
+        compact = '~^{0}({1})$'.format(re.escape(prefix), numbers)
+        if len(names) > 1 and len(compact) < len(plain) and \
+                ':' not in compact and ',' not in compact:
+            patterns.append(compact)
+        else:
+            patterns.append(plain)
+    return ':'.join(sorted(patterns))
+
+
+def encrypted_vars(extra_vars, path=''):
+    """
+    Returns the (dotted) names of the variables tower redacted as $encrypted$
+
+    Args:
+        extra_vars (dict|list): extra variables of a job
+        path (str): name of the parent variable
+
+    Returns:
+        (list): names of the redacted variables
+    """
+    if isinstance(extra_vars, dict):
+        items = extra_vars.items()
+    elif isinstance(extra_vars, list):
+        items = enumerate(extra_vars)
+    else:
+        return [path] if extra_vars == ENCRYPTED else []
+    names = []
+    for key, value in items:
+        name = '{0}.{1}'.format(path, key) if path else str(key)
+        names.extend(encrypted_vars(value, name))
+    return sorted(names)
+
+
+def project_is_current(project, max_age=None, revision=None, now=None):
+    """
+    Tells if a project update can be skipped: its last update succeeded and
+    it is already at revision or it has been updated less than max_age
+    seconds ago. Without max_age and revision, updates are never skipped.
+
+    Args:
+        project (dict): project details, as returned by the api
+        max_age (int): freshness window, in seconds
+        revision (str): expected scm revision (or its prefix)
+        now (datetime): current UTC time, see seconds_since()
+
+    Returns:
+        (str|None): the reason to skip the update, None to update
+    """
+    if project.get('status') != 'successful':
+        return None
+    scm_revision = project.get('scm_revision') or ''
+    if revision and scm_revision.startswith(revision):
+        return 'already at {0}'.format(scm_revision)
+    age = seconds_since(project.get('last_updated'), now=now)
+    if max_age is not None and age is not None and age <= max_age:
+        return 'updated {0}s ago'.format(int(age))
+    return None
+
+
+def launch_fingerprint(template_id, limit, extra_vars):
+    """
+    Returns a fingerprint of a launch: two launches of the same template with
+    the same limit and the same extra variables, whatever the order of their
+    keys, have the same fingerprint
+
+    Args:
+        template_id (int): id of the template
+        limit (str): limit, None and '' are the same
+        extra_vars (dict|str): extra variables, strings are json (as stored
+                               by tower in the job)
+    Returns:
+        (str): the fingerprint
+    """
+    if not isinstance(extra_vars, dict):
+        try:
+            extra_vars = codec.loads(extra_vars or '{}')
+        except ValueError:
+            pass
+    launch = json.dumps([int(template_id), limit or '', extra_vars or {}],
+                        sort_keys=True)
+    return hashlib.sha1(launch.encode('utf-8')).hexdigest()
+
+
+def launch_values(template, limit, extra_vars):
+    """
+    Returns the limit and the extra variables tower stores in a job of
+    template launched with limit and extra_vars: the template extra variables
+    updated with the launch ones and the launch limit, or the template one.
+    The launch values the template does not prompt for are ignored, as tower
+    does.
+
+    Args:
+        template (dict): template data, as returned by template_data
+        limit (str): launch limit
+        extra_vars (dict): launch extra variables
+    Returns:
+        (tuple): limit, extra variables (dict)
+    """
+    try:
+        merged = yaml.safe_load(template.get('extra_vars') or '') or {}
+    except yaml.YAMLError:
+        merged = {}
+    if not isinstance(merged, dict):
+        merged = {}
+    if extra_vars and (template.get('ask_variables_on_launch') or
+                       template.get('survey_enabled')):
+        merged.update(extra_vars)
+    if not (limit and template.get('ask_limit_on_launch')):
+        limit = template.get('limit')
+    return limit, merged
+
+
+def source_is_stale(source, ttl, now=None):
+    """
+    Tells if an inventory source needs a sync: its last sync failed, it never
+    happened or it is older than ttl seconds. A source with a sync in progress
+    is not stale, the sync is waited on instead
+
+    Args:
+        source (dict): inventory source, as returned by the api
+        ttl (int): max age of the last sync, in seconds
+        now (datetime): current UTC time, see seconds_since()
+
+    Returns:
+        (bool)
+    """
+    status = source.get('status')
+    if status in ACTIVE_STATUSES:
+        return False
+    if status != 'successful':
+        return True
+    age = seconds_since(source.get('last_updated'), now=now)
+    return age is None or age > ttl
 
 
 class GuardError(Exception):
@@ -24,13 +233,183 @@ class Guard(object):
     Your belowed tower house keeper. It just need a configuration object
     and it will do all the dirty job for you.
     """
-    def __init__(self, config, sleep_interval=SLEEP_INTERVAL):
+    def __init__(self, config, sleep_interval=SLEEP_INTERVAL, reporter=None):
         self.config = config
         self.sleep_interval = sleep_interval
+        # what the user is told, human readable text by default
+        self.reporter = reporter if reporter is not None else Reporter()
         try:
             self.api = APIv1(config)
         except APIError as error:
             raise GuardError(error)
+        self.reporter.track_concurrency(self.api.host,
+                                        self.api.concurrency_stats)
+
+    def launch_scheduler(self):
+        """
+        Returns the launch scheduler for batch operations, configured with
+        the launch_share (0 < share <= 1), job_impact and instance_group
+        options, None if launch_share is not configured
+
+        Returns:
+            (LaunchScheduler|None)
+
+        Raises:
+            GuardError
+        """
+        config = self.config
+        if not config.has_option('launch_share'):
+            return None
+        try:
+            share = float(config.get('launch_share'))
+            job_impact = JOB_IMPACT
+            if config.has_option('job_impact'):
+                job_impact = int(config.get('job_impact'))
+        except ValueError as error:
+            msg = 'Invalid launch_share/job_impact in configuration, {0}'
+            raise GuardError(msg.format(error))
+        if not 0 < share <= 1 or job_impact < 1:
+            msg = 'launch_share must be in (0, 1] and job_impact positive'
+            raise GuardError(msg)
+        instance_group = None
+        if config.has_option('instance_group'):
+            instance_group = config.get('instance_group')
+        return LaunchScheduler(self.api, share=share, job_impact=job_impact,
+                               instance_group=instance_group,
+                               sleep_interval=self.sleep_interval,
+                               reporter=self.reporter)
+
+    def output_store(self):
+        """
+        Returns the local store of job outputs, configured with the
+        output_store option (a directory), None if it's not configured.
+        monitor and archive feed it, grep searches it.
+
+        Returns:
+            (OutputStore|None)
+        """
+        config = self.config
+        if not config.has_option('output_store'):
+            return None
+        return OutputStore(os.path.expanduser(config.get('output_store')))
+
+    def store_output(self, job_url, output):
+        """
+        Adds the complete output of a job to the output store, if any. The
+        job is over when its output is stored, a store that cannot be written
+        is reported as a warning, not as an error
+
+        Args:
+            job_url (str): job url
+            output (str): output of the job
+        """
+        store = self.output_store()
+        if store is None:
+            return
+        try:
+            store.put(job_key(job_url), [output.encode('utf-8')])
+        except StoreError as error:
+            self._store_warning(job_url, error)
+
+    def _store_warning(self, job, error):
+        """
+        Reports an output that could not be stored
+        """
+        msg = u'output not stored: {0}'.format(error)
+        self.reporter.warning(msg, u'Warning: {0}'.format(msg), job=job)
+
+    def _store_key(self, job_id):
+        """
+        Returns the store key of a job of this tower, see host_key()
+        """
+        return host_key(job_id, self.api.host)
+
+    def grep(self, pattern, job_ids=None, context=0, ignore_case=False,
+             processes=None):
+        """
+        Searches the outputs in the output store, see OutputStore.grep
+
+        Raises:
+            GuardError
+        """
+        store = self.output_store()
+        if store is None:
+            raise GuardError('output_store is not configured')
+        keys = None
+        if job_ids:
+            keys = [self._store_key(job_id) for job_id in job_ids]
+        try:
+            return store.grep(pattern, keys=keys, context=context,
+                              ignore_case=ignore_case, processes=processes)
+        except StoreError as error:
+            raise GuardError(error)
+
+    def stored_output(self, job_id):
+        """
+        Returns the path of an uncompressed copy of a stored output, see
+        OutputStore.plain
+
+        Args:
+            job_id (int|str): job id (of this tower) or store key
+        Returns:
+            (str)
+        Raises:
+            GuardError
+        """
+        store = self.output_store()
+        if store is None:
+            raise GuardError('output_store is not configured')
+        try:
+            return store.plain(self._store_key(job_id))
+        except StoreError as error:
+            raise GuardError(error)
+
+    def _launch_many(self, launch, items, workers):
+        """
+        Calls launch on every item in parallel, when a launch scheduler is
+        configured, launches wait for tower capacity. When some launches
+        fail, the jobs started by the others are reported before raising,
+        they are running and nobody else knows about them
+
+        Args:
+            launch (callable): function starting a job
+            items (iterable): arguments for launch
+            workers (int): max number of concurrent launches
+        Returns:
+            (list): results of launch
+        Raises:
+            GuardError
+        """
+        def try_launch(item):
+            """
+            returns the launch data or the error
+            """
+            try:
+                return launch(item), None
+            except (GuardError, APIError) as error:
+                return None, error
+
+        scheduler = self.launch_scheduler()
+        try:
+            if scheduler is None:
+                results = parallel_map(try_launch, items, workers=workers)
+            else:
+                results = scheduler.run(try_launch, items, workers=workers)
+        except APIError as error:
+            raise GuardError(error)
+        errors = [error for _, error in results if error is not None]
+        if not errors:
+            return [job for job, _ in results]
+        started = [self.launch_data_to_url(job) for job, error in results
+                   if error is None]
+        for job_url in started:
+            self.reporter.launch(job_url, 'Started job: {0}'.format(job_url))
+        msg = '{0} of {1} launches failed: {2}'.format(len(errors),
+                                                       len(results),
+                                                       errors[0])
+        if started:
+            msg = '{0} (already started: {1})'.format(msg, ', '.join(started))
+        raise GuardError(msg)
 
     def get_template_id(self, template_name):
         """
@@ -51,6 +430,25 @@ class Guard(object):
         except APIError as error:
             raise GuardError(error)
 
+    def get_template(self, template_name):
+        """
+        Returns the data of a template from its name
+
+        Args:
+            template_name (str): the name of template
+        Returns:
+            (dict): template data
+        Raises:
+            GuardError
+        """
+        try:
+            return self.api.template_data(template_name)['results'][0]
+        except (IndexError, KeyError):
+            msg = 'no such template: {0}'.format(template_name)
+            raise GuardError(msg)
+        except APIError as error:
+            raise GuardError(error)
+
     def get_role_id(self, template_name, permission):
         """
         Returns a role id from a template permission combination
@@ -61,28 +459,57 @@ class Guard(object):
         Retruns:
             (int): role id if found
 
+        Raises:
+            GuardError
+        """
+        key = (template_name.lower(), permission.lower())
+        for role_key, role_id in self._iter_template_roles():
+            if role_key == key:
+                # stop here, the other roles are not even downloaded
+                return role_id
+        # if we are here, we didnt find any suitable role
+        msg = "No role found for template '{0}' ".format(template_name)
+        msg = "{0}with permissions {1}. ".format(msg, permission)
+        msg = "{0}Please make sure that a suitable role exists".format(msg)
+        raise GuardError(msg)
+
+    def template_roles(self):
+        """
+        Returns the job template roles, with a single request
+        Retruns:
+            (dict): (template name, permission) -> role id, names and
+                    permissions are lower case
+
+        Raises:
+            GuardError
+        """
+        roles = {}
+        for key, role_id in self._iter_template_roles():
+            roles.setdefault(key, role_id)
+        return roles
+
+    def _iter_template_roles(self):
+        """
+        Yields the job template roles as they are downloaded, the roles
+        listing is parsed as a stream
+        Yields:
+            (tuple): (template name, permission), role id; names and
+                     permissions are lower case
+
         Raises:
             GuardError
         """
         api = self.api
         try:
-            data = api.role_data()
-            # now iterate through all roles and search for the right combination of template id and permission
-            for role in data['results']:
-                role_type = role['name'].lower()
-                resource_type = role['summary_fields'].get('resource_type')
-                resource_name = role['summary_fields'].get('resource_name')
+            for role in api.roles():
+                summary = role.get('summary_fields') or {}
+                resource_type = summary.get('resource_type')
+                resource_name = summary.get('resource_name')
                 if ((resource_type) and
                         (resource_name) and
-                        (role_type.lower() == permission.lower()) and
-                        (resource_type.lower() == 'job template') and
-                        (resource_name.lower() == template_name.lower())):
-                    return role['id']
-            # if we are here, we didnt find any suitable role
-            msg = "No role found for template '{0}' ".format(template_name)
-            msg = "{0}with permissions {1}. ".format(msg, permission)
-            msg = "{0}Please make sure that a suitable role exists".format(msg)
-            raise GuardError(msg)
+                        (resource_type.lower() == 'job template')):
+                    yield ((resource_name.lower(), role['name'].lower()),
+                           role['id'])
         except APIError as error:
             raise GuardError(error)
 
@@ -144,6 +571,154 @@ class Guard(object):
         except APIError as error:
             raise GuardError(error)
 
+    def update_projects(self, project_names, max_age=None, revision=None,
+                        wait=False, output_format='txt',
+                        workers=DEFAULT_WORKERS):
+        """
+        Updates many projects in parallel, skipping the ones that are
+        already current, see project_is_current()
+
+        Args:
+            project_names (list): names of the projects
+            max_age (int): freshness window, in seconds
+            revision (str): expected scm revision
+            wait (bool): monitor the updates until they are complete
+            output_format (str): output format of the updates, when waiting
+            workers (int): max number of concurrent requests
+        Returns:
+            (list): (project name, status, update url) tuples, status is the
+                    reason of a skip, 'started' or, when waiting, the final
+                    status of the update; the url of a skipped project is
+                    None
+        Raises:
+            GuardError
+        """
+        names = []
+        for name in project_names:
+            if name not in names:
+                names.append(name)
+        api = self.api
+        try:
+            ids = api.project_ids(names)
+            projects = parallel_map(api.project_details,
+                                    [ids[name] for name in names],
+                                    workers=workers)
+        except APIError as error:
+            raise GuardError(error)
+
+        statuses = {}
+        to_update = []
+        for name, project in zip(names, projects):
+            reason = project_is_current(project, max_age, revision)
+            if reason:
+                statuses[name] = 'skipped ({0})'.format(reason)
+            else:
+                to_update.append(name)
+
+        def update(name):
+            """
+            Starts the update of a project, returns its url
+            """
+            return api.project_update_url(self.update_project(ids[name]))
+
+        try:
+            urls = parallel_map(update, to_update, workers=workers)
+        except APIError as error:
+            raise GuardError(error)
+        update_urls = dict(zip(to_update, urls))
+        for name, url in zip(to_update, urls):
+            statuses[name] = 'started'
+            self.reporter.launch(url, None, project=name)
+        if wait and urls:
+            final = self.monitor_many(urls, output_format, labels=to_update,
+                                      workers=workers)
+            for name, url in zip(to_update, urls):
+                statuses[name] = final[url]
+        return [(name, statuses[name], update_urls.get(name))
+                for name in names]
+
+    def refresh_inventory(self, template_name, ttl, workers=DEFAULT_WORKERS):
+        """
+        Syncs the stale inventory sources of a template inventory, see
+        source_is_stale(), and waits until the syncs are complete. The syncs
+        already in progress are waited on, not started again. Sources
+        without an external source (manual) are ignored.
+
+        Args:
+            template_name (str): the name of template
+            ttl (int): max age of the last sync, in seconds
+            workers (int): max number of concurrent requests
+        Returns:
+            (list): names of the refreshed sources
+        Raises:
+            GuardError
+        """
+        api = self.api
+        template = self.get_template(template_name)
+        if not template.get('inventory'):
+            # the inventory is prompted on launch
+            return []
+
+        try:
+            sources = api.inventory_sources(template['inventory'])
+        except APIError as error:
+            raise GuardError(error)
+        names = []
+        urls = []
+        stale = []
+        for source in sources:
+            if not source.get('source'):
+                continue
+            update_url = api.source_update_url(source)
+            if update_url:
+                names.append(source['name'])
+                urls.append(update_url)
+            elif source_is_stale(source, ttl):
+                stale.append(source)
+        try:
+            urls.extend(parallel_map(api.update_inventory_source,
+                                     [source['id'] for source in stale],
+                                     workers=workers))
+        except APIError as error:
+            raise GuardError(error)
+        names.extend(source['name'] for source in stale)
+        statuses = self.wait_for_jobs(urls, workers=workers)
+        failed = [name for name, url in zip(names, urls)
+                  if statuses[url] != 'successful']
+        if failed:
+            msg = 'inventory sync failed: {0}'.format(', '.join(failed))
+            raise GuardError(msg)
+        return names
+
+    def wait_for_jobs(self, job_urls, workers=DEFAULT_WORKERS):
+        """
+        Waits, without printing their output, until all the jobs are complete
+
+        Args:
+            job_urls (list): job (or update) urls
+            workers (int): max number of jobs polled at the same time
+        Returns:
+            (dict): final status of each job url
+        Raises:
+            GuardError
+        """
+        api = self.api
+        statuses = {}
+        pending = list(job_urls)
+        try:
+            while pending:
+                polled = parallel_map(api.job_status, pending,
+                                      workers=workers)
+                for url, status in zip(pending, polled):
+                    if status in FINISHED_STATUSES:
+                        statuses[url] = status
+                pending = [url for url in pending if url not in statuses]
+                if pending:
+                    sleep(self.sleep_interval)
+        except APIError as error:
+            raise GuardError(error)
+        return statuses
+
     def kick(self, template_id, extra_vars, limit):
         """
         Starts a job in ansible tower
@@ -159,6 +734,164 @@ class Guard(object):
         except APIError as error:
             raise GuardError(error)
 
+    def find_duplicate(self, template, extra_vars, limit):
+        """
+        Looks for a pending or running job with the same launch fingerprint,
+        see launch_fingerprint(). The launch is compared as tower stores it,
+        with the template defaults, see launch_values()
+
+        Args:
+            template (dict): template data, as returned by template_data
+            extra_vars (dict): extra variables
+            limit (str): limit
+        Returns:
+            (dict|None): the newest identical job, None if there is none
+        Raises:
+            GuardError
+        """
+        template_id = template['id']
+        limit, extra_vars = launch_values(template, limit, extra_vars)
+        fingerprint = launch_fingerprint(template_id, limit, extra_vars)
+        try:
+            jobs = self.api.active_jobs(template_id)
+        except APIError as error:
+            raise GuardError(error)
+        for job in jobs:
+            if launch_fingerprint(template_id, job.get('limit'),
+                                  job.get('extra_vars')) == fingerprint:
+                return job
+        return None
+
+    def failed_hosts(self, job_id):
+        """
+        Returns the hosts that failed or were unreachable during a job
+        Args:
+            job_id (int): id of the job
+        Returns:
+            (list): sorted list of host names
+        Raises:
+            GuardError
+        """
+        api = self.api
+        try:
+            summaries = api.job_failed_hosts(job_id)
+            return sorted(set(summary['host_name'] for summary in summaries
+                              if summary.get('failures') or
+                              summary.get('dark') or summary.get('failed')))
+        except KeyError as error:
+            msg = 'unexpected host summary for job {0}: {1}'.format(job_id,
+                                                                  error)
+            raise GuardError(msg)
+        except APIError as error:
+            raise GuardError(error)
+
+    def relaunch_failed(self, job_id):
+        """
+        Launches the template of a previous job again, with the same extra
+        variables, limited to the hosts that failed or were unreachable
+
+        Args:
+            job_id (int): id of the job to relaunch
+        Returns:
+            (tuple): launch data (dict), limit (str)
+        Raises:
+            GuardError
+        """
+        try:
+            job = self.api.job_data(job_id)
+            template_id = job.get('job_template')
+            extra_vars = codec.loads(job.get('extra_vars') or '{}')
+        except ValueError as error:
+            msg = 'cannot read extra vars of job {0}: {1}'.format(job_id,
+                                                                  error)
+            raise GuardError(msg)
+        except APIError as error:
+            raise GuardError(error)
+        if not template_id:
+            msg = 'job {0} has no job template to relaunch'.format(job_id)
+            raise GuardError(msg)
+        redacted = encrypted_vars(extra_vars)
+        if redacted:
+            msg = 'job {0} has secret extra vars'.format(job_id)
+            msg = '{0} that cannot be copied: {1}'.format(msg,
+                                                          ', '.join(redacted))
+            raise GuardError(msg)
+        hosts = self.failed_hosts(job_id)
+        if not hosts:
+            msg = 'job {0} has no failed or unreachable hosts'.format(job_id)
+            raise GuardError(msg)
+        limit = hosts_to_limit(hosts)
+        return self.kick(template_id, extra_vars, limit), limit
+
+    def slice_limits(self, template, slices):
+        """
+        Splits the hosts of the template inventory into disjoint limits.
+        Templates with their own limit cannot be sliced: every slice limit
+        would replace it and run on hosts outside of it. Templates must
+        prompt for the limit on launch, or tower ignores the slice limits and
+        every slice runs on the whole inventory.
+
+        Args:
+            template (dict): template data, as returned by template_data
+            slices (int): number of slices
+        Returns:
+            (list): limit expressions, one per slice
+        Raises:
+            GuardError
+        """
+        name = template.get('name')
+        if template.get('limit'):
+            msg = 'template {0} has a limit ({1}), it cannot be sliced'.format(
+                name, template['limit'])
+            raise GuardError(msg)
+        if not template.get('ask_limit_on_launch'):
+            msg = ('template {0} does not prompt for a limit on launch, it '
+                   'cannot be sliced'.format(name))
+            raise GuardError(msg)
+        try:
+            hosts = self.api.inventory_hosts(template['inventory'])
+            names = [host['name'] for host in hosts
+                     if host.get('enabled', True)]
+        except KeyError:
+            msg = 'cannot find the inventory of {0}'.format(name)
+            raise GuardError(msg)
+        except APIError as error:
+            raise GuardError(error)
+        if not names:
+            msg = 'the inventory of {0} has no hosts'.format(name)
+            raise GuardError(msg)
+        return [hosts_to_limit(hosts) for hosts in split_hosts(names, slices)]
+
+    def kick_slices(self, template_name, extra_vars, slices):
+        """
+        Splits the template inventory in slices and starts a job for each of
+        them, in parallel
+        Args:
+            template_name (str): the name of template
+            extra_vars (dict): extra variables
+            slices (int): number of slices
+        Returns:
+            (list): launch data of the triggered jobs
+        Raises:
+            GuardError
+        """
+        template = self.get_template(template_name)
+        template_id = template['id']
+        limits = self.slice_limits(template, slices)
+
+        def kick_slice(limit):
+            """
+            starts the job for a single slice
+            """
+            job = self.kick(template_id, extra_vars, limit)
+            if 'limit' in (job.get('ignored_fields') or {}):
+                msg = ('tower ignored the limit {0}, job {1} runs on the '
+                       'whole inventory'.format(limit,
+                                                self.launch_data_to_url(job)))
+                raise GuardError(msg)
+            return job
+        return self._launch_many(kick_slice, limits, workers=DEFAULT_WORKERS)
+
     def download_url(self, job_id, output_format):
         """
         Returns the url
@@ -175,49 +908,537 @@ class Guard(object):
         return 'https://{0}/api/v1/ad_hoc_commands/{1}/stdout/?format={2}'.format(
             host, job_id, output_format)
 
-    def monitor(self, job_url, output_format):
+    def archive_job(self, job_id, directory, compress=False, host_logs=False):
+        """
+        Downloads the output of a finished job into directory, a previous
+        interrupted download is resumed
+
+        Args:
+            job_id (int): id of the job
+            directory (str): archive directory
+            compress (bool): gzip the output
+            host_logs (bool): split the output by host too, see
+                              archive_hosts()
+        Returns:
+            (tuple): job id, status ('downloaded', 'resumed' or 'already
+                     archived'), size of the output, path
+        Raises:
+            GuardError
+        """
+        path = archive_path(directory, job_id, compress)
+        if host_logs:
+            self.archive_hosts(job_id, directory)
+        if os.path.exists(path):
+            self._store_archived(job_id, path)
+            return (job_id, 'already archived', None, path)
+        output = OutputFile(path, compress)
+        offset = output.resume_offset()
+        try:
+            start, chunks = self.api.download_stdout(job_id, offset,
+                                                     chunk_size=CHUNK_SIZE)
+            written = output.write(start, chunks)
+            output.finish()
+        except APIError as error:
+            raise GuardError('job {0}: {1}'.format(job_id, error))
+        except (IOError, OSError) as error:
+            raise GuardError('job {0}: cannot write {1}: {2}'.format(
+                job_id, path, error))
+        self._store_archived(job_id, path)
+        status = 'resumed' if start else 'downloaded'
+        return (job_id, status, start + written, path)
+
+    def archive_hosts(self, job_id, directory):
+        """
+        Splits the output of a finished job by host, from its events, into
+        directory/job-<id>.hosts, see HostLogs. Jobs already split (they have
+        an index) are skipped, jobs still running are an error: their logs
+        and states would be incomplete
+
+        Args:
+            job_id (int): id of the job
+            directory (str): archive directory
+        Returns:
+            (str): directory of the host logs
+        Raises:
+            GuardError
+        """
+        path = host_logs_path(directory, job_id)
+        if read_index(path) is not None:
+            return path
+        job_url = self.job_url(job_id)
+        try:
+            if not self.api.job_finished(job_url):
+                raise GuardError('job {0} is not finished, its output cannot '
+                                 'be split by host yet'.format(job_id))
+            hosts = HostLogs(path, job_url)
+            try:
+                self._drain_events(self.api, job_url, 0, hosts.write)
+            finally:
+                hosts.close()
+            hosts.finish()
+        except (KeyError, TypeError) as error:
+            msg = 'unexpected event data from {0}: {1}'.format(job_url, error)
+            raise GuardError(msg)
+        except (APIError, HostLogsError) as error:
+            raise GuardError('job {0}: {1}'.format(job_id, error))
+        return path
+
+    def _store_archived(self, job_id, path):
+        """
+        Adds an archived output to the output store, unless it's already
+        there. Like store_output(), a failure is only a warning
+        """
+        store = self.output_store()
+        key = self._store_key(job_id)
+        if store is None or store.has(key):
+            return
+        try:
+            store.put_file(key, path)
+        except StoreError as error:
+            self._store_warning(str(job_id), error)
+
+    def archive(self, job_ids=(), filters=None, directory='.',
+                compress=False, workers=DEFAULT_WORKERS, host_logs=False):
+        """
+        Downloads the outputs of many jobs in parallel, the jobs are listed
+        or queried. Queries only match finished jobs, unless they filter
+        by status.
+
+        Args:
+            job_ids (list): ids of the jobs
+            filters (dict): jobs endpoint filters, e.g.
+                            {'job_template__name': 'deploy'}
+            directory (str): archive directory
+            compress (bool): gzip the outputs
+            workers (int): max number of concurrent downloads
+            host_logs (bool): split the outputs by host too
+        Returns:
+            (list): archive_job results, the status of a job that cannot be
+                    archived is 'error: <reason>'
+        Raises:
+            GuardError
+        """
+        job_ids = [int(job_id) for job_id in job_ids]
+        if filters:
+            filters = dict(filters)
+            if not any(key.startswith('status') for key in filters):
+                filters['status__in'] = ','.join(FINISHED_STATUSES)
+            try:
+                job_ids.extend(self.api.job_ids(filters))
+            except APIError as error:
+                raise GuardError(error)
+        # duplicates would download the same file at the same time
+        job_ids = sorted(set(job_ids))
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+        except OSError as error:
+            raise GuardError('cannot create {0}: {1}'.format(directory,
+                                                             error))
+
+        def archive_one(job_id):
+            """
+            archives a single job, a job that cannot be archived gets an
+            error row, it does not stop the others
+            """
+            try:
+                return self.archive_job(job_id, directory, compress,
+                                        host_logs)
+            except GuardError as error:
+                return (job_id, 'error: {0}'.format(error), None, None)
+        return parallel_map(archive_one, job_ids, workers=workers)
+
+    def monitor(self, job_url, output_format, summary=None, log_file=None,
+                host_logs=None):
         """
         Monitor the execution of a job stdout endpoint
         Args:
             job_url (str): job url
-            output_format (str): text, ansi, ...
+            output_format (str): text, ansi, events ...
+            summary (str): None, 'text' or 'json'. When set, prints a summary
+                of the PLAY RECAP and of the failed tasks when the job ends
+            log_file (str): when set, the output is appended to this file
+                too, as plain text. The output is downloaded once, an ansi
+                output is stripped of its colors locally
+            host_logs (str): when set, the output is split by host in this
+                directory, from the job events, see HostLogs
         Raises:
             GuardError
         """
+        hosts = None
+        if host_logs is not None:
+            try:
+                hosts = HostLogs(host_logs, job_url)
+            except HostLogsError as error:
+                raise GuardError(error)
+        log = self._open_log(log_file)
+        try:
+            return self._monitor(job_url, output_format, summary, log, hosts)
+        finally:
+            if log is not None:
+                log.close()
+            if hosts is not None:
+                hosts.close()
+
+    def _open_log(self, log_file):
+        """
+        Opens the plain text log of a monitor, for appending
+
+        Args:
+            log_file (str): path of the log, can be None
+        Returns:
+            (file|None)
+        Raises:
+            GuardError
+        """
+        if log_file is None:
+            return None
+        try:
+            return io.open(log_file, 'a', encoding='utf-8')
+        except (IOError, OSError) as error:
+            raise GuardError('cannot open {0}: {1}'.format(log_file, error))
+
+    def _report_status(self, api, job_url, reported, **fields):
+        """
+        Reports the status of a job when it changed. The status is the one
+        seen by the last poll of the job, no request is sent to tower
+
+        Args:
+            api (APIv1): api of the job
+            job_url (str): job url
+            reported (str): status reported so far, can be None
+            fields: more fields of the status record
+        Returns:
+            (str): the status reported now
+        """
+        status = api.last_status(job_url)
+        if status is None or status == reported:
+            return reported
+        self.reporter.status(job_url, status, **fields)
+        return status
+
+    def _drain_events(self, api, job_url, last_id, handler):
+        """
+        Passes the events of a job newer than last_id to handler, page after
+        page
+
+        Args:
+            api (APIv1): api of the job
+            job_url (str): job url
+            last_id (int): id of the last event already handled
+            handler (callable): called with every raw event
+        Returns:
+            (int): id of the last event handled
+        Raises:
+            APIError, KeyError, TypeError, whatever handler raises
+        """
+        more = True
+        while more:
+            data = api.job_events(job_url, last_id=last_id)
+            for event in data['results']:
+                last_id = event['id']
+                handler(event)
+            more = bool(data.get('next')) and bool(data['results'])
+        return last_id
+
+    def _finish_hosts(self, hosts):
+        """
+        Writes the index of the host logs, if any
+        """
+        if hosts is None:
+            return
+        try:
+            hosts.finish()
+        except HostLogsError as error:
+            raise GuardError(error)
+
+    def _monitor(self, job_url, output_format, summary, log, hosts):
+        """
+        monitor(), log is the open log file and hosts the HostLogs, or None
+        """
+        parser = None
+        if summary:
+            parser = RecapParser()
+        if output_format == 'events':
+            return self.monitor_events(job_url, parser=parser,
+                                       summary=summary, log=log, hosts=hosts)
         # a good old empty string
         prev_output = u''
         # suppose the job is not complete
         result = None
         complete = False
         api = self.api
+        reporter = self.reporter
+        status = None
+        started = time()
+        last_id = 0
         try:
             while not complete:
                 complete = api.job_finished(job_url)
+                status = self._report_status(api, job_url, status)
+                if hosts is not None:
+                    # the output has no hosts, their events do
+                    last_id = self._drain_events(api, job_url, last_id,
+                                                 hosts.write)
                 # get the current status from the API point
                 output = api.job_stdout(job_url, output_format)
                 # take a nap
                 sleep(self.sleep_interval)
                 # we just want to display the lines that have not been printed
                 # yet
-                print_me = output.replace(prev_output, '').strip()
+                new_output = output.replace(prev_output, '')
+                if parser is not None:
+                    parser.feed(new_output)
                 # do not print empty lines
-                if print_me:
-                    print(print_me)
+                reporter.output(job_url, new_output, new_output.strip())
+                reporter.flush()
+                if log is not None and new_output:
+                    # the same download, without colors
+                    write_log(log, strip_ansi(new_output))
                 # now all the new lines have been printed, set prev_req to output
                 prev_output = output
             result = api.job_status(job_url)
-        except APIError as error:
+            self._report_status(api, job_url, status)
+        except (KeyError, TypeError) as error:
+            msg = 'unexpected event data from {0}: {1}'.format(job_url, error)
+            raise GuardError(msg)
+        except (APIError, HostLogsError) as error:
             raise GuardError(error)
+        reporter.timing('job', time() - started, job=job_url)
+        self.store_output(job_url, prev_output)
+        self._finish_hosts(hosts)
+
+        if parser is not None:
+            parser.close()
+            reporter.summary(parser, summary)
 
         # print some other information
         # download_url = self.download_url(job_id, 'txt_download')
         # print('you can download the full output from: {0}'.format(download_url))
         # check if the job was successful
-        if result == 'failed':
+        if result in FAILED_STATUSES:
+            msg = 'job id {0}: ended with errors'.format(job_url)
+            raise GuardError(msg)
+
+    def monitor_events(self, job_url, handler=None, parser=None,
+                       summary=None, log=None, hosts=None):
+        """
+        Monitor the execution of a job using its events endpoint. Instead of
+        downloading the whole stdout at every iteration, it only asks for the
+        events newer than the last one received.
+
+        Args:
+            job_url (str): job url
+            handler (callable): called with every new event record, defaults
+                to reporting it, see Reporter.event()
+            parser (RecapParser): when set, it receives every raw event
+            summary (str): None, 'text' or 'json', prints the summary
+                collected by parser when the job ends
+            log (file): when set, every record is appended to it too, as a
+                json line
+            hosts (HostLogs): when set, it receives every raw event
+        Raises:
+            GuardError
+        """
+        reporter = self.reporter
+        if handler is None:
+            def handler(record):
+                """
+                reports the record
+                """
+                reporter.event(job_url, record)
+        if log is not None:
+            print_handler = handler
+
+            def log_handler(record):
+                """
+                handles the record and logs it
+                """
+                print_handler(record)
+                write_log(log, u'{0}\n'.format(json.dumps(record,
+                                                          sort_keys=True)))
+            handler = log_handler
+
+        def event_handler(event):
+            """
+            handles a raw event
+            """
+            if parser is not None:
+                parser.feed_event(event)
+            if hosts is not None:
+                hosts.write(event)
+            handler(event_record(event))
+        last_id = 0
+        complete = False
+        api = self.api
+        status = None
+        started = time()
+        try:
+            while not complete:
+                complete = api.job_finished(job_url)
+                status = self._report_status(api, job_url, status)
+                # drain all the events produced since the last iteration
+                last_id = self._drain_events(api, job_url, last_id,
+                                             event_handler)
+                reporter.flush()
+                if not complete:
+                    sleep(self.sleep_interval)
+            result = api.job_status(job_url)
+            self._report_status(api, job_url, status)
+        except (KeyError, TypeError) as error:
+            msg = 'unexpected event data from {0}: {1}'.format(job_url, error)
+            raise GuardError(msg)
+        except (APIError, HostLogsError) as error:
+            raise GuardError(error)
+        reporter.timing('job', time() - started, job=job_url)
+        self._finish_hosts(hosts)
+
+        if parser is not None:
+            parser.close()
+            reporter.summary(parser, summary)
+
+        if result in FAILED_STATUSES:
             msg = 'job id {0}: ended with errors'.format(job_url)
             raise GuardError(msg)
 
-    def kick_and_monitor(self, template_name, extra_vars, limit, output_format):
+    def monitor_many(self, job_urls, output_format, labels=None, summary=None,
+                     workers=DEFAULT_WORKERS, apis=None, log_file=None):
+        """
+        Monitors the execution of many jobs at the same time. Every line of
+        output is prefixed with the label of its job. When all the jobs are
+        complete, it prints a table with their final status.
+
+        Args:
+            job_urls (list): job urls
+            output_format (str): text, ansi, events
+            labels (list): a label for each job, defaults to the job urls
+            summary (str): None, 'text' or 'json', see monitor(). The
+                summaries of all the jobs are merged together
+            workers (int): max number of jobs polled at the same time
+            apis (list): the api of each job, for jobs running on different
+                towers, defaults to the api of this guard
+            log_file (str): when set, the lines are appended to this file
+                too, as plain text, see monitor()
+        Returns:
+            (dict): final status of each job url
+        Raises:
+            GuardError
+        """
+        if labels is None:
+            labels = job_urls
+        if apis is None:
+            apis = [self.api] * len(job_urls)
+        jobs = [{'url': url, 'label': label, 'output': u'', 'last_id': 0,
+                 'parser': RecapParser() if summary else None, 'api': api,
+                 'status': None, 'started': time()}
+                for url, label, api in zip(job_urls, labels, apis)]
+        parsers = [job['parser'] for job in jobs]
+        statuses = {}
+        reporter = self.reporter
+
+        def poll(job):
+            """
+            returns the completion status and the new lines of a job
+            """
+            return self._poll_job(job, output_format)
+
+        log = self._open_log(log_file)
+        try:
+            while jobs:
+                polled = parallel_map(poll, jobs, workers=workers)
+                for job, (complete, new, lines) in zip(jobs, polled):
+                    job['status'] = self._report_status(
+                        job['api'], job['url'], job['status'],
+                        label=job['label'])
+                    if output_format == 'events':
+                        for record in new:
+                            reporter.event(job['url'], record,
+                                           label=job['label'])
+                    else:
+                        reporter.output(job['url'], new, u'\n'.join(lines),
+                                        label=job['label'])
+                    if log is not None and lines:
+                        write_log(log, u''.join(u'{0}\n'.format(
+                            strip_ansi(line)) for line in lines))
+                    if complete:
+                        statuses[job['url']] = job['api'].job_status(
+                            job['url'])
+                        self._report_status(job['api'], job['url'],
+                                            job['status'], label=job['label'])
+                        reporter.timing('job', time() - job['started'],
+                                        job=job['url'], label=job['label'])
+                        if job['output']:
+                            self.store_output(job['url'], job['output'])
+                jobs = [job for job in jobs if job['url'] not in statuses]
+                reporter.flush()
+                if jobs:
+                    sleep(self.sleep_interval)
+        except APIError as error:
+            raise GuardError(error)
+        finally:
+            if log is not None:
+                log.close()
+
+        if summary:
+            merged = RecapParser()
+            for parser in parsers:
+                parser.close()
+                merged.merge(parser)
+            merged.close()
+            reporter.summary(merged, summary)
+        rows = [(label, statuses[url]) for url, label in zip(job_urls, labels)]
+        reporter.table(('job', 'status'), rows,
+                       format_table(('job', 'status'), rows))
+        failed = [label for label, status in rows
+                  if status in FAILED_STATUSES]
+        if failed:
+            msg = '{0} ended with errors'.format(', '.join(failed))
+            raise GuardError(msg)
+        return statuses
+
+    def _poll_job(self, job, output_format):
+        """
+        A single monitor_many iteration for a job
+
+        Args:
+            job (dict): job state, updated in place
+            output_format (str): text, ansi, events
+        Returns:
+            (tuple): completion (bool), what's new (the new event records or
+                     the new output), the new lines to print (list)
+        Raises:
+            APIError
+        """
+        api = job['api']
+        complete = api.job_finished(job['url'])
+        prefix = '[{0}] '.format(job['label'])
+        if output_format == 'events':
+            records = []
+            lines = []
+            more = True
+            while more:
+                data = api.job_events(job['url'], last_id=job['last_id'])
+                for event in data['results']:
+                    job['last_id'] = event['id']
+                    if job['parser'] is not None:
+                        job['parser'].feed_event(event)
+                    record = event_record(event)
+                    record['job'] = job['label']
+                    records.append(record)
+                    lines.append(json.dumps(record, sort_keys=True))
+                more = bool(data.get('next')) and bool(data['results'])
+            return complete, records, lines
+        output = api.job_stdout(job['url'], output_format)
+        new_output = output.replace(job['output'], '')
+        job['output'] = output
+        if job['parser'] is not None:
+            job['parser'].feed(new_output)
+        return complete, new_output, [prefix + line for line
+                                      in new_output.strip().splitlines()]
+
+    def kick_and_monitor(self, template_name, extra_vars, limit, output_format,
+                         summary=None, slices=1, refresh_ttl=None,
+                         dedupe=False, log_file=None):
         """
         Starts a job and monitors its execution
 
@@ -226,14 +1447,57 @@ class Guard(object):
             extra_vars (list|tuple): extra variables
             output_format (str): output format
             limit (str): limit to the following hosts
+            summary (str): None, 'text' or 'json', see monitor()
+            slices (int): when greater than 1, the inventory is split in
+                slices and a job is started for each of them
+            refresh_ttl (int): when set, the inventory sources older than
+                refresh_ttl seconds are synced before the launch, see
+                refresh_inventory()
+            dedupe (bool): when an identical job is already pending or
+                running, monitor it instead of starting a new one, see
+                find_duplicate()
+            log_file (str): plain text copy of the output, see monitor()
         Raises:
             GuardError
         """
+        if slices > 1 and limit:
+            raise GuardError('limit cannot be used together with slices')
+        if slices > 1 and dedupe:
+            raise GuardError('dedupe cannot be used together with slices')
+        if slices > 1:
+            if refresh_ttl is not None:
+                self.refresh_inventory(template_name, refresh_ttl)
+            jobs = self.kick_slices(template_name, extra_vars, slices)
+            job_urls = [self.launch_data_to_url(job) for job in jobs]
+            labels = ['slice {0}/{1}'.format(index + 1, len(jobs))
+                      for index in range(len(jobs))]
+            for job_url, label in zip(job_urls, labels):
+                self.reporter.launch(job_url, None, label=label)
+            self.monitor_many(job_urls, output_format, labels=labels,
+                              summary=summary, log_file=log_file)
+            return
         try:
-            template_id = self.get_template_id(template_name)
-            job = self.kick(template_id, extra_vars, limit)
-            job_url = self.launch_data_to_url(job)
-            self.monitor(job_url, output_format)
+            job = None
+            if dedupe:
+                template = self.get_template(template_name)
+                template_id = template['id']
+                job = self.find_duplicate(template, extra_vars, limit)
+            else:
+                template_id = self.get_template_id(template_name)
+            if job is not None:
+                job_url = self.launch_data_to_url(job)
+                self.reporter.emit('attach',
+                                   'Attaching to job: {0}'.format(job_url),
+                                   job=job_url)
+            else:
+                # an attached job does not need a fresh inventory
+                if refresh_ttl is not None:
+                    self.refresh_inventory(template_name, refresh_ttl)
+                job = self.kick(template_id, extra_vars, limit)
+                job_url = self.launch_data_to_url(job)
+                self.reporter.launch(job_url, None, limit=limit or None)
+            self.monitor(job_url, output_format, summary=summary,
+                         log_file=log_file)
         except APIError as error:
             raise GuardError(error)
 
@@ -274,6 +1538,77 @@ class Guard(object):
         except APIError as error:
             raise GuardError(error)
 
+    def grant_permissions(self, grants, workers=DEFAULT_WORKERS):
+        """
+        Grants many template permissions at once. Roles are read with a
+        single request, users are resolved in bulk, their current roles are
+        looked up in parallel, roles that are already granted are skipped and
+        the remaining ones are granted in parallel.
+
+        Args:
+            grants (list): (username, template name, permission) tuples
+            workers (int): max number of concurrent requests
+        Returns:
+            (list): (username, template name, permission, status) tuples,
+                    status is 'granted', 'already granted' or 'error: ...'
+                    when the role cannot be granted
+        Raises:
+            GuardError
+        """
+        grants = list(grants)
+        roles = self.template_roles()
+        missing = sorted(set(
+            '{0} ({1})'.format(template, permission)
+            for _, template, permission in grants
+            if (template.lower(), permission.lower()) not in roles))
+        if missing:
+            msg = 'No role found for: {0}'.format(', '.join(missing))
+            raise GuardError(msg)
+
+        api = self.api
+        usernames = sorted(set(grant[0] for grant in grants))
+        try:
+            user_ids = api.user_ids(usernames)
+            granted = parallel_map(api.user_roles,
+                                   [user_ids[name] for name in usernames],
+                                   workers=workers)
+        except APIError as error:
+            raise GuardError(error)
+        granted = dict((user_ids[name], set(role['id'] for role in user_roles))
+                       for name, user_roles in zip(usernames, granted))
+
+        results = []
+        # (user id, role id) -> rows of the role, the first one grants it
+        todo = {}
+        for username, template, permission in grants:
+            user_id = user_ids[username]
+            role_id = roles[(template.lower(), permission.lower())]
+            status = 'already granted'
+            if (user_id, role_id) in todo:
+                todo[(user_id, role_id)].append(len(results))
+            elif role_id not in granted[user_id]:
+                todo[(user_id, role_id)] = [len(results)]
+                status = 'granted'
+            results.append([username, template, permission, status])
+
+        def grant(user_role):
+            """
+            Grants a single role, returns the error, if any
+            """
+            try:
+                self.user_role(*user_role)
+            except GuardError as error:
+                return error
+            return None
+
+        user_roles = sorted(todo)
+        errors = parallel_map(grant, user_roles, workers=workers)
+        for user_role, error in zip(user_roles, errors):
+            if error is not None:
+                for row in todo[user_role]:
+                    results[row][3] = 'error: {0}'.format(error)
+        return [tuple(row) for row in results]
+
     def ad_hoc(self, ad_hoc):
         """
         Starts a ad hoc job in ansible tower
@@ -285,7 +1620,7 @@ class Guard(object):
         api = self.api
         try:
             result = api.launch_ad_hoc(ad_hoc)
-            return json.loads(result.text)
+            return codec.decode_response(result)
         except APIError as error:
             raise GuardError(error)
 
@@ -308,22 +1643,105 @@ class Guard(object):
         except APIError as error:
             raise GuardError(error)
 
-    def ad_hoc_and_monitor(self, ad_hoc, output_format):
+    def ad_hoc_and_monitor(self, ad_hoc, output_format, summary=None,
+                           log_file=None):
         """
         Starts an ad hoc job and outputs the job output on stdout
 
         Args:
             ad_hoc (AdHoc): ad hoc object
             output_format (str): output format, it can be ansi or txt
+            summary (str): None, 'text' or 'json', see monitor()
+            log_file (str): plain text copy of the output, see monitor()
         Raises:
             GuardError
         """
         job = self.ad_hoc(ad_hoc)
         job_url = self.launch_data_to_url(job)
+        self.reporter.launch(job_url, None, limit=ad_hoc.limit or None)
         job_id = job['id']
         # wait for job to be started
         self.wait_for_job_to_start(job_id)
-        self.monitor(job_url, output_format=output_format)
+        self.monitor(job_url, output_format=output_format, summary=summary,
+                     log_file=log_file)
+
+    def _resolve_ids(self, names, resolver):
+        """
+        Resolves names into ids, every distinct name is looked up only once,
+        in bulk. Values that are already ids are kept
+
+        Args:
+            names (iterable): names (or ids)
+            resolver (callable): bulk api method transforming names into a
+                                 name -> id dictionary, e.g. inventory_ids
+        Returns:
+            (dict): name -> id
+        Raises:
+            APIError
+        """
+        names = sorted(set(names), key=str)
+        to_resolve = []
+        for name in names:
+            try:
+                int(name)
+            except ValueError:
+                to_resolve.append(name)
+        ids = dict((name, name) for name in names)
+        if to_resolve:
+            ids.update(resolver(to_resolve))
+        return ids
+
+    def ad_hoc_fan_out(self, ad_hoc, inventories, limits, output_format,
+                       workers=DEFAULT_WORKERS):
+        """
+        Runs the same ad hoc command on many inventories and/or limits at the
+        same time and monitors all of them. Inventories and credential are
+        resolved once, at most 'workers' commands are launched at the same
+        time.
+
+        Args:
+            ad_hoc (AdHoc): the command to run, its inventory is ignored
+            inventories (list): inventory names or ids
+            limits (list): limit patterns, an empty list means no limit
+            output_format (str): output format, it can be ansi, txt or events
+            workers (int): max number of concurrent launches and polls
+        Returns:
+            (dict): final status of each job url
+        Raises:
+            GuardError
+        """
+        limits = list(limits) or [ad_hoc.limit or '']
+        targets = [(inventory, limit) for inventory in inventories
+                   for limit in limits]
+        api = self.api
+        try:
+            inventory_ids = self._resolve_ids(inventories, api.inventory_ids)
+            credential = self._resolve_ids([ad_hoc.credential_id],
+                                           api.credential_ids)
+        except APIError as error:
+            raise GuardError(error)
+
+        commands = []
+        for inventory, limit in targets:
+            command = copy.copy(ad_hoc)
+            command.inventory_id = inventory_ids[inventory]
+            command.credential_id = credential[ad_hoc.credential_id]
+            command.limit = limit
+            commands.append(command)
+        jobs = self._launch_many(self.ad_hoc, commands, workers=workers)
+        # ad hoc jobs do not start immediately, see ad_hoc_and_monitor
+        parallel_map(self.wait_for_job_to_start, [job['id'] for job in jobs],
+                     workers=workers)
+
+        job_urls = [self.launch_data_to_url(job) for job in jobs]
+        labels = []
+        for (inventory, limit), job in zip(targets, jobs):
+            target = ':'.join(str(part) for part in (inventory, limit) if part)
+            labels.append('{0} #{1}'.format(target, job['id']))
+        for job_url, label in zip(job_urls, labels):
+            self.reporter.launch(job_url, None, label=label)
+        return self.monitor_many(job_urls, output_format, labels=labels,
+                                 workers=workers)
 
     def job_url(self, job_id):
         """
@@ -344,3 +1762,85 @@ class Guard(object):
             return api.job_url(job_id)
         except APIError as error:
             raise GuardError(error)
+
+
+def kick_profiles(guards, template_name, extra_vars, limit):
+    """
+    Starts the same template on many towers (profiles) at the same time
+
+    Args:
+        guards (dict): profile name -> Guard
+        template_name (str): Name of the template
+        extra_vars (dict): extra variables
+        limit (str): limit to the following hosts
+    Returns:
+        (list): (profile, job url or None, error or None) tuples, sorted by
+                profile
+    """
+    profiles = sorted(guards)
+
+    def kick(profile):
+        """
+        Starts the job on a single tower, errors are returned, not raised,
+        so a broken region does not stop the others
+        """
+        guard = guards[profile]
+        try:
+            template_id = guard.get_template_id(template_name)
+            job = guard.kick(template_id, extra_vars, limit)
+            return guard.launch_data_to_url(job), None
+        except GuardError as error:
+            return None, str(error)
+
+    return [(profile,) + result
+            for profile, result in zip(profiles,
+                                       parallel_map(kick, profiles))]
+
+
+def kick_and_monitor_profiles(guards, template_name, extra_vars, limit,
+                              output_format, summary=None, log_file=None):
+    """
+    Starts the same template on many towers (profiles) at the same time and
+    monitors all the jobs, the output of each job is prefixed with its
+    profile. Every tower is polled through its own guard.
+
+    Args:
+        guards (dict): profile name -> Guard
+        template_name (str): Name of the template
+        extra_vars (dict): extra variables
+        limit (str): limit to the following hosts
+        output_format (str): output format
+        summary (str): None, 'text' or 'json', see Guard.monitor()
+        log_file (str): plain text copy of the output, see Guard.monitor()
+    Returns:
+        (dict): profile -> final status of its job
+    Raises:
+        GuardError: if any job could not be started or failed
+    """
+    launched = kick_profiles(guards, template_name, extra_vars, limit)
+    statuses = {}
+    errors = []
+    for profile, _, error in launched:
+        if error is not None:
+            statuses[profile] = 'not started'
+            errors.append('{0}: {1}'.format(profile, error))
+    started = [(profile, url) for profile, url, error in launched
+               if error is None]
+    if started:
+        guard = guards[started[0][0]]
+        for profile, url in started:
+            guard.reporter.launch(url, None, label=profile)
+        try:
+            job_statuses = guard.monitor_many(
+                [url for _, url in started], output_format,
+                labels=[profile for profile, _ in started], summary=summary,
+                apis=[guards[profile].api for profile, _ in started],
+                log_file=log_file)
+        except GuardError as error:
+            errors.append(str(error))
+            job_statuses = {}
+        for profile, url in started:
+            statuses[profile] = job_statuses.get(url, 'failed')
+    if errors:
+        raise GuardError('; '.join(errors))
+    return statuses
@@ -4,6 +4,13 @@ Collection of utils for the tower companion
 """
 from __future__ import print_function
 import os
+import re
+from datetime import datetime
+
+# CSI sequences (colors, cursor movements) and the few two chars escapes
+ANSI_ESCAPE = re.compile(r'\x1b(?:\[[0-9;?]*[ -/]*[@-~]|[@-Z\\-_])')
+# tower timestamps are UTC, with or without microseconds
+TOWER_DATETIME_FORMATS = ('%Y-%m-%dT%H:%M:%S.%fZ', '%Y-%m-%dT%H:%M:%SZ')
 
 
 class BadKarma(Exception):
@@ -37,3 +44,66 @@ def which(executable):
     msg = "{0} is not in your path. Giving up. Have a good day".format(
         executable)
     raise BadKarma(msg)
+
+
+def strip_ansi(text):
+    """
+    Removes ANSI escape sequences from text
+
+    Args:
+        text (str): text, with or without colors
+
+    Returns:
+        (str): plain text
+    """
+    if '\x1b' not in text:
+        # nothing to do here, quite common with txt outputs
+        return text
+    return ANSI_ESCAPE.sub('', text)
+
+
+def format_table(headers, rows):
+    """
+    Formats rows as a plain text table, columns are aligned to the left
+
+    Args:
+        headers (list): column names
+        rows (list): list of rows, every row is a list of values
+
+    Returns:
+        (str): the table
+    """
+    rows = [[str(value) for value in row] for row in rows]
+    widths = [len(header) for header in headers]
+    for row in rows:
+        widths = [max(width, len(value)) for width, value in zip(widths, row)]
+    lines = [headers, ['-' * width for width in widths]] + rows
+    return '\n'.join('  '.join(value.ljust(width)
+                               for value, width in zip(line, widths)).rstrip()
+                     for line in lines)
+
+
+def seconds_since(timestamp, now=None):
+    """
+    Returns the number of seconds elapsed since a tower timestamp
+
+    Args:
+        timestamp (str): tower timestamp, e.g. 2017-03-28T10:00:00.123Z
+        now (datetime): current UTC time, defaults to utcnow()
+
+    Returns:
+        (float|None): elapsed seconds, None when timestamp is empty or it
+                      cannot be parsed
+    """
+    if not timestamp:
+        return None
+    for datetime_format in TOWER_DATETIME_FORMATS:
+        try:
+            then = datetime.strptime(timestamp, datetime_format)
+            break
+        except ValueError:
+            continue
+    else:
+        return None
+    now = now or datetime.utcnow()
+    return (now - then).total_seconds()
@@ -35,3 +35,34 @@ def module_name(name):
     if not name:
         return False
     return name in VALID_AD_HOC_MODULES
+
+
+def forks(value):
+    """
+    Validates the number of forks of an ad hoc command: a non negative
+    integer (0 means tower default) or 'auto'
+
+    Args:
+        value (int|str): forks
+
+    Returns:
+        boolean
+    """
+    if value == 'auto':
+        return True
+    return isinstance(value, int) and not isinstance(value, bool) \
+        and value >= 0
+
+
+def verbosity(value):
+    """
+    Validates an ad hoc verbosity level, from 0 (normal) to 4 (connection
+    debug)
+
+    Args:
+        value (int): verbosity
+
+    Returns:
+        boolean
+    """
+    return value in (0, 1, 2, 3, 4) and not isinstance(value, bool)
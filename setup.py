@@ -99,6 +99,13 @@ setup(
         'click==6.6',
     ],
 
+    # Optional, faster, json decoders for the api responses:
+    # pip install tower-companion[speedups]
+    extras_require={
+        'speedups': ['orjson; python_version >= "3.6"',
+                     'ujson; python_version < "3.6"'],
+    },
+
     # To provide executable scripts, use entry points in preference to the
     # "scripts" keyword. Entry points provide cross-platform support and allow
     # pip to create the appropriate form of executable for the target platform.
@@ -110,7 +117,13 @@ setup(
             'ad_hoc_and_monitor=lib.cli:cli_ad_hoc_and_monitor',
             'ad_hoc=lib.cli:cli_ad_hoc',
             'template_permissions=lib.cli:cli_template_permissions',
-            'update_project=lib.cli:cli_update_project'
+            'update_project=lib.cli:cli_update_project',
+            'relaunch_failed=lib.cli:cli_relaunch_failed',
+            'ad_hoc_fan_out=lib.cli:cli_ad_hoc_fan_out',
+            'bulk_template_permissions=lib.cli:cli_bulk_template_permissions',
+            'archive=lib.cli:cli_archive',
+            'grep_jobs=lib.cli:cli_grep_jobs',
+            'view_output=lib.cli:cli_view_output',
         ],
     },
     tests_require=['tox'],
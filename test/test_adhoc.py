@@ -47,3 +47,29 @@ def test_ids(monkeypatch):
     adhoc.inventory_id = ''
     with pytest.raises(AdHocError):
         adhoc.is_valid()
+
+
+def test_tuning(monkeypatch):
+    adhoc = AdHoc()
+    monkeypatch.setattr('lib.adhoc.AdHoc._is_valid_module_name', mockreturn)
+    adhoc.inventory_id = 1
+    adhoc.credential_id = 2
+    data = adhoc.data()
+    # tower defaults are used unless forks and verbosity are set
+    assert 'forks' not in data
+    assert 'verbosity' not in data
+
+    adhoc.forks = 25
+    adhoc.verbosity = 3
+    data = adhoc.data()
+    assert data['forks'] == 25
+    assert data['verbosity'] == 3
+
+    adhoc.forks = -1
+    with pytest.raises(AdHocError):
+        adhoc.is_valid()
+
+    adhoc.forks = 'auto'
+    adhoc.verbosity = 9
+    with pytest.raises(AdHocError):
+        adhoc.is_valid()
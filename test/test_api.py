@@ -1,7 +1,9 @@
 from __future__ import print_function
 import os
 import json
+import threading
 import pytest
+import requests
 from lib.adhoc import AdHoc, AdHocError
 from lib.api import APIv1, APIError
 from lib.configuration import Config
@@ -21,6 +23,19 @@ class MockRequest(object):
         self.text = None
         self.json = None
 
+    @property
+    def content(self):
+        return self.text.encode('utf-8')
+
+    def iter_content(self, chunk_size=1):
+        content = self.content
+        for start in range(0, len(content), chunk_size):
+            self.read = start + chunk_size
+            yield content[start:start + chunk_size]
+
+    def close(self):
+        self.closed = True
+
 
 def basic_api():
     config = Config(None)
@@ -95,6 +110,109 @@ def test_post(monkeypatch):
     api._post(url='', params={}, data={})
 
 
+def test_request_limiter(monkeypatch):
+    api = basic_api()
+    codes = [200, 503, 200]
+
+    def mockreturn(*args, **kwargs):
+        mock = MockRequest()
+        mock.status_code = codes.pop(0)
+        mock.text = '{}'
+        mock.reason = 'test'
+        return mock
+
+    def mockerror(*args, **kwargs):
+        raise requests.exceptions.ConnectionError
+
+    monkeypatch.setattr('requests.get', mockreturn)
+    api._get(url='', params={}, data={})
+    stats = api.concurrency_stats()
+    assert stats['requests'] == 1
+    assert stats['backoffs'] == 0
+    with pytest.raises(APIError):
+        api._get(url='', params={}, data={})
+    assert api.concurrency_stats()['backoffs'] == 1
+
+    monkeypatch.setattr('requests.get', mockerror)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        api._get(url='', params={}, data={})
+    stats = api.concurrency_stats()
+    assert stats['backoffs'] == 2
+    assert stats['in_flight'] == 0
+
+    api.config.update('max_concurrency', '3')
+    assert APIv1(api.config).limiter.maximum == 3
+    api.config.update('max_concurrency', 'many')
+    with pytest.raises(APIError):
+        APIv1(api.config)
+
+
+def test_nodes_failover(monkeypatch):
+    config = basic_api().config
+    config.update('nodes', 'node1, node2')
+    api = APIv1(config)
+    assert api.nodes.hosts == ['node1', 'node2']
+    monkeypatch.setattr('lib.api.APIv1.ping', lambda self, host: 0.1)
+    urls = []
+
+    def mockreturn(url, **kwargs):
+        urls.append(url)
+        if url.startswith('https://node1/'):
+            raise requests.exceptions.ConnectionError
+        mock = MockRequest()
+        mock.status_code = 200
+        mock.text = '{"status": "running"}'
+        return mock
+
+    monkeypatch.setattr('requests.get', mockreturn)
+    monkeypatch.setattr('requests.post', mockreturn)
+    job_url = 'https://{0}/api/v1/jobs/1/'.format(HOST)
+    for _ in range(4):
+        assert api.job_status(job_url) == 'running'
+    # node1 failed at most once, then all the requests go to node2
+    assert urls.count('https://node1/api/v1/jobs/1/') <= 1
+    assert urls.count('https://node2/api/v1/jobs/1/') == 4
+    assert 'node1' not in api.nodes.healthy()
+    # other hosts are not rewritten
+    api.job_status('https://elsewhere/api/v1/jobs/1/')
+    assert urls[-1] == 'https://elsewhere/api/v1/jobs/1/'
+
+    # posts are never sent twice
+    del urls[:]
+    monkeypatch.setattr(api.nodes, 'pick', lambda exclude=(): 'node1')
+    with pytest.raises(requests.exceptions.ConnectionError):
+        api._post(job_url, params={}, data={})
+    assert urls == ['https://node1/api/v1/jobs/1/']
+
+    # no node left
+    def mockerror(url, **kwargs):
+        raise requests.exceptions.ConnectionError
+
+    monkeypatch.undo()
+    monkeypatch.setattr('lib.api.APIv1.ping', lambda self, host: 0.1)
+    monkeypatch.setattr('requests.get', mockerror)
+    api = APIv1(config)
+    with pytest.raises(APIError):
+        api.job_status(job_url)
+
+
+def test_ping(monkeypatch):
+    def mockreturn(url, **kwargs):
+        assert url == 'https://node1/api/v1/ping/'
+        mock = MockRequest()
+        mock.status_code = status[0]
+        mock.reason = 'test'
+        return mock
+
+    status = [200]
+    monkeypatch.setattr('requests.get', mockreturn)
+    api = basic_api()
+    assert api.ping('node1') >= 0
+    status[0] = 502
+    with pytest.raises(APIError):
+        api.ping('node1')
+
+
 def test_post_error(monkeypatch):
     api = basic_api()
 
@@ -207,6 +325,49 @@ def test_get_ids_zero_results(monkeypatch):
             api.credential_id(name='')
 
 
+def test_get_ids(monkeypatch):
+    records = {'web': [{'id': 1, 'name': 'web'}],
+               'db': [{'id': 2, 'name': 'db'}, {'id': 3, 'name': 'db'}],
+               'a,b': [{'id': 4, 'name': 'a,b'}]}
+    queries = []
+
+    def mockreturn(self, url, params):
+        queries.append(dict(params))
+        if 'name__in' in params:
+            names = params['name__in'].split(',')
+        else:
+            names = [params['name']]
+        return [data for name in names for data in records.get(name, [])]
+
+    monkeypatch.setattr('lib.api.APIv1._get_all_results', mockreturn)
+    api = basic_api()
+    assert api.inventory_ids(['web', 'a,b', 'web']) == {'web': 1, 'a,b': 4}
+    # names with commas are looked up on their own
+    assert sorted(query['name'] for query in queries) == ['a,b', 'web']
+    # resolved names are cached
+    del queries[:]
+    assert api.inventory_ids(['web']) == {'web': 1}
+    assert queries == []
+
+    # every missing or ambiguous name is reported
+    with pytest.raises(APIError) as error:
+        api.inventory_ids(['db', 'nope', 'gone'])
+    assert '"gone", "nope"' in str(error.value)
+    assert 'Multiple id related to "db"' in str(error.value)
+
+    # long lists are split in many requests
+    del queries[:]
+    api.MAX_FILTER_LENGTH = 12
+    with pytest.raises(APIError):
+        api.inventory_ids(['name{0}'.format(i) for i in range(10)])
+    assert len(queries) == 5
+    assert all(len(query['name__in']) == 11 for query in queries)
+
+    api.user_ids([])
+    api.template_ids([])
+    api.credential_ids([])
+
+
 def test_launch_template_id(monkeypatch):
     expected_id = 123
     fake_text = json.dumps({'results': [{'id': expected_id}]})
@@ -315,7 +476,7 @@ def test_job_status(monkeypatch):
 
 
 def test_job_finished(monkeypatch):
-    for status in ('successful', 'canceled', 'failed'):
+    for status in ('successful', 'canceled', 'failed', 'error'):
         text = json.dumps({'status': status})
 
         def mockreturn(*args, **kwargs):
@@ -327,7 +488,7 @@ def test_job_finished(monkeypatch):
         monkeypatch.setattr('requests.get', mockreturn)
         assert api.job_finished(job_url='') == True
 
-    for status in ('error', 'still running', 'failed-'):
+    for status in ('running', 'still running', 'failed-'):
         text = json.dumps({'status': status})
 
         def mockreturn(*args, **kwargs):
@@ -458,3 +619,333 @@ def test_job_url(monkeypatch):
     api = basic_api()
     monkeypatch.setattr('lib.api.APIv1.job_info', mockreturn)
     assert expected_url in api.job_url(job_id='')
+
+
+def test_job_events(monkeypatch):
+    api = basic_api()
+    job_url = 'https://example.com/api/v1/jobs/1/'
+    assert api.job_events_url(job_url).endswith('/jobs/1/job_events/')
+    ad_hoc_url = 'https://example.com/api/v1/ad_hoc_commands/1'
+    assert api.job_events_url(ad_hoc_url).endswith('/ad_hoc_commands/1/events/')
+
+    calls = []
+
+    def mockreturn(self, url, params, data=None):
+        calls.append((url, params))
+        return {'results': [], 'next': None}
+
+    monkeypatch.setattr('lib.api.APIv1._get_json', mockreturn)
+    api.job_events(job_url, last_id=42)
+    url, params = calls[0]
+    assert url.endswith('/job_events/')
+    assert params['id__gt'] == 42
+    assert params['order_by'] == 'id'
+
+
+def test_get_all_results(monkeypatch):
+    pages = {'first': {'results': [1, 2], 'next': '/api/v1/next/?page=2'},
+             'https://example.com/api/v1/next/?page=2': {'results': [3],
+                                                         'next': None}}
+    seen_params = []
+
+    def mockreturn(self, url, params, data=None):
+        seen_params.append(dict(params))
+        return pages[url]
+
+    monkeypatch.setattr('lib.api.APIv1._get_json', mockreturn)
+    api = basic_api()
+    assert api._get_all_results('first', params={'a': 1}) == [1, 2, 3]
+    assert seen_params == [{'a': 1}, {}]
+
+
+def test_job_failed_hosts(monkeypatch):
+    calls = []
+
+    def mock_job(self, url, params, data=None):
+        calls.append((url, params))
+        return {'results': [{'host_name': 'web-01'}], 'next': None}
+
+    monkeypatch.setattr('lib.api.APIv1._get_json', mock_job)
+    api = basic_api()
+    assert api.job_failed_hosts(job_id=12) == [{'host_name': 'web-01'}]
+    url, params = calls[0]
+    assert url.endswith('/jobs/12/job_host_summaries/')
+    assert params['failed'] == 'true'
+    api.job_data(job_id=12)
+    assert calls[1][0].endswith('/jobs/12/')
+
+
+def test_user_roles(monkeypatch):
+    calls = []
+
+    def mockreturn(self, url, params, data=None):
+        calls.append(url)
+        return {'results': [{'id': 4}], 'next': None}
+
+    monkeypatch.setattr('lib.api.APIv1._get_json', mockreturn)
+    api = basic_api()
+    assert api.user_roles(user_id=7) == [{'id': 4}]
+    assert calls[0].endswith('/users/7/roles/')
+
+
+def test_inventory_sources(monkeypatch):
+    calls = []
+
+    def mock_get(self, url, params, data=None):
+        calls.append(url)
+        return {'results': [{'id': 4, 'name': 'ec2'}], 'next': None}
+
+    def mock_post(self, url, params, data):
+        calls.append(url)
+        mock = MockRequest()
+        mock.text = json.dumps({'inventory_update': 12})
+        return mock
+
+    monkeypatch.setattr('lib.api.APIv1._get_json', mock_get)
+    monkeypatch.setattr('lib.api.APIv1._post', mock_post)
+    api = basic_api()
+    assert api.inventory_sources(3) == [{'id': 4, 'name': 'ec2'}]
+    assert calls[0].endswith('/inventories/3/inventory_sources/')
+    assert api.update_inventory_source(4).endswith(
+        '/api/v1/inventory_updates/12/')
+    assert calls[1].endswith('/inventory_sources/4/update/')
+    assert api.project_update_url({'project_update': 5}).endswith(
+        '/api/v1/project_updates/5/')
+    with pytest.raises(APIError):
+        api.project_update_url({})
+
+
+def test_active_jobs(monkeypatch):
+    calls = []
+
+    def mockreturn(self, url, params, data=None):
+        calls.append((url, params))
+        return {'results': [{'id': 4}], 'next': None}
+
+    monkeypatch.setattr('lib.api.APIv1._get_json', mockreturn)
+    api = basic_api()
+    assert api.active_jobs(template_id=7) == [{'id': 4}]
+    url, params = calls[0]
+    assert url.endswith('/api/v1/jobs/')
+    assert params['job_template'] == 7
+    assert params['status__in'] == 'pending,waiting,running'
+
+
+def test_capacity_endpoints(monkeypatch):
+    calls = []
+
+    def mockreturn(self, url, params, data=None):
+        calls.append((url, params))
+        return {'results': [{'id': 1, 'capacity': 10}], 'count': 1,
+                'next': None}
+
+    monkeypatch.setattr('lib.api.APIv1._get_json', mockreturn)
+    api = basic_api()
+    assert api.jobs_count(['pending', 'waiting']) == 1
+    assert calls[-1][0].endswith('/unified_jobs/')
+    assert calls[-1][1]['status__in'] == 'pending,waiting'
+    assert api.instances() == [{'id': 1, 'capacity': 10}]
+    assert calls[-1][0].endswith('/instances/')
+    assert api.instance_group_data('eu') == {'id': 1, 'capacity': 10}
+    assert calls[-1][0].endswith('/instance_groups/')
+
+
+def test_auto_forks(monkeypatch):
+    api = basic_api()
+    total_hosts = {'total_hosts': 12}
+
+    def mockreturn(self, url, params, data=None):
+        assert url.endswith('/inventories/3/')
+        return total_hosts
+
+    monkeypatch.setattr('lib.api.APIv1._get_json', mockreturn)
+    assert api.max_forks() == APIv1.MAX_FORKS
+    assert api.auto_forks(3) == 12
+
+    api.config.update('max_forks', '5')
+    assert api.auto_forks(3) == 5
+
+    total_hosts['total_hosts'] = 0
+    assert api.auto_forks(3) == 1
+
+    del total_hosts['total_hosts']
+    with pytest.raises(APIError):
+        api.auto_forks(3)
+
+    api.config.update('max_forks', 'many')
+    with pytest.raises(APIError):
+        api.max_forks()
+
+
+def test_ad_hoc_to_api_auto_forks(monkeypatch):
+    api = basic_api()
+    monkeypatch.setattr('lib.api.APIv1.auto_forks', lambda self, inv: 7)
+    ad_hoc = AdHoc()
+    ad_hoc.module_name = 'command'
+    ad_hoc.inventory_id = 1
+    ad_hoc.credential_id = 2
+    ad_hoc.forks = 'auto'
+    data = api.adhoc_to_api(ad_hoc)
+    assert data['forks'] == 7
+    # the original ad hoc command still asks for auto forks
+    assert ad_hoc.forks == 'auto'
+
+
+def test_get_id_cache(monkeypatch):
+    requests_count = []
+
+    def mockreturn(self, name, endpoint):
+        requests_count.append(name)
+        return {'count': 1, 'results': [{'id': 3, 'total_hosts': 4}]}
+
+    monkeypatch.setattr('lib.api.APIv1._get_data_by_name', mockreturn)
+    api = basic_api()
+    assert api.inventory_id('eu') == 3
+    assert api.inventory_id('eu') == 3
+    assert requests_count == ['eu']
+    # the inventory data is reused by auto_forks
+    assert api.auto_forks(3) == 4
+    assert requests_count == ['eu']
+
+
+def test_ad_hoc_to_api_names(monkeypatch):
+    # each lookup waits for the other one: they must run concurrently
+    inventory_started = threading.Event()
+    credential_started = threading.Event()
+
+    def mock_inventory_id(self, name):
+        inventory_started.set()
+        assert credential_started.wait(5)
+        return 10
+
+    def mock_credential_id(self, name):
+        credential_started.set()
+        assert inventory_started.wait(5)
+        return 20
+
+    monkeypatch.setattr('lib.api.APIv1.inventory_id', mock_inventory_id)
+    monkeypatch.setattr('lib.api.APIv1.credential_id', mock_credential_id)
+    api = basic_api()
+    ad_hoc = AdHoc()
+    ad_hoc.module_name = 'command'
+    ad_hoc.inventory_id = 'eu'
+    ad_hoc.credential_id = 'ssh'
+    data = api.adhoc_to_api(ad_hoc)
+    assert data['inventory'] == 10
+    assert data['credential'] == 20
+    # the ad hoc object is untouched
+    assert ad_hoc.inventory_id == 'eu'
+    assert ad_hoc.credential_id == 'ssh'
+
+
+def test_iter_results(monkeypatch):
+    pages = {None: {'count': 3, 'next': '/api/v1/roles/?page=2',
+                    'results': [{'id': 1}, {'id': 2}]},
+             '2': {'count': 3, 'next': None, 'results': [{'id': 3}]}}
+    responses = []
+
+    def mockreturn(url, **kwargs):
+        assert kwargs['stream']
+        mock = MockRequest()
+        mock.status_code = 200
+        mock.text = json.dumps(pages[url.partition('page=')[2] or None])
+        responses.append(mock)
+        return mock
+
+    monkeypatch.setattr('requests.get', mockreturn)
+    api = basic_api()
+    api.STREAM_CHUNK_SIZE = 4
+    assert [role['id'] for role in api.roles()] == [1, 2, 3]
+    assert len(responses) == 2
+    assert all(response.closed for response in responses)
+
+    # stopping early does not download the rest of the listing
+    del responses[:]
+    roles = api.roles()
+    assert next(roles) == {'id': 1}
+    roles.close()
+    assert len(responses) == 1
+    assert responses[0].closed
+    assert responses[0].read < len(responses[0].content)
+
+    def mockerror(url, **kwargs):
+        mock = MockRequest()
+        mock.status_code = 200
+        mock.text = '{"results": [{"id": 1}, {"id"'
+        return mock
+
+    monkeypatch.setattr('requests.get', mockerror)
+    with pytest.raises(APIError):
+        list(api.roles())
+
+
+def test_download_stdout(monkeypatch):
+    calls = []
+
+    def mockreturn(url, **kwargs):
+        calls.append((url, kwargs))
+        mock = MockRequest()
+        mock.text = 'job output'
+        mock.status_code = statuses.pop(0)
+        mock.reason = 'Not Found'
+        return mock
+
+    monkeypatch.setattr('requests.get', mockreturn)
+    api = basic_api()
+    statuses = [200]
+    start, chunks = api.download_stdout(12, chunk_size=4)
+    assert start == 0
+    assert b''.join(chunks) == b'job output'
+    url, kwargs = calls[-1]
+    assert url == 'https://example.com/api/v1/jobs/12/stdout/'
+    assert kwargs['params'] == {'format': 'txt_download'}
+    assert kwargs['headers'] == {}
+    assert kwargs['stream']
+
+    statuses = [206]
+    start, chunks = api.download_stdout(12, offset=4)
+    assert start == 4
+    assert calls[-1][1]['headers'] == {'Range': 'bytes=4-'}
+    # tower ignored the range, the whole output is sent again
+    statuses = [200]
+    assert api.download_stdout(12, offset=4)[0] == 0
+    # nothing left to download
+    statuses = [416]
+    start, chunks = api.download_stdout(12, offset=10)
+    assert start == 10
+    assert list(chunks) == []
+
+    statuses = [404]
+    with pytest.raises(APIError):
+        api.download_stdout(12)
+
+
+def test_download_stdout_broken(monkeypatch):
+    def iter_content(self, chunk_size=1):
+        yield b'job '
+        raise requests.exceptions.ChunkedEncodingError('connection reset')
+
+    def mockreturn(url, **kwargs):
+        mock = MockRequest()
+        mock.status_code = 200
+        return mock
+
+    monkeypatch.setattr('requests.get', mockreturn)
+    monkeypatch.setattr(MockRequest, 'iter_content', iter_content)
+    api = basic_api()
+    start, chunks = api.download_stdout(12)
+    assert next(chunks) == b'job '
+    with pytest.raises(APIError):
+        next(chunks)
+
+
+def test_job_ids(monkeypatch):
+    def mockreturn(self, endpoint, params):
+        assert endpoint == 'jobs'
+        assert params['status'] == 'failed'
+        assert params['order_by'] == '-id'
+        return iter([{'id': 3}, {'id': 2}])
+
+    monkeypatch.setattr('lib.api.APIv1.iter_results', mockreturn)
+    api = basic_api()
+    assert api.job_ids({'status': 'failed'}) == [3, 2]
@@ -0,0 +1,74 @@
+import gzip
+import os
+import pytest
+from lib.archive import OutputFile, archive_path
+
+
+def broken(chunks, error):
+    for chunk in chunks:
+        yield chunk
+    raise error
+
+
+def test_archive_path():
+    assert archive_path('out', 12) == os.path.join('out', 'job-12.txt')
+    assert archive_path('out', 12, compress=True) == os.path.join(
+        'out', 'job-12.txt.gz')
+
+
+def test_plain_output(tmpdir):
+    path = str(tmpdir.join('job-1.txt'))
+    output = OutputFile(path)
+    assert output.resume_offset() == 0
+    with pytest.raises(IOError):
+        output.write(0, broken([b'line 1\n', b'li'], IOError))
+    assert not os.path.exists(path)
+    assert output.resume_offset() == 9
+
+    output = OutputFile(path)
+    assert output.write(9, [b'ne 2\n']) == 5
+    output.finish()
+    with open(path, 'rb') as output_in:
+        assert output_in.read() == b'line 1\nline 2\n'
+
+    # the server ignored the range, start again
+    path = str(tmpdir.join('job-2.txt'))
+    output = OutputFile(path)
+    output.write(0, [b'old output'])
+    assert output.write(0, [b'new']) == 3
+    output.finish()
+    with open(path, 'rb') as output_in:
+        assert output_in.read() == b'new'
+
+
+def test_compressed_output(monkeypatch, tmpdir):
+    monkeypatch.setattr('lib.archive.MEMBER_SIZE', 10)
+    path = str(tmpdir.join('job-1.txt.gz'))
+    output = OutputFile(path, compress=True)
+    with pytest.raises(IOError):
+        output.write(0, broken([b'0123456789', b'abcdefghij', b'lost'],
+                               IOError))
+    # the incomplete member is dropped
+    assert output.resume_offset() == 20
+
+    output = OutputFile(path, compress=True)
+    offset = output.resume_offset()
+    assert output.write(offset, [b'klmnopqrst', b'uvwxyz']) == 16
+    output.finish()
+    assert not os.path.exists(output.part)
+    assert not os.path.exists(output.offsets)
+    with gzip.open(path, 'rb') as output_in:
+        assert output_in.read() == (b'0123456789abcdefghij'
+                                    b'klmnopqrstuvwxyz')
+
+
+def test_empty_output(tmpdir):
+    for compress in (False, True):
+        path = archive_path(str(tmpdir), 1, compress)
+        output = OutputFile(path, compress)
+        assert output.write(0, []) == 0
+        output.finish()
+        opener = gzip.open if compress else open
+        with opener(path, 'rb') as output_in:
+            assert output_in.read() == b''
+
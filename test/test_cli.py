@@ -1,6 +1,7 @@
 """
 Testing tower companion CLI
 """
+import json
 import os
 import pytest
 from click.testing import CliRunner
@@ -8,7 +9,11 @@ from lib.tc import GuardError
 from lib.cli import cli_kick, cli_monitor, DEFAULT_CONFIGURATION, config_file
 from lib.cli import cli_kick_and_monitor, cli_ad_hoc_and_monitor, cli_ad_hoc
 from lib.cli import cli_template_permissions, cli_update_project
-from lib.cli import extra_var_to_dict, CLIError
+from lib.cli import cli_relaunch_failed, cli_ad_hoc_fan_out
+from lib.cli import cli_bulk_template_permissions, grants_from_file
+from lib.cli import extra_var_to_dict, CLIError, vars_from_file, parse_vars
+from lib.cli import cli_archive, parse_filters, cli_grep_jobs
+from lib.cli import cli_view_output, index_path
 
 
 CURRENT_DIR = os.path.dirname(__file__)
@@ -20,6 +25,13 @@ def mock_config_file(*args, **kwargs):
     return os.path.join(current_dir, 'configuration.cfg')
 
 
+@pytest.fixture(autouse=True)
+def tmp_cache_dir(monkeypatch, tmpdir):
+    # do not write the output indexes in the home directory
+    monkeypatch.setitem(os.environ, 'TC_CACHE_DIR', str(tmpdir.join('cache')))
+    monkeypatch.setattr('lib.cli.EXTRA_VARS_CACHE', {})
+
+
 def test_extra_var_to_dict():
     extra_var = 'version=1'
     # bad extra var
@@ -42,6 +54,43 @@ def test_extra_var_to_dict():
         assert str(result[key]) == value
 
 
+def test_parse_vars(monkeypatch):
+    assert parse_vars('{"version": "1.0", "hosts": [1, 2]}') == \
+        {'version': '1.0', 'hosts': [1, 2]}
+    # yaml flow mappings are not json
+    assert parse_vars('{version: 1.0}') == {'version': 1.0}
+    assert parse_vars('version: 1.0') == {'version': 1.0}
+    with pytest.raises(CLIError):
+        extra_var_to_dict('version: [1')
+
+
+def test_vars_from_file(monkeypatch, tmpdir):
+    vars_file = tmpdir.join('vars.yml')
+    vars_file.write('version: 1.0\nhosts: [web01, web02]\n')
+    parsed = []
+
+    def mock_parse(text):
+        parsed.append(text)
+        return parse_vars(text)
+
+    monkeypatch.setattr('lib.cli.parse_vars', mock_parse)
+    expected = {'version': 1.0, 'hosts': ['web01', 'web02']}
+    assert vars_from_file(str(vars_file)) == expected
+    assert vars_from_file(str(vars_file)) == expected
+    assert len(parsed) == 1
+
+    assert extra_var_to_dict('@{0}'.format(vars_file)) == expected
+    assert len(parsed) == 1
+    # nothing is written to disk, extra vars are often secrets
+    assert not tmpdir.join('cache').check()
+
+    # the file changed
+    vars_file.write('version: 2.0\n')
+    os.utime(str(vars_file), (1, 1))
+    assert vars_from_file(str(vars_file)) == {'version': 2.0}
+    assert len(parsed) == 2
+
+
 def test_config_file(monkeypatch):
 
     monkeypatch.setattr('os.environ', {})
@@ -73,6 +122,17 @@ def test_cli_kick(monkeypatch):
                                       '--extra-vars', 'version: 1.0'])
     assert result.exit_code == 0
 
+    # slices
+    monkeypatch.setattr('lib.tc.Guard.kick_slices',
+                        lambda *args, **kwargs: ['one', 'two'])
+    result = runner.invoke(cli_kick, ['--template-name', 'test',
+                                      '--slices', '2'])
+    assert result.exit_code == 0
+    assert result.output.count('Started job') == 2
+    result = runner.invoke(cli_kick, ['--template-name', 'test',
+                                      '--slices', '2', '--limit', 'web'])
+    assert result.exit_code == 1
+
     monkeypatch.setattr('lib.cli.extra_var_to_dict', mock_cli_error)
     result = runner.invoke(cli_kick, ['--template-name', 'test',
                                       '--extra-vars', 'version: 1.0'])
@@ -83,29 +143,133 @@ def test_cli_kick(monkeypatch):
                                       '--extra-vars', 'version: 1.0'])
     assert result.exit_code == 1
 
+def test_cli_kick_refresh_inventory(monkeypatch):
+    refreshed = []
+
+    def mock_refresh(self, template_name, ttl):
+        refreshed.append((template_name, ttl))
+        return ['ec2']
+
+    def mock_kick_and_monitor(self, **kwargs):
+        refreshed.append(kwargs['refresh_ttl'])
+
+    monkeypatch.setattr('lib.tc.Guard.refresh_inventory', mock_refresh)
+    monkeypatch.setattr('lib.tc.Guard.get_template_id',
+                        lambda self, name: 1)
+    monkeypatch.setattr('lib.tc.Guard.kick', lambda *args, **kwargs: {})
+    monkeypatch.setattr('lib.tc.Guard.launch_data_to_url',
+                        lambda self, job: 'url')
+    monkeypatch.setattr('lib.tc.Guard.kick_and_monitor',
+                        mock_kick_and_monitor)
+    monkeypatch.setattr('lib.cli.config_file', mock_config_file)
+
+    runner = CliRunner()
+    result = runner.invoke(cli_kick, ['--template-name', 'test'])
+    assert result.exit_code == 0
+    assert refreshed == []
+    result = runner.invoke(cli_kick, ['--template-name', 'test',
+                                      '--refresh-inventory', '300'])
+    assert result.exit_code == 0
+    assert refreshed == [('test', 300)]
+    assert 'Synced inventory sources: ec2' in result.output
+
+    result = runner.invoke(cli_kick_and_monitor,
+                           ['--template-name', 'test',
+                            '--refresh-inventory', '60'])
+    assert result.exit_code == 0
+    assert refreshed[-1] == 60
+
+
+def test_cli_kick_and_monitor_dedupe(monkeypatch):
+    calls = []
+
+    def mock_kick_and_monitor(self, **kwargs):
+        calls.append(kwargs['dedupe'])
+
+    monkeypatch.setattr('lib.tc.Guard.kick_and_monitor',
+                        mock_kick_and_monitor)
+    monkeypatch.setattr('lib.cli.config_file', mock_config_file)
+    runner = CliRunner()
+    for args in (['--template-name', 'test'],
+                 ['--template-name', 'test', '--dedupe']):
+        result = runner.invoke(cli_kick_and_monitor, args)
+        assert result.exit_code == 0
+    assert calls == [False, True]
+
+
+def test_cli_kick_profiles(monkeypatch, tmpdir):
+    config = tmpdir.join('profiles.cfg')
+    config.write('[general]\nusername = test\npassword = secret\n'
+                 'verify_ssl = yes\n'
+                 '[profile eu]\nhost = eu.example.com\n'
+                 '[profile us]\nhost = us.example.com\n')
+    monkeypatch.setattr('lib.cli.config_file', lambda: str(config))
+    hosts = []
+
+    def mock_kick_profiles(guards, template_name, extra_vars, limit):
+        hosts.extend(sorted(guard.api.host for guard in guards.values()))
+        return [('eu', 'https://eu/1', None), ('us', None, 'boom')]
+
+    def mock_monitor_profiles(guards, template_name, extra_vars, limit,
+                              output_format, summary, log_file=None):
+        hosts.extend(sorted(guards))
+
+    monkeypatch.setattr('lib.cli.kick_profiles', mock_kick_profiles)
+    monkeypatch.setattr('lib.cli.kick_and_monitor_profiles',
+                        mock_monitor_profiles)
+    runner = CliRunner()
+    args = ['--template-name', 'test', '--profile', 'eu', '--profile', 'us']
+    result = runner.invoke(cli_kick, args)
+    assert hosts == ['eu.example.com', 'us.example.com']
+    assert '[eu] Started job: https://eu/1' in result.output
+    assert '[us] Error kicking job template: test - boom' in result.output
+    assert result.exit_code == 1
+
+    result = runner.invoke(cli_kick_and_monitor, args)
+    assert result.exit_code == 0
+    assert hosts[-2:] == ['eu', 'us']
+
+    # unknown profiles and unsupported options
+    for cli in (cli_kick, cli_kick_and_monitor):
+        result = runner.invoke(cli, ['--template-name', 'test',
+                                     '--profile', 'asia'])
+        assert result.exit_code == 1
+        result = runner.invoke(cli, args + ['--slices', '2'])
+        assert result.exit_code == 1
+
+
 def test_cli_update_project(monkeypatch):
 
     def mockerror(*args, **kwargs):
         raise GuardError
 
-    def mock_cli_error(*args, **kwargs):
-        raise CLIError
+    calls = []
 
-    def mockreturn(*args, **kwargs):
-        return 'just a test'
+    def mockreturn(self, project_names, max_age, revision, wait,
+                   output_format, workers):
+        calls.append((project_names, max_age, revision, wait))
+        return [('test', 'started', 'https://tower/api/v1/project_updates/3/'),
+                ('other', 'skipped (updated 3s ago)', None)]
 
-    monkeypatch.setattr('lib.tc.Guard.get_project_id', mockreturn)
-    monkeypatch.setattr('lib.tc.Guard.update_project', mockreturn)
-    monkeypatch.setattr('lib.tc.Guard.launch_data_to_url', mockreturn)
+    monkeypatch.setattr('lib.tc.Guard.update_projects', mockreturn)
     monkeypatch.setattr('lib.cli.config_file', mock_config_file)
 
     runner = CliRunner()
     # clean execution
     result = runner.invoke(cli_update_project, ['--project-name', 'test'])
     assert result.exit_code == 0
+    assert 'Started updating project: test' in result.output
+    assert 'Project other: skipped (updated 3s ago)' in result.output
+    assert calls[-1] == (('test',), None, None, False)
+
+    result = runner.invoke(cli_update_project,
+                           ['--project-name', 'test', '--project-name', 'b',
+                            '--max-age', '60', '--revision', 'abc', '--wait'])
+    assert result.exit_code == 0
+    assert calls[-1] == (('test', 'b'), 60, 'abc', True)
 
     # whooops! error
-    monkeypatch.setattr('lib.tc.Guard.get_project_id', mockerror)
+    monkeypatch.setattr('lib.tc.Guard.update_projects', mockerror)
     result = runner.invoke(cli_update_project, ['--project-name', 'test'])
     assert result.exit_code == 1
 
@@ -126,6 +290,19 @@ def test_cli_monitor(monkeypatch):
     result = runner.invoke(cli_monitor, ['--job-id', '1'])
     assert result.exit_code == 0
 
+    calls = []
+
+    def mock_monitor(self, job_url, output_format, summary, log_file,
+                     host_logs):
+        calls.append((output_format, log_file, host_logs))
+
+    monkeypatch.setattr('lib.tc.Guard.monitor', mock_monitor)
+    result = runner.invoke(cli_monitor, ['--job-id', '1',
+                                         '--log-file', 'job.log',
+                                         '--host-logs', 'hosts'])
+    assert result.exit_code == 0
+    assert calls == [('ansi', 'job.log', 'hosts')]
+
     # error!
     monkeypatch.setattr('lib.tc.Guard.monitor', mockerror)
     result = runner.invoke(cli_monitor, ['--job-id', '1'])
@@ -151,6 +328,10 @@ def test_cli_kick_and_monitor(monkeypatch):
     result = runner.invoke(cli_kick_and_monitor, ['--template-name', 'test'])
     assert result.exit_code == 0
 
+    result = runner.invoke(cli_kick_and_monitor, ['--template-name', 'test',
+                                                  '--summary', 'json'])
+    assert result.exit_code == 0
+
     # error!
     monkeypatch.setattr('lib.tc.Guard.kick_and_monitor', mockerror)
     result = runner.invoke(cli_kick_and_monitor, ['--template-name', 'test'])
@@ -215,6 +396,16 @@ def test_cli_ad_hoc(monkeypatch):
     result = runner.invoke(cli_ad_hoc, args)
     assert result.exit_code == 0
 
+    # forks and verbosity
+    for forks in ('auto', '10'):
+        result = runner.invoke(cli_ad_hoc, args + ['--forks', forks,
+                                                   '--verbosity', '2'])
+        assert result.exit_code == 0
+    for tuning in (['--forks', 'many'], ['--forks', '-1'],
+                   ['--verbosity', '7']):
+        result = runner.invoke(cli_ad_hoc, args + tuning)
+        assert result.exit_code == 2
+
     # error!
     monkeypatch.setattr('lib.tc.Guard.ad_hoc', mockerror)
     monkeypatch.setattr('lib.api.APIv1.launch_ad_hoc', mockerror)
@@ -254,3 +445,266 @@ def test_cli_template_permissions(monkeypatch):
     monkeypatch.setattr('lib.api.APIv1.update_user_role', mockerror)
     result = runner.invoke(cli_template_permissions, args)
     assert result.exit_code == 1
+
+
+def test_cli_relaunch_failed(monkeypatch):
+
+    def mockerror(*args, **kwargs):
+        raise GuardError
+
+    def mock_relaunch(*args, **kwargs):
+        return {'url': '/api/v1/jobs/2/'}, 'web-01:web-02'
+
+    def mockreturn(*args, **kwargs):
+        return 'just a test'
+
+    monkeypatch.setattr('lib.tc.Guard.relaunch_failed', mock_relaunch)
+    monkeypatch.setattr('lib.tc.Guard.monitor', mockreturn)
+    monkeypatch.setattr('lib.cli.config_file', mock_config_file)
+
+    runner = CliRunner()
+    result = runner.invoke(cli_relaunch_failed, ['--job-id', '1'])
+    assert result.exit_code == 0
+    assert 'web-01:web-02' in result.output
+
+    result = runner.invoke(cli_relaunch_failed, ['--job-id', '1', '--monitor'])
+    assert result.exit_code == 0
+
+    monkeypatch.setattr('lib.tc.Guard.relaunch_failed', mockerror)
+    result = runner.invoke(cli_relaunch_failed, ['--job-id', '1'])
+    assert result.exit_code == 1
+
+
+def test_cli_ad_hoc_fan_out(monkeypatch):
+
+    def mockerror(*args, **kwargs):
+        raise GuardError
+
+    fan_outs = []
+
+    def mock_fan_out(self, ad_hoc, inventories, limits, output_format,
+                     workers):
+        fan_outs.append((inventories, limits, workers))
+
+    monkeypatch.setattr('lib.tc.Guard.ad_hoc_fan_out', mock_fan_out)
+    monkeypatch.setattr('lib.cli.config_file', mock_config_file)
+
+    runner = CliRunner()
+    args = ['--inventory', 'eu',
+            '--inventory', 'us',
+            '--machine-credential', 'test',
+            '--module-name', 'command',
+            '--module-args', 'uptime',
+            '--max-parallel', '3']
+    result = runner.invoke(cli_ad_hoc_fan_out, args)
+    assert result.exit_code == 0
+    assert fan_outs == [(('eu', 'us'), (), 3)]
+
+    monkeypatch.setattr('lib.tc.Guard.ad_hoc_fan_out', mockerror)
+    result = runner.invoke(cli_ad_hoc_fan_out, args)
+    assert result.exit_code == 1
+
+
+def test_grants_from_file(tmpdir):
+    spec_csv = tmpdir.join('grants.csv')
+    spec_csv.write('username,template,permission\n'
+                   'alice,deploy,Execute\n'
+                   'bob,deploy,\n')
+    spec_yaml = tmpdir.join('grants.yml')
+    spec_yaml.write('- {username: alice, template: deploy, '
+                    'permission: execute}\n'
+                    '- {username: bob, template: deploy}\n')
+    expected = [('alice', 'deploy', 'execute'), ('bob', 'deploy', 'read')]
+    for spec in (spec_csv, spec_yaml):
+        assert grants_from_file(str(spec)) == expected
+
+    with pytest.raises(CLIError):
+        grants_from_file(str(tmpdir.join('missing.csv')))
+
+    spec_yaml.write('- {username: alice, template: deploy, '
+                    'permission: root}\n')
+    with pytest.raises(CLIError):
+        grants_from_file(str(spec_yaml))
+
+    spec_yaml.write('username: alice\n')
+    with pytest.raises(CLIError):
+        grants_from_file(str(spec_yaml))
+
+
+def test_cli_bulk_template_permissions(monkeypatch, tmpdir):
+    spec = tmpdir.join('grants.csv')
+    spec.write('username,template,permission\nalice,deploy,admin\n')
+
+    def mock_grant(self, grants, workers):
+        return [grant + ('granted',) for grant in grants]
+
+    def mockerror(*args, **kwargs):
+        raise GuardError
+
+    monkeypatch.setattr('lib.tc.Guard.grant_permissions', mock_grant)
+    monkeypatch.setattr('lib.cli.config_file', mock_config_file)
+    runner = CliRunner()
+    result = runner.invoke(cli_bulk_template_permissions,
+                           ['--spec', str(spec)])
+    assert result.exit_code == 0
+    assert 'alice  deploy    admin       granted' in result.output
+
+    # the table is printed, the exit code tells something went wrong
+    def mock_grant_error(self, grants, workers):
+        return [grant + ('error: forbidden',) for grant in grants]
+
+    monkeypatch.setattr('lib.tc.Guard.grant_permissions', mock_grant_error)
+    result = runner.invoke(cli_bulk_template_permissions,
+                           ['--spec', str(spec)])
+    assert result.exit_code == 1
+    assert 'error: forbidden' in result.output
+
+    monkeypatch.setattr('lib.tc.Guard.grant_permissions', mockerror)
+    result = runner.invoke(cli_bulk_template_permissions,
+                           ['--spec', str(spec)])
+    assert result.exit_code == 1
+
+
+def test_parse_filters():
+    assert parse_filters(['status=failed', 'name__icontains=a=b']) == {
+        'status': 'failed', 'name__icontains': 'a=b'}
+    with pytest.raises(CLIError):
+        parse_filters(['status'])
+    with pytest.raises(CLIError):
+        parse_filters(['=failed'])
+
+
+def test_cli_archive(monkeypatch, tmpdir):
+    calls = []
+
+    def mock_archive(self, job_ids, filters, directory, compress, workers,
+                     host_logs):
+        calls.append((job_ids, filters, compress, workers, host_logs))
+        return [(12, 'downloaded', 100, 'job-12.txt'),
+                (13, 'already archived', None, 'job-13.txt.gz')]
+
+    def mockerror(*args, **kwargs):
+        raise GuardError
+
+    monkeypatch.setattr('lib.tc.Guard.archive', mock_archive)
+    monkeypatch.setattr('lib.cli.config_file', mock_config_file)
+    runner = CliRunner()
+    result = runner.invoke(cli_archive, ['--job-id', '12',
+                                         '--filter', 'status=failed',
+                                         '--directory', str(tmpdir),
+                                         '--compress', '--host-logs'])
+    assert result.exit_code == 0
+    assert calls == [((12,), {'status': 'failed'}, True, 8, True)]
+    assert '12   downloaded        100    job-12.txt' in result.output
+
+    # the table is printed, a job that failed is an error
+    def mock_archive_error(self, *args, **kwargs):
+        return [(12, 'downloaded', 100, 'job-12.txt'),
+                (13, 'error: not found', None, None)]
+
+    monkeypatch.setattr('lib.tc.Guard.archive', mock_archive_error)
+    result = runner.invoke(cli_archive, ['--job-id', '12', '--job-id', '13',
+                                         '--directory', str(tmpdir)])
+    assert result.exit_code == 1
+    assert '13   error: not found' in result.output
+
+    # nothing to archive
+    result = runner.invoke(cli_archive, [])
+    assert result.exit_code == 1
+
+    monkeypatch.setattr('lib.tc.Guard.archive', mockerror)
+    result = runner.invoke(cli_archive, ['--job-id', '12'])
+    assert result.exit_code == 1
+
+
+def test_cli_grep_jobs(monkeypatch):
+    calls = []
+    results = [('12', [(3, 'ok: [web-01]', False),
+                       (4, 'fatal: [web-02]: FAILED!', True)]),
+               ('13', [(4, 'fatal: [web-02]: FAILED!', True), None,
+                       (9, 'fatal: [web-05]: FAILED!', True)])]
+
+    def mock_grep(self, pattern, job_ids, context, ignore_case, processes):
+        calls.append((pattern, job_ids, context, ignore_case, processes))
+        return results
+
+    def mockerror(*args, **kwargs):
+        raise GuardError
+
+    monkeypatch.setattr('lib.tc.Guard.grep', mock_grep)
+    monkeypatch.setattr('lib.cli.config_file', mock_config_file)
+    runner = CliRunner()
+    result = runner.invoke(cli_grep_jobs, ['--pattern', 'FAILED', '-C', '1',
+                                           '--job-id', '12', '-i'])
+    assert result.exit_code == 0
+    assert calls == [('FAILED', ('12',), 1, True, None)]
+    assert result.output.splitlines() == [
+        '12-3-ok: [web-01]', '12:4:fatal: [web-02]: FAILED!', '--',
+        '13:4:fatal: [web-02]: FAILED!', '--',
+        '13:9:fatal: [web-05]: FAILED!']
+
+    # nothing found
+    del results[:]
+    result = runner.invoke(cli_grep_jobs, ['--pattern', 'FAILED'])
+    assert result.exit_code == 1
+    assert result.output == ''
+
+    # json records, one per line, no separators
+    results.append(('12', [(4, 'fatal: [web-02]: FAILED!', True)]))
+    result = runner.invoke(cli_grep_jobs, ['--pattern', 'FAILED', '--json'])
+    assert result.exit_code == 0
+    records = [json.loads(line) for line in result.output.splitlines()]
+    assert [record['type'] for record in records] == ['match', 'timing']
+    assert records[0]['job'] == '12'
+    assert records[0]['line'] == 4
+    assert records[0]['match'] is True
+
+    monkeypatch.setattr('lib.tc.Guard.grep', mockerror)
+    result = runner.invoke(cli_grep_jobs, ['--pattern', 'FAILED'])
+    assert result.exit_code == 1
+    result = runner.invoke(cli_grep_jobs, ['--pattern', 'FAILED', '--json'])
+    assert result.exit_code == 1
+    assert json.loads(result.output.splitlines()[0])['type'] == 'error'
+
+
+def test_cli_view_output(monkeypatch, tmpdir):
+    output = tmpdir.join('job-12.txt')
+    output.write(''.join('line {0}\n'.format(number)
+                         for number in range(1, 21)))
+    path = str(output)
+
+    def mock_stored_output(self, job_id):
+        assert job_id == '12'
+        return path
+
+    monkeypatch.setattr('lib.tc.Guard.stored_output', mock_stored_output)
+    monkeypatch.setattr('lib.cli.config_file', mock_config_file)
+    runner = CliRunner()
+    result = runner.invoke(cli_view_output, ['--file', path])
+    assert result.exit_code == 0
+    assert result.output == ''.join('line {0}\n'.format(number)
+                                    for number in range(11, 21))
+    assert os.path.exists(index_path(path))
+    result = runner.invoke(cli_view_output, ['--job-id', '12', '--head', '2'])
+    assert result.output == 'line 1\nline 2\n'
+    result = runner.invoke(cli_view_output, ['--file', path, '--line', '7'])
+    assert result.output == 'line 7\n'
+    result = runner.invoke(cli_view_output, ['--file', path,
+                                             '--range', '3:4'])
+    assert result.output == 'line 3\nline 4\n'
+    result = runner.invoke(cli_view_output, ['--file', path,
+                                             '--range', '19:'])
+    assert result.output == 'line 19\nline 20\n'
+    result = runner.invoke(cli_view_output, ['--file', path, '--tail', '2',
+                                             '--json'])
+    records = [json.loads(line) for line in result.output.splitlines()]
+    assert [(record['line'], record['text']) for record in records
+            if record['type'] == 'line'] == [(19, 'line 19'),
+                                             (20, 'line 20')]
+
+    for args in (['--range', '4:3'], ['--range', 'a:b'],
+                 ['--head', '1', '--tail', '1'], ['--job-id', '12']):
+        result = runner.invoke(cli_view_output, ['--file', path] + args)
+        assert result.exit_code != 0
+    result = runner.invoke(cli_view_output, [])
+    assert result.exit_code == 1
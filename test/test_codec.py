@@ -0,0 +1,76 @@
+import json
+import pytest
+from lib import codec
+
+
+class MockResponse(object):
+    def __init__(self, content):
+        self.content = content
+
+
+def test_loads():
+    assert codec.loads('{"a": [1, 2]}') == {'a': [1, 2]}
+    assert codec.loads(b'{"a": "caf\xc3\xa9"}') == {'a': u'caf\xe9'}
+    with pytest.raises(ValueError):
+        codec.loads('{"a": ')
+    with pytest.raises(ValueError):
+        codec.loads('')
+
+
+def test_stdlib_fallback(monkeypatch):
+    monkeypatch.setattr('lib.codec._loads', codec._stdlib_loads)
+    assert codec.loads(b'{"count": 1}') == {'count': 1}
+    assert codec.loads(u'{"count": 1}') == {'count': 1}
+    with pytest.raises(ValueError):
+        codec.loads(b'not json')
+
+
+def test_decode_response():
+    response = MockResponse(b'{"count": 1, "results": [{"id": 3}]}')
+    assert codec.decode_response(response) == {'count': 1,
+                                               'results': [{'id': 3}]}
+    with pytest.raises(ValueError):
+        codec.decode_response(MockResponse(b'<html>'))
+
+
+def test_iter_results():
+    listing = {'count': 4, 'next': '/api/v1/roles/?page=2', 'previous': None,
+               'results': [{'id': 1, 'name': 'a "quoted" ]} \\ name'},
+                           [1, {'nested': []}], 'text, ]', 12.5]}
+    document = json.dumps(listing).encode('utf-8')
+    for size in (1, 3, 7, len(document)):
+        chunks = [document[start:start + size]
+                  for start in range(0, len(document), size)]
+        page = {}
+        assert list(codec.iter_results(chunks, page)) == listing['results']
+        assert page == {'count': 4, 'next': '/api/v1/roles/?page=2',
+                        'previous': None}
+    assert list(codec.iter_results([b'{"results": []}'])) == []
+    assert list(codec.iter_results([b'{"count": 0}'])) == []
+
+
+def test_iter_results_early_stop():
+    read = []
+
+    def chunks():
+        for item in (b'{"results": [', b'{"id": 1},', b'{"id": 2},',
+                     b'{"id": 3}]}'):
+            read.append(item)
+            yield item
+
+    results = codec.iter_results(chunks())
+    assert next(results) == {'id': 1}
+    assert len(read) == 2
+
+
+def test_iter_results_errors():
+    with pytest.raises(ValueError):
+        list(codec.iter_results([b'{"results": [{"id": 1}, {"id"']))
+    with pytest.raises(ValueError):
+        list(codec.iter_results([b'[1, 2]']))
+    with pytest.raises(ValueError):
+        list(codec.iter_results([b'{"results": [{"id": 1}, {"id" 2}]}']))
+
+
+def test_backend():
+    assert codec.BACKEND in ('orjson', 'ujson', 'json')
@@ -0,0 +1,105 @@
+import threading
+import pytest
+from lib.concurrency import parallel_map, AIMDLimiter
+
+
+def test_parallel_map():
+    items = list(range(50))
+    assert parallel_map(lambda item: item * 2, items) == [i * 2 for i in items]
+    assert parallel_map(lambda item: item, []) == []
+    assert parallel_map(lambda item: item, [1], workers=4) == [1]
+    assert parallel_map(lambda item: item, [1, 2], workers=1) == [1, 2]
+
+
+def test_parallel_map_threads():
+    threads = set()
+
+    def func(item):
+        threads.add(threading.current_thread().name)
+        return item
+
+    parallel_map(func, range(20), workers=4)
+    assert 1 <= len(threads) <= 4
+
+
+def test_parallel_map_errors():
+    processed = []
+
+    def func(item):
+        processed.append(item)
+        if item in (3, 7):
+            raise ValueError(item)
+        return item
+
+    with pytest.raises(ValueError) as error:
+        parallel_map(func, range(10), workers=3)
+    # all the items are processed, the first failure is raised
+    assert sorted(processed) == list(range(10))
+    assert error.value.args == (3,)
+
+
+def test_aimd_limiter():
+    limiter = AIMDLimiter(initial=4, maximum=6, min_latency=1.0)
+    # additive increase: about +1 every full window of good requests
+    for _ in range(5):
+        limiter.release(limiter.acquire(), latency=0.1)
+    assert limiter.snapshot()['limit'] == 5
+    for _ in range(50):
+        limiter.release(limiter.acquire(), latency=0.1)
+    assert limiter.snapshot()['limit'] == 6
+
+    # multiplicative decrease, once for the requests in flight together
+    tokens = [limiter.acquire() for _ in range(3)]
+    for token in tokens:
+        limiter.release(token, latency=0.1, overloaded=True)
+    snapshot = limiter.snapshot()
+    assert snapshot['limit'] == 3
+    assert snapshot['backoffs'] == 1
+    assert snapshot['in_flight'] == 0
+
+    # latency spikes count as overload
+    limiter.release(limiter.acquire(), latency=3.0)
+    assert limiter.snapshot()['limit'] == 1
+    limiter.release(limiter.acquire(), latency=3.0)
+    assert limiter.snapshot()['limit'] == 1
+    assert limiter.snapshot()['requests'] == 60
+
+
+def test_aimd_limiter_baseline():
+    limiter = AIMDLimiter(initial=4)
+    assert limiter.snapshot()['baseline'] is None
+    # a slow tower is not an overloaded tower
+    for _ in range(20):
+        limiter.release(limiter.acquire(), latency=2.0)
+    snapshot = limiter.snapshot()
+    assert snapshot['backoffs'] == 0
+    assert snapshot['baseline'] == 2.0
+    # slower than usual
+    limiter.release(limiter.acquire(), latency=7.0)
+    assert limiter.snapshot()['backoffs'] == 1
+    assert limiter.snapshot()['baseline'] == 2.5
+    # overload errors do not move the baseline
+    limiter.release(limiter.acquire(), latency=60.0, overloaded=True)
+    assert limiter.snapshot()['baseline'] == 2.5
+    # below min_latency nothing is slow
+    limiter = AIMDLimiter(initial=4)
+    limiter.release(limiter.acquire(), latency=0.01)
+    limiter.release(limiter.acquire(), latency=0.4)
+    assert limiter.snapshot()['backoffs'] == 0
+
+
+def test_aimd_limiter_blocks():
+    limiter = AIMDLimiter(initial=2)
+    in_flight = []
+    lock = threading.Lock()
+
+    def func(item):
+        token = limiter.acquire()
+        with lock:
+            in_flight.append(limiter.snapshot()['in_flight'])
+        limiter.release(token, latency=0.0)
+        return item
+
+    parallel_map(func, range(30), workers=8)
+    assert max(in_flight) <= limiter.maximum
+    assert limiter.snapshot()['in_flight'] == 0
@@ -110,3 +110,53 @@ def teardown_module(module):
         except OSError:
             # filename does not exist
             pass
+
+
+def test_profiles(tmpdir):
+    config_file = tmpdir.join('profiles.cfg')
+    config_file.write('[general]\n'
+                      'username = test\n'
+                      'host = default.example.com\n'
+                      '[profile eu]\n'
+                      'host = eu.example.com\n'
+                      'verify_ssl = no\n'
+                      '[profile us]\n'
+                      'host = us.example.com\n')
+    config = Config(str(config_file))
+    assert config.profiles() == ['eu', 'us']
+    assert config.get('host') == 'default.example.com'
+
+    config = Config(str(config_file), profile='eu')
+    # profile options take precedence, the others come from general
+    assert config.get('host') == 'eu.example.com'
+    assert config.get('username') == 'test'
+    assert config.getboolean('verify_ssl') is False
+    assert config.has_option('verify_ssl')
+    assert not Config(str(config_file), profile='us').has_option('verify_ssl')
+    # updates (e.g. from the environment) go to the profile
+    config.update('username', 'eu_user')
+    assert config.get('username') == 'eu_user'
+    assert Config(str(config_file), profile='us').get('username') == 'test'
+
+    with pytest.raises(ConfigError):
+        Config(str(config_file), profile='asia')
+
+
+def test_profiles_environment(tmpdir, monkeypatch):
+    config_file = tmpdir.join('profiles.cfg')
+    config_file.write('[general]\n'
+                      'host = default.example.com\n'
+                      '[profile eu]\n'
+                      'host = eu.example.com\n'
+                      '[profile us]\n'
+                      'username = us_user\n')
+    monkeypatch.setenv('TC_HOST', 'env.example.com')
+    monkeypatch.setenv('TC_USERNAME', 'env_user')
+    # the environment overrides general, not the profiles
+    assert Config(str(config_file)).get('host') == 'env.example.com'
+    config = Config(str(config_file), profile='eu')
+    assert config.get('host') == 'eu.example.com'
+    assert config.get('username') == 'env_user'
+    config = Config(str(config_file), profile='us')
+    assert config.get('host') == 'env.example.com'
+    assert config.get('username') == 'us_user'
@@ -0,0 +1,30 @@
+from lib.events import event_host, event_record
+
+
+def test_event_host():
+    assert event_host({'host_name': 'web-01'}) == 'web-01'
+    event = {'summary_fields': {'host': {'name': 'web-02'}}}
+    assert event_host(event) == 'web-02'
+    assert event_host({'event': 'playbook_on_start'}) is None
+
+
+def test_event_record():
+    event = {'id': 10,
+             'counter': 3,
+             'event': 'runner_on_failed',
+             'host_name': 'web-01',
+             'failed': True,
+             'event_data': {'task': 'install', 'play': 'all',
+                            'res': {'msg': 'No package matching'}}}
+    record = event_record(event)
+    assert record['id'] == 10
+    assert record['host'] == 'web-01'
+    assert record['task'] == 'install'
+    assert record['play'] == 'all'
+    assert record['failed'] is True
+    assert record['changed'] is False
+    assert record['msg'] == 'No package matching'
+
+    record = event_record({'id': 11, 'event_data': {'res': 'a string'}})
+    assert record['msg'] is None
+    assert record['host'] is None
@@ -1,11 +1,20 @@
 from __future__ import absolute_import
+import io
 import os
+import re
 import json
 import pytest
+from datetime import datetime
 from lib.api import APIError
 from lib.configuration import Config
 from lib.adhoc import AdHoc
-from lib.tc import Guard, GuardError
+from lib.tc import Guard, GuardError, hosts_to_limit, encrypted_vars
+from lib.tc import split_hosts, project_is_current, source_is_stale
+from lib.tc import launch_fingerprint, launch_values, kick_profiles
+from lib.tc import kick_and_monitor_profiles
+from lib.reporter import JSONReporter
+from lib.hostlogs import read_index
+from lib.store import StoreError
 
 
 USERNAME = 'my_username'
@@ -46,6 +55,10 @@ class MockRequest(object):
         self.text = None
         self.json = None
 
+    @property
+    def content(self):
+        return self.text.encode('utf-8')
+
 
 def test_guard_bad_configuration(monkeypatch):
     def mockreturn(*args, **kwargs):
@@ -113,8 +126,8 @@ def test_get_role_id(monkeypatch):
                         }
                     ]}
     def mockreturn(self):
-        return fake_result
-    monkeypatch.setattr('lib.api.APIv1.role_data', mockreturn)
+        return iter(fake_result['results'])
+    monkeypatch.setattr('lib.api.APIv1.roles', mockreturn)
     assert guard.get_role_id(resource_name, permission) == expected_id
 
     with pytest.raises(GuardError):
@@ -122,10 +135,25 @@ def test_get_role_id(monkeypatch):
 
     def mockreturn(self):
         raise APIError
-    monkeypatch.setattr('lib.api.APIv1.role_data', mockreturn)
+    monkeypatch.setattr('lib.api.APIv1.roles', mockreturn)
     with pytest.raises(GuardError):
         guard.get_role_id(resource_name, '')
 
+def test_get_role_id_stops_early(monkeypatch):
+    yielded = []
+
+    def mock_roles(self):
+        for role_id, name in ((1, 'deploy'), (2, 'backup'), (3, 'web')):
+            yielded.append(role_id)
+            yield {'id': role_id, 'name': 'Execute',
+                   'summary_fields': {'resource_type': 'job template',
+                                      'resource_name': name}}
+
+    monkeypatch.setattr('lib.api.APIv1.roles', mock_roles)
+    guard = basic_guard()
+    assert guard.get_role_id('Backup', 'execute') == 2
+    assert yielded == [1, 2]
+
 def test_get_project_id(monkeypatch):
     guard = basic_guard()
 
@@ -264,6 +292,8 @@ def test_monitor(monkeypatch):
 
     guard = basic_guard()
     guard.monitor(job_url='', output_format='')
+    for summary in ('text', 'json'):
+        guard.monitor(job_url='', output_format='', summary=summary)
 
     # simulate an error received from the API
     monkeypatch.setattr('lib.api.APIv1.job_finished', mockerror)
@@ -276,6 +306,41 @@ def test_monitor(monkeypatch):
     with pytest.raises(GuardError):
         guard.monitor(job_url='', output_format='')
 
+    # tower could not run the job
+    monkeypatch.setattr('lib.api.APIv1.job_status', lambda *args: 'error')
+    with pytest.raises(GuardError):
+        guard.monitor(job_url='', output_format='')
+
+
+def test_monitor_json(monkeypatch):
+    statuses = ['pending', 'running', 'running', 'successful', 'successful']
+    outputs = ['', '', 'ok: [web-01]\n', 'ok: [web-01]\nPLAY RECAP\n']
+
+    def mock_get_json(self, url, params, data):
+        return {'status': statuses.pop(0)}
+
+    def mock_stdout(self, url, output_format):
+        return outputs.pop(0)
+
+    monkeypatch.setattr('lib.api.APIv1._get_json', mock_get_json)
+    monkeypatch.setattr('lib.api.APIv1.job_stdout', mock_stdout)
+    stream = io.BytesIO()
+    guard = basic_guard()
+    guard.reporter = JSONReporter(stream)
+    guard.monitor(job_url='/api/v1/jobs/1/', output_format='txt')
+    guard.reporter.flush()
+    records = [json.loads(line) for line in
+               stream.getvalue().decode('ascii').splitlines()]
+    # status changes are reported once, with no extra request
+    assert [(record['type'], record.get('status', record.get('text')))
+            for record in records if record['type'] != 'timing'] == [
+        ('status', 'pending'), ('status', 'running'),
+        ('output', 'ok: [web-01]\n'), ('status', 'successful'),
+        ('output', 'PLAY RECAP\n')]
+    assert records[-1]['type'] == 'timing'
+    assert records[-1]['job'] == '/api/v1/jobs/1/'
+    assert not statuses
+
 
 def test_kick_and_monitor(monkeypatch):
 
@@ -399,3 +464,1092 @@ def test_job_url(monkeypatch):
     monkeypatch.setattr('lib.api.APIv1.job_url', mockerror)
     with pytest.raises(GuardError):
         guard.job_url(job_id='')
+
+
+def test_monitor_events(monkeypatch, capsys):
+    pages = [{'results': [{'id': 1, 'event': 'playbook_on_start'},
+                          {'id': 2, 'event': 'runner_on_ok',
+                           'host_name': 'web-01'}],
+              'next': '/next/'},
+             {'results': [{'id': 3, 'event': 'runner_on_failed',
+                           'host_name': 'web-02', 'failed': True}],
+              'next': None}]
+    cursors = []
+
+    def mock_events(self, job_url, last_id=0):
+        cursors.append(last_id)
+        if pages:
+            return pages.pop(0)
+        return {'results': [], 'next': None}
+
+    def mock_finished(*args, **kwargs):
+        return True
+
+    def mock_status_ok(*args, **kwargs):
+        return 'successful'
+
+    def mock_status_failed(*args, **kwargs):
+        return 'failed'
+
+    monkeypatch.setattr('lib.api.APIv1.job_finished', mock_finished)
+    monkeypatch.setattr('lib.api.APIv1.job_events', mock_events)
+    monkeypatch.setattr('lib.api.APIv1.job_status', mock_status_ok)
+
+    guard = basic_guard()
+    records = []
+    guard.monitor_events(job_url='', handler=records.append)
+    assert [record['id'] for record in records] == [1, 2, 3]
+    assert records[2]['host'] == 'web-02'
+    # the cursor follows the last received event
+    assert cursors == [0, 2]
+
+    # monitor dispatches to the events mode
+    guard.monitor(job_url='', output_format='events')
+
+    # the summary is collected from the events
+    pages.append({'results': [{'id': 4, 'event': 'playbook_on_stats',
+                               'event_data': {'failures': {'web-02': 1}}}],
+                  'next': None})
+    guard.monitor(job_url='', output_format='events', summary='json')
+    summary = json.loads(capsys.readouterr()[0].splitlines()[-1])
+    assert summary['failed_hosts'] == ['web-02']
+
+    monkeypatch.setattr('lib.api.APIv1.job_status', mock_status_failed)
+    with pytest.raises(GuardError):
+        guard.monitor_events(job_url='', handler=records.append)
+
+    def mockerror(*args, **kwargs):
+        raise APIError
+
+    monkeypatch.setattr('lib.api.APIv1.job_events', mockerror)
+    with pytest.raises(GuardError):
+        guard.monitor_events(job_url='')
+
+
+def test_hosts_to_limit():
+    assert hosts_to_limit(['web-02', 'web-01', 'web-02']) == 'web-01:web-02'
+    assert hosts_to_limit([]) == ''
+    hosts = ['app-eu-{0:03d}'.format(index) for index in (1, 2, 17)]
+    limit = hosts_to_limit(hosts + ['db'])
+    assert limit == 'db:~^app\\-eu\\-(001|002|017)$'
+    pattern = re.compile(limit.split(':')[1][1:])
+    assert [host for host in hosts + ['app-eu-003'] if pattern.match(host)] \
+        == hosts
+
+
+def test_encrypted_vars():
+    extra_vars = {'version': '1.0', 'password': '$encrypted$',
+                  'db': {'users': ['admin', '$encrypted$']}}
+    assert encrypted_vars(extra_vars) == ['db.users.1', 'password']
+    assert encrypted_vars({'version': '1.0'}) == []
+
+
+def test_relaunch_failed(monkeypatch):
+    guard = basic_guard()
+    summaries = [{'host_name': 'web-02', 'failures': 1, 'dark': 0},
+                 {'host_name': 'web-01', 'failures': 0, 'dark': 1},
+                 {'host_name': 'web-03', 'failures': 0, 'dark': 0}]
+    job = {'job_template': 7, 'extra_vars': '{"version": "1.0"}'}
+    launched = []
+
+    def mock_summaries(*args, **kwargs):
+        return summaries
+
+    def mock_job_data(*args, **kwargs):
+        return job
+
+    def mock_kick(self, template_id, extra_vars, limit):
+        launched.append((template_id, extra_vars, limit))
+        return {'url': '/api/v1/jobs/2/'}
+
+    monkeypatch.setattr('lib.api.APIv1.job_failed_hosts', mock_summaries)
+    monkeypatch.setattr('lib.api.APIv1.job_data', mock_job_data)
+    monkeypatch.setattr('lib.tc.Guard.kick', mock_kick)
+
+    assert guard.failed_hosts(job_id=1) == ['web-01', 'web-02']
+    result, limit = guard.relaunch_failed(job_id=1)
+    assert limit == 'web-01:web-02'
+    assert launched == [(7, {'version': '1.0'}, 'web-01:web-02')]
+
+    # secrets cannot be copied
+    job['extra_vars'] = '{"password": "$encrypted$"}'
+    with pytest.raises(GuardError):
+        guard.relaunch_failed(job_id=1)
+    job['extra_vars'] = '{}'
+
+    # nothing to relaunch
+    summaries[:] = []
+    with pytest.raises(GuardError):
+        guard.relaunch_failed(job_id=1)
+
+    # not a template job
+    job['job_template'] = None
+    with pytest.raises(GuardError):
+        guard.relaunch_failed(job_id=1)
+
+    def mockerror(*args, **kwargs):
+        raise APIError
+
+    monkeypatch.setattr('lib.api.APIv1.job_data', mockerror)
+    with pytest.raises(GuardError):
+        guard.relaunch_failed(job_id=1)
+    monkeypatch.setattr('lib.api.APIv1.job_failed_hosts', mockerror)
+    with pytest.raises(GuardError):
+        guard.failed_hosts(job_id=1)
+
+
+def test_split_hosts():
+    hosts = ['web-{0:02d}'.format(index) for index in range(10)]
+    slices = split_hosts(hosts + hosts[:3], 3)
+    assert len(slices) == 3
+    assert sorted(sum(slices, [])) == hosts
+    assert [len(hosts_slice) for hosts_slice in slices] == [4, 3, 3]
+    # no empty slices
+    assert split_hosts(['web-01'], 4) == [['web-01']]
+
+
+def test_launch_many_partial_failure(monkeypatch, capsys):
+    guard = basic_guard()
+
+    def launch(item):
+        if item == 2:
+            raise GuardError('no capacity')
+        return {'url': 'api/v1/jobs/{0}/'.format(item)}
+
+    assert guard._launch_many(launch, [1, 3], workers=2) == [
+        {'url': 'api/v1/jobs/1/'}, {'url': 'api/v1/jobs/3/'}]
+    # the jobs already started are reported, not lost
+    with pytest.raises(GuardError) as error:
+        guard._launch_many(launch, [1, 2, 3], workers=2)
+    assert '1 of 3 launches failed: no capacity' in str(error.value)
+    assert 'https://{0}/api/v1/jobs/3/'.format(HOST) in str(error.value)
+    out, _ = capsys.readouterr()
+    assert out.splitlines() == [
+        'Started job: https://{0}/api/v1/jobs/1/'.format(HOST),
+        'Started job: https://{0}/api/v1/jobs/3/'.format(HOST)]
+
+
+def test_kick_slices(monkeypatch):
+    guard = basic_guard()
+    hosts = [{'name': 'web-01'}, {'name': 'web-02'}, {'name': 'web-03'},
+             {'name': 'web-04', 'enabled': False}]
+    template = {'id': 1, 'name': 'test', 'inventory': 3, 'limit': '',
+                'ask_limit_on_launch': True}
+    launched = []
+    lookups = []
+    ignored = {}
+
+    def mock_template_data(self, name):
+        lookups.append(name)
+        return {'results': [template]}
+
+    def mock_inventory_hosts(self, inventory_id):
+        assert inventory_id == 3
+        return hosts
+
+    def mock_kick(self, template_id, extra_vars, limit):
+        assert template_id == 1
+        launched.append(limit)
+        return {'url': limit, 'ignored_fields': ignored}
+
+    def mockerror(*args, **kwargs):
+        raise APIError
+
+    monkeypatch.setattr('lib.api.APIv1.template_data', mock_template_data)
+    monkeypatch.setattr('lib.api.APIv1.inventory_hosts', mock_inventory_hosts)
+    monkeypatch.setattr('lib.api.APIv1._get_id', mockerror)
+    monkeypatch.setattr('lib.tc.Guard.kick', mock_kick)
+
+    assert guard.slice_limits(template, 2) == ['web-01:web-03', 'web-02']
+    jobs = guard.kick_slices('test', {}, 2)
+    assert [job['url'] for job in jobs] == ['web-01:web-03', 'web-02']
+    assert sorted(launched) == ['web-01:web-03', 'web-02']
+    # the template is looked up only once
+    assert lookups == ['test']
+
+    # tower would ignore the slice limits
+    template['ask_limit_on_launch'] = False
+    with pytest.raises(GuardError):
+        guard.kick_slices('test', {}, 2)
+    assert len(launched) == 2
+    template['ask_limit_on_launch'] = True
+    ignored['limit'] = 'web-02'
+    with pytest.raises(GuardError) as error:
+        guard.kick_slices('test', {}, 2)
+    assert 'runs on the whole inventory' in str(error.value)
+    ignored.clear()
+
+    # slices would replace the template limit
+    template['limit'] = 'web'
+    with pytest.raises(GuardError):
+        guard.kick_slices('test', {}, 2)
+    template['limit'] = ''
+
+    hosts[:] = []
+    with pytest.raises(GuardError):
+        guard.slice_limits(template, 2)
+
+    monkeypatch.setattr('lib.api.APIv1.inventory_hosts', mockerror)
+    with pytest.raises(GuardError):
+        guard.slice_limits(template, 2)
+
+    monkeypatch.setattr('lib.api.APIv1.template_data',
+                        lambda self, name: {'results': []})
+    with pytest.raises(GuardError):
+        guard.kick_slices('test', {}, 2)
+
+
+def test_monitor_many(monkeypatch, capsys):
+    outputs = {'job-1': [u'line 1', u'line 1\nline 2'],
+               'job-2': [u'other', u'other']}
+    statuses = {'job-1': 'successful', 'job-2': 'successful'}
+    polls = {}
+
+    def mock_finished(self, job_url):
+        # every job completes at its second poll
+        polls[job_url] = polls.get(job_url, 0) + 1
+        return polls[job_url] >= 2
+
+    def mock_stdout(self, job_url, output_format):
+        return outputs[job_url][polls[job_url] - 1]
+
+    def mock_status(self, job_url):
+        return statuses[job_url]
+
+    monkeypatch.setattr('lib.api.APIv1.job_finished', mock_finished)
+    monkeypatch.setattr('lib.api.APIv1.job_stdout', mock_stdout)
+    monkeypatch.setattr('lib.api.APIv1.job_status', mock_status)
+
+    guard = basic_guard()
+    result = guard.monitor_many(['job-1', 'job-2'], 'txt',
+                                labels=['first', 'second'], summary='text')
+    assert result == statuses
+    out = capsys.readouterr()[0]
+    assert '[first] line 1' in out
+    assert '[first] line 2' in out
+    assert '[second] other' in out
+    assert 'SUMMARY' in out
+
+    statuses['job-2'] = 'failed'
+    polls.clear()
+    with pytest.raises(GuardError):
+        guard.monitor_many(['job-1', 'job-2'], 'txt')
+    capsys.readouterr()
+
+    def mock_events(self, job_url, last_id=0):
+        if last_id:
+            return {'results': [], 'next': None}
+        host = 'web-{0}'.format(job_url[-1])
+        return {'results': [{'id': 1, 'event': 'runner_on_ok',
+                             'host_name': host},
+                            {'id': 2, 'event': 'playbook_on_stats',
+                             'event_data': {'ok': {host: 1}}}],
+                'next': None}
+
+    monkeypatch.setattr('lib.api.APIv1.job_events', mock_events)
+    statuses['job-2'] = 'successful'
+    polls.clear()
+    guard.monitor_many(['job-1', 'job-2'], 'events', labels=['a', 'b'],
+                       summary='json')
+    out = capsys.readouterr()[0]
+    assert '"job": "a"' in out
+    summary = json.loads([line for line in out.splitlines()
+                          if line.startswith('{"dropped_failures"')][0])
+    assert sorted(summary['hosts']) == ['web-1', 'web-2']
+
+    def mockerror(*args, **kwargs):
+        raise APIError
+
+    monkeypatch.setattr('lib.api.APIv1.job_finished', mockerror)
+    with pytest.raises(GuardError):
+        guard.monitor_many(['job-1', 'job-2'], 'txt')
+
+
+def test_kick_and_monitor_slices(monkeypatch):
+    guard = basic_guard()
+    monitored = []
+
+    def mock_kick_slices(self, template_name, extra_vars, slices):
+        return [{'url': '/1/'}, {'url': '/2/'}]
+
+    def mock_monitor_many(self, job_urls, output_format, labels, summary,
+                          log_file=None):
+        monitored.append(labels)
+
+    monkeypatch.setattr('lib.tc.Guard.kick_slices', mock_kick_slices)
+    monkeypatch.setattr('lib.tc.Guard.monitor_many', mock_monitor_many)
+    guard.kick_and_monitor(template_name='', extra_vars={}, limit='',
+                           output_format='txt', slices=2)
+    assert monitored == [['slice 1/2', 'slice 2/2']]
+
+    with pytest.raises(GuardError):
+        guard.kick_and_monitor(template_name='', extra_vars={}, limit='web',
+                               output_format='txt', slices=2)
+
+
+def test_ad_hoc_fan_out(monkeypatch):
+    guard = basic_guard()
+    lookups = []
+    launched = []
+    monitored = []
+
+    def mock_inventory_ids(self, names):
+        lookups.extend(names)
+        return dict((name, 'id-{0}'.format(name)) for name in names)
+
+    def mock_credential_ids(self, names):
+        lookups.extend(names)
+        return dict((name, 7) for name in names)
+
+    def mock_ad_hoc(self, ad_hoc):
+        launched.append((ad_hoc.inventory_id, ad_hoc.credential_id,
+                         ad_hoc.limit))
+        return {'id': len(launched), 'url': '/{0}/'.format(len(launched))}
+
+    def mock_monitor_many(self, job_urls, output_format, labels, workers):
+        monitored.append(labels)
+        return {}
+
+    monkeypatch.setattr('lib.api.APIv1.inventory_ids', mock_inventory_ids)
+    monkeypatch.setattr('lib.api.APIv1.credential_ids', mock_credential_ids)
+    monkeypatch.setattr('lib.tc.Guard.ad_hoc', mock_ad_hoc)
+    monkeypatch.setattr('lib.tc.Guard.wait_for_job_to_start',
+                        lambda self, job_id: None)
+    monkeypatch.setattr('lib.tc.Guard.monitor_many', mock_monitor_many)
+
+    ad_hoc = AdHoc()
+    ad_hoc.credential_id = 'ssh'
+    ad_hoc.module_name = 'command'
+    guard.ad_hoc_fan_out(ad_hoc, inventories=['eu', 'us', '3', 'eu'],
+                         limits=[], output_format='txt', workers=2)
+    # every name is resolved once, ids are not resolved
+    assert sorted(lookups) == ['eu', 'ssh', 'us']
+    assert len(launched) == 4
+    assert ('id-eu', 7, '') in launched
+    assert ('3', 7, '') in launched
+    assert len(monitored[0]) == 4
+    # the original command is not modified
+    assert ad_hoc.inventory_id is None
+
+    del launched[:]
+    guard.ad_hoc_fan_out(ad_hoc, inventories=['eu'], limits=['web', 'db'],
+                         output_format='txt')
+    assert sorted(launched) == [('id-eu', 7, 'db'), ('id-eu', 7, 'web')]
+
+    def mockerror(*args, **kwargs):
+        raise APIError
+
+    monkeypatch.setattr('lib.api.APIv1.inventory_ids', mockerror)
+    with pytest.raises(GuardError):
+        guard.ad_hoc_fan_out(ad_hoc, inventories=['eu'], limits=[],
+                             output_format='txt')
+
+
+def test_grant_permissions(monkeypatch):
+    def role(role_id, template, permission):
+        return {'id': role_id, 'name': permission,
+                'summary_fields': {'resource_type': 'job template',
+                                   'resource_name': template}}
+
+    roles = {'results': [role(1, 'deploy', 'Execute'),
+                         role(2, 'deploy', 'Admin'),
+                         role(3, 'backup', 'Execute')]}
+    users = {'alice': 10, 'bob': 20, 'carol': 30}
+    granted = {10: [{'id': 1}], 20: [], 30: []}
+    posts = []
+    role_calls = []
+    user_calls = []
+
+    def mock_roles(self):
+        role_calls.append(1)
+        return iter(roles['results'])
+
+    def mock_user_ids(self, usernames):
+        user_calls.append(usernames)
+        return dict((name, users[name]) for name in usernames)
+
+    def mock_user_roles(self, user_id):
+        return granted[user_id]
+
+    def mock_user_role(self, user_id, role_id):
+        posts.append((user_id, role_id))
+        if user_id == 30:
+            raise GuardError('forbidden')
+
+    monkeypatch.setattr('lib.api.APIv1.roles', mock_roles)
+    monkeypatch.setattr('lib.api.APIv1.user_ids', mock_user_ids)
+    monkeypatch.setattr('lib.api.APIv1.user_roles', mock_user_roles)
+    monkeypatch.setattr('lib.tc.Guard.user_role', mock_user_role)
+    guard = basic_guard()
+    grants = [('alice', 'Deploy', 'execute'),
+              ('alice', 'backup', 'execute'),
+              ('bob', 'deploy', 'admin'),
+              ('bob', 'deploy', 'admin')]
+    result = guard.grant_permissions(grants, workers=4)
+    assert result == [('alice', 'Deploy', 'execute', 'already granted'),
+                      ('alice', 'backup', 'execute', 'granted'),
+                      ('bob', 'deploy', 'admin', 'granted'),
+                      ('bob', 'deploy', 'admin', 'already granted')]
+    assert sorted(posts) == [(10, 3), (20, 2)]
+    assert len(role_calls) == 1
+    assert user_calls == [['alice', 'bob']]
+
+    # a failed grant is a row of the results, the others are granted
+    del posts[:]
+    result = guard.grant_permissions([('carol', 'deploy', 'admin'),
+                                      ('bob', 'backup', 'execute'),
+                                      ('carol', 'deploy', 'admin')])
+    assert result == [('carol', 'deploy', 'admin', 'error: forbidden'),
+                      ('bob', 'backup', 'execute', 'granted'),
+                      ('carol', 'deploy', 'admin', 'error: forbidden')]
+    assert sorted(posts) == [(20, 3), (30, 2)]
+
+    # every missing role is reported, nothing is granted
+    del posts[:]
+    with pytest.raises(GuardError) as error:
+        guard.grant_permissions([('alice', 'nope', 'read'),
+                                 ('bob', 'deploy', 'read')])
+    assert 'nope (read)' in str(error.value)
+    assert 'deploy (read)' in str(error.value)
+    assert posts == []
+
+
+def test_project_is_current():
+    now = datetime(2017, 3, 28, 10, 0, 0)
+    project = {'status': 'successful', 'scm_revision': 'abc123',
+               'last_updated': '2017-03-28T09:59:00.123456Z'}
+    assert project_is_current(project, now=now) is None
+    assert project_is_current(project, revision='abc', now=now) == \
+        'already at abc123'
+    assert project_is_current(project, revision='def', now=now) is None
+    assert project_is_current(project, max_age=120, now=now) == \
+        'updated 59s ago'
+    assert project_is_current(project, max_age=30, now=now) is None
+    # failed updates are never skipped
+    project['status'] = 'failed'
+    assert project_is_current(project, max_age=120, revision='abc',
+                              now=now) is None
+
+
+def test_update_projects(monkeypatch, capsys):
+    projects = {1: {'status': 'successful', 'scm_revision': 'abc',
+                    'last_updated': None},
+                2: {'status': 'failed', 'scm_revision': 'abc',
+                    'last_updated': None}}
+    updates = []
+    monitored = []
+
+    def mock_project_ids(self, names):
+        return {'app': 1, 'infra': 2}
+
+    def mock_project_details(self, project_id):
+        return projects[project_id]
+
+    def mock_update(self, project_id):
+        updates.append(project_id)
+        return {'project_update': 10 + project_id}
+
+    def mock_monitor_many(self, job_urls, output_format, labels, workers):
+        monitored.append((job_urls, labels))
+        return dict((url, 'successful') for url in job_urls)
+
+    monkeypatch.setattr('lib.api.APIv1.project_ids', mock_project_ids)
+    monkeypatch.setattr('lib.api.APIv1.project_details',
+                        mock_project_details)
+    monkeypatch.setattr('lib.api.APIv1.update_project_id', mock_update)
+    monkeypatch.setattr('lib.tc.Guard.monitor_many', mock_monitor_many)
+    guard = basic_guard()
+    stream = io.BytesIO()
+    guard.reporter = JSONReporter(stream)
+    result = guard.update_projects(['app', 'infra', 'app'], revision='abc')
+    update_url = 'https://{0}/api/v1/project_updates/12/'.format(HOST)
+    assert result == [('app', 'skipped (already at abc)', None),
+                      ('infra', 'started', update_url)]
+    assert updates == [2]
+    assert monitored == []
+    # the launch is reported with the url of the update
+    guard.reporter.flush()
+    launches = [json.loads(line) for line in
+                stream.getvalue().decode('ascii').splitlines()]
+    assert [(launch['type'], launch['job'], launch['project'])
+            for launch in launches] == [('launch', update_url, 'infra')]
+
+    del updates[:]
+    result = guard.update_projects(['app', 'infra'], wait=True)
+    assert [(name, status) for name, status, _ in result] == [
+        ('app', 'successful'), ('infra', 'successful')]
+    assert sorted(updates) == [1, 2]
+    urls, labels = monitored[0]
+    assert labels == ['app', 'infra']
+    assert urls[0].endswith('/api/v1/project_updates/11/')
+
+    def mockerror(*args, **kwargs):
+        raise APIError
+
+    monkeypatch.setattr('lib.api.APIv1.project_ids', mockerror)
+    with pytest.raises(GuardError):
+        guard.update_projects(['app'])
+
+
+def test_source_is_stale():
+    now = datetime(2017, 3, 28, 10, 0, 0)
+    source = {'status': 'successful',
+              'last_updated': '2017-03-28T09:58:00Z'}
+    assert not source_is_stale(source, 300, now=now)
+    assert source_is_stale(source, 60, now=now)
+    source['status'] = 'failed'
+    assert source_is_stale(source, 300, now=now)
+    assert source_is_stale({'status': 'successful', 'last_updated': None},
+                           300, now=now)
+    # a sync in progress is waited on
+    source['status'] = 'running'
+    assert not source_is_stale(source, 300, now=now)
+
+
+def test_refresh_inventory(monkeypatch):
+    sources = [{'id': 1, 'name': 'ec2', 'source': 'ec2',
+                'status': 'failed'},
+               {'id': 2, 'name': 'fresh', 'source': 'ec2',
+                'status': 'successful',
+                'last_updated': '2999-01-01T00:00:00Z'},
+               {'id': 3, 'name': 'manual', 'source': '',
+                'status': 'none'},
+               {'id': 4, 'name': 'gce', 'source': 'gce',
+                'status': 'never updated'},
+               {'id': 6, 'name': 'azure', 'source': 'azure_rm',
+                'status': 'pending',
+                'related': {'current_update': '/api/v1/inventory_updates/8/'}}]
+    template = {'results': [{'id': 9, 'inventory': 5}]}
+    updates = []
+    polls = []
+    pending_url = 'https://{0}/api/v1/inventory_updates/8/'.format(HOST)
+    final = {'update-1': 'successful', 'update-4': 'successful',
+             pending_url: 'successful'}
+
+    def mock_update(self, source_id):
+        updates.append(source_id)
+        return 'update-{0}'.format(source_id)
+
+    def mock_status(self, url):
+        polls.append(url)
+        if polls.count(url) == 1:
+            return 'running'
+        return final[url]
+
+    monkeypatch.setattr('lib.api.APIv1.template_data',
+                        lambda self, name: template)
+    monkeypatch.setattr('lib.api.APIv1.inventory_sources',
+                        lambda self, inventory_id: sources)
+    monkeypatch.setattr('lib.api.APIv1.update_inventory_source', mock_update)
+    monkeypatch.setattr('lib.api.APIv1.job_status', mock_status)
+    guard = basic_guard()
+    assert guard.refresh_inventory('deploy', 300) == ['azure', 'ec2', 'gce']
+    # the pending sync is not started again
+    assert sorted(updates) == [1, 4]
+    assert len(polls) == 6
+    assert pending_url in polls
+
+    final['update-4'] = 'failed'
+    with pytest.raises(GuardError) as error:
+        guard.refresh_inventory('deploy', 300)
+    assert 'gce' in str(error.value)
+
+    # inventory prompted on launch, nothing to sync
+    template['results'][0]['inventory'] = None
+    assert guard.refresh_inventory('deploy', 300) == []
+
+    template['results'] = []
+    with pytest.raises(GuardError):
+        guard.refresh_inventory('deploy', 300)
+
+
+def test_kick_and_monitor_refresh(monkeypatch):
+    calls = []
+    monkeypatch.setattr('lib.tc.Guard.refresh_inventory',
+                        lambda self, name, ttl: calls.append(('refresh', ttl)))
+    monkeypatch.setattr('lib.tc.Guard.get_template_id',
+                        lambda self, name: 7)
+    monkeypatch.setattr('lib.tc.Guard.kick',
+                        lambda *args: calls.append('launch') or {})
+    monkeypatch.setattr('lib.tc.Guard.launch_data_to_url',
+                        lambda self, job: 'url')
+    monkeypatch.setattr('lib.tc.Guard.monitor', lambda *args, **kwargs: None)
+    monkeypatch.setattr('lib.tc.Guard.find_duplicate', lambda *args: None)
+    guard = basic_guard()
+    stream = io.BytesIO()
+    guard.reporter = JSONReporter(stream)
+    guard.kick_and_monitor('deploy', {}, '', 'txt', refresh_ttl=60)
+    assert calls == [('refresh', 60), 'launch']
+    # the started job is reported
+    guard.reporter.flush()
+    record = json.loads(stream.getvalue().decode('ascii'))
+    assert (record['type'], record['job']) == ('launch', 'url')
+
+    # attached to an identical job, no refresh and no launch
+    calls[:] = []
+    monkeypatch.setattr('lib.tc.Guard.find_duplicate',
+                        lambda *args: {'id': 3})
+    monkeypatch.setattr('lib.tc.Guard.get_template',
+                        lambda self, name: {'id': 7})
+    guard.kick_and_monitor('deploy', {}, '', 'txt', refresh_ttl=60,
+                           dedupe=True)
+    assert calls == []
+
+
+def test_find_duplicate_template_defaults(monkeypatch):
+    # tower stores the template variables merged with the launch ones
+    running = [{'id': 4, 'url': '/api/v1/jobs/4/', 'limit': 'web',
+                'extra_vars': '{"env": "prod", "version": "1.0"}'}]
+    monkeypatch.setattr('lib.api.APIv1.active_jobs',
+                        lambda self, template_id: running)
+    guard = basic_guard()
+    template = {'id': 7, 'extra_vars': 'env: prod\nversion: "0.9"',
+                'limit': 'web', 'ask_variables_on_launch': True,
+                'ask_limit_on_launch': False}
+    assert guard.find_duplicate(template, {'version': '1.0'}, '')['id'] == 4
+    # the limit is not prompted for, the template one is used
+    assert guard.find_duplicate(template, {'version': '1.0'},
+                                'db')['id'] == 4
+    assert guard.find_duplicate(template, {'version': '0.9'}, '') is None
+    # launch variables are ignored when they are not prompted for
+    template['ask_variables_on_launch'] = False
+    template['extra_vars'] = '{"env": "prod", "version": "1.0"}'
+    assert guard.find_duplicate(template, {'version': '2.0'}, '')['id'] == 4
+    template['ask_limit_on_launch'] = True
+    assert guard.find_duplicate(template, {}, 'db') is None
+
+
+def test_launch_values():
+    template = {'extra_vars': '---\na: 1\nb: 2\n', 'limit': 'web',
+                'ask_variables_on_launch': True}
+    assert launch_values(template, 'db', {'b': 3}) == ('web',
+                                                      {'a': 1, 'b': 3})
+    template['ask_limit_on_launch'] = True
+    assert launch_values(template, 'db', None) == ('db', {'a': 1, 'b': 2})
+    assert launch_values(template, '', None)[0] == 'web'
+    # surveys accept launch variables
+    assert launch_values({'survey_enabled': True}, None,
+                         {'a': 1}) == (None, {'a': 1})
+    assert launch_values({'extra_vars': '[1'}, None, None) == (None, {})
+
+
+def test_launch_fingerprint():
+    fingerprint = launch_fingerprint(7, 'web', {'a': 1, 'b': [1, 2]})
+    assert fingerprint == launch_fingerprint('7', 'web',
+                                             '{"b": [1, 2], "a": 1}')
+    assert fingerprint != launch_fingerprint(7, 'db', {'a': 1, 'b': [1, 2]})
+    assert fingerprint != launch_fingerprint(7, 'web', {'a': 2, 'b': [1, 2]})
+    assert fingerprint != launch_fingerprint(8, 'web', {'a': 1, 'b': [1, 2]})
+    assert launch_fingerprint(7, None, '') == launch_fingerprint(7, '', {})
+    # not json, compared as it is
+    assert launch_fingerprint(7, '', 'a: 1') != launch_fingerprint(7, '', {})
+
+
+def test_kick_and_monitor_dedupe(monkeypatch, capsys):
+    running = [{'id': 3, 'url': '/api/v1/jobs/3/', 'limit': '',
+                'extra_vars': '{"version": "1.0"}'},
+               {'id': 2, 'url': '/api/v1/jobs/2/', 'limit': 'web',
+                'extra_vars': '{"version": "1.0"}'}]
+    kicked = []
+    monitored = []
+
+    def mock_kick(self, template_id, extra_vars, limit):
+        kicked.append(limit)
+        return {'id': 9, 'url': '/api/v1/jobs/9/'}
+
+    monkeypatch.setattr('lib.api.APIv1.active_jobs',
+                        lambda self, template_id: running)
+    template = {'id': 7, 'ask_variables_on_launch': True,
+                'ask_limit_on_launch': True}
+    monkeypatch.setattr('lib.tc.Guard.get_template',
+                        lambda self, name: template)
+    monkeypatch.setattr('lib.tc.Guard.get_template_id', lambda self, name: 7)
+    monkeypatch.setattr('lib.tc.Guard.kick', mock_kick)
+    monkeypatch.setattr('lib.tc.Guard.monitor',
+                        lambda self, url, *args, **kwargs:
+                        monitored.append(url))
+    guard = basic_guard()
+    assert guard.find_duplicate(template, {'version': '1.0'},
+                                'web')['id'] == 2
+    assert guard.find_duplicate(template, {'version': '2.0'},
+                                'web') is None
+
+    guard.kick_and_monitor('deploy', {'version': '1.0'}, 'web', 'txt',
+                           dedupe=True)
+    assert kicked == []
+    assert monitored[-1].endswith('/api/v1/jobs/2/')
+    assert 'Attaching to job' in capsys.readouterr()[0]
+
+    guard.kick_and_monitor('deploy', {'version': '1.0'}, 'db', 'txt',
+                           dedupe=True)
+    assert kicked == ['db']
+    assert monitored[-1].endswith('/api/v1/jobs/9/')
+
+    # without dedupe, a new job is always started
+    guard.kick_and_monitor('deploy', {'version': '1.0'}, 'web', 'txt')
+    assert kicked == ['db', 'web']
+
+    with pytest.raises(GuardError):
+        guard.kick_and_monitor('deploy', {}, '', 'txt', slices=2,
+                               dedupe=True)
+
+
+def test_launch_scheduler(monkeypatch):
+    guard = basic_guard()
+    assert guard.launch_scheduler() is None
+    guard.config.update('launch_share', '0.5')
+    guard.config.update('instance_group', 'eu')
+    scheduler = guard.launch_scheduler()
+    assert scheduler.share == 0.5
+    assert scheduler.instance_group == 'eu'
+    guard.config.update('job_impact', '3')
+    assert guard.launch_scheduler().job_impact == 3
+    for share, impact in (('2', '3'), ('0', '3'), ('half', '3'),
+                          ('0.5', '0')):
+        guard.config.update('launch_share', share)
+        guard.config.update('job_impact', impact)
+        with pytest.raises(GuardError):
+            guard.launch_scheduler()
+
+
+def test_launch_many(monkeypatch):
+    runs = []
+
+    def mock_run(self, launch, items, workers):
+        runs.append(list(items))
+        return [launch(item) for item in items]
+
+    monkeypatch.setattr('lib.scheduler.LaunchScheduler.run', mock_run)
+    guard = basic_guard()
+    assert guard._launch_many(str, [1, 2], workers=2) == ['1', '2']
+    assert runs == []
+    guard.config.update('launch_share', '0.5')
+    assert guard._launch_many(str, [1, 2], workers=2) == ['1', '2']
+    assert runs == [[1, 2]]
+
+    def mockerror(*args, **kwargs):
+        raise APIError
+
+    monkeypatch.setattr('lib.scheduler.LaunchScheduler.run', mockerror)
+    with pytest.raises(GuardError):
+        guard._launch_many(str, [1, 2], workers=2)
+
+
+def profile_guard(host):
+    guard = basic_guard()
+    guard.config.update('host', host)
+    guard.api.host = host
+    return guard
+
+
+def test_kick_profiles(monkeypatch):
+    def mock_template_id(self, template_name):
+        if self.api.host == 'asia':
+            raise GuardError('no such template')
+        return 1
+
+    def mock_kick(self, template_id, extra_vars, limit):
+        return {'url': '/api/v1/jobs/{0}/'.format(self.api.host)}
+
+    monkeypatch.setattr('lib.tc.Guard.get_template_id', mock_template_id)
+    monkeypatch.setattr('lib.tc.Guard.kick', mock_kick)
+    guards = dict((host, profile_guard(host)) for host in ('us', 'eu'))
+    launched = kick_profiles(guards, 'deploy', {}, '')
+    assert [profile for profile, _, _ in launched] == ['eu', 'us']
+    assert launched[0][1].endswith('/api/v1/jobs/eu/')
+    assert launched[0][2] is None
+
+    monitored = []
+
+    def mock_monitor_many(self, job_urls, output_format, labels, summary,
+                          apis, log_file=None):
+        monitored.append((labels, [api.host for api in apis]))
+        return dict((url, 'successful') for url in job_urls)
+
+    monkeypatch.setattr('lib.tc.Guard.monitor_many', mock_monitor_many)
+    assert kick_and_monitor_profiles(guards, 'deploy', {}, '', 'txt') == \
+        {'eu': 'successful', 'us': 'successful'}
+    # every job is polled through the api of its own tower
+    assert monitored == [(['eu', 'us'], ['eu', 'us'])]
+
+    # a broken region does not stop the others
+    del monitored[:]
+    guards['asia'] = profile_guard('asia')
+    with pytest.raises(GuardError) as error:
+        kick_and_monitor_profiles(guards, 'deploy', {}, '', 'txt')
+    assert 'asia: no such template' in str(error.value)
+    assert monitored == [(['eu', 'us'], ['eu', 'us'])]
+
+
+def test_monitor_many_apis(monkeypatch, capsys):
+    polled = []
+
+    def mock_finished(self, job_url):
+        polled.append((self.host, job_url))
+        return True
+
+    monkeypatch.setattr('lib.api.APIv1.job_finished', mock_finished)
+    monkeypatch.setattr('lib.api.APIv1.job_stdout',
+                        lambda self, url, output_format: u'')
+    monkeypatch.setattr('lib.api.APIv1.job_status',
+                        lambda self, url: 'successful')
+    eu, us = profile_guard('eu'), profile_guard('us')
+    eu.monitor_many(['eu/1', 'us/1'], 'txt', labels=['eu', 'us'],
+                    apis=[eu.api, us.api])
+    assert sorted(polled) == [('eu', 'eu/1'), ('us', 'us/1')]
+
+
+def test_archive(monkeypatch, tmpdir):
+    outputs = {1: b'output of job 1', 2: b'output of job 2'}
+    downloads = []
+    queries = []
+
+    def mock_download(self, job_id, offset=0, chunk_size=None):
+        downloads.append((job_id, offset))
+        return offset, iter([outputs[job_id][offset:]])
+
+    def mock_job_ids(self, filters):
+        queries.append(filters)
+        return [2, 1]
+
+    monkeypatch.setattr('lib.api.APIv1.download_stdout', mock_download)
+    monkeypatch.setattr('lib.api.APIv1.job_ids', mock_job_ids)
+    directory = str(tmpdir.join('archive'))
+    # an interrupted download of job 2
+    os.makedirs(directory)
+    with open(os.path.join(directory, 'job-2.txt.part'), 'wb') as part:
+        part.write(b'output ')
+
+    guard = basic_guard()
+    results = guard.archive(job_ids=['1'],
+                            filters={'job_template__name': 'deploy'},
+                            directory=directory, workers=2)
+    assert results == [
+        (1, 'downloaded', 15, os.path.join(directory, 'job-1.txt')),
+        (2, 'resumed', 15, os.path.join(directory, 'job-2.txt'))]
+    assert sorted(downloads) == [(1, 0), (2, 7)]
+    assert queries == [{'job_template__name': 'deploy',
+                        'status__in': 'successful,failed,error,canceled'}]
+    for job_id, output in outputs.items():
+        with open(os.path.join(directory, 'job-{0}.txt'.format(job_id)),
+                  'rb') as output_in:
+            assert output_in.read() == output
+
+    # archived jobs are not downloaded again, status filters are kept
+    results = guard.archive(filters={'status': 'failed'},
+                            directory=directory)
+    assert [status for _, status, _, _ in results] == ['already archived'] * 2
+    assert queries[-1] == {'status': 'failed'}
+
+    def mockerror(self, job_id, offset=0, chunk_size=None):
+        raise APIError('not found')
+
+    monkeypatch.setattr('lib.api.APIv1.download_stdout', mockerror)
+    # a job that cannot be archived does not stop the others
+    results = guard.archive(job_ids=[3, 1], directory=directory)
+    assert results == [
+        (1, 'already archived', None, os.path.join(directory, 'job-1.txt')),
+        (3, 'error: job 3: not found', None, None)]
+
+    monkeypatch.setattr('lib.api.APIv1.job_ids', mockerror)
+    with pytest.raises(GuardError):
+        guard.archive(filters={'status': 'failed'}, directory=directory)
+
+
+def test_monitor_host_logs(monkeypatch, tmpdir):
+    statuses = ['running', 'failed', 'failed']
+    pages = [{'results': [{'id': 1, 'event': 'runner_on_ok',
+                           'host_name': 'web-01', 'task': 'setup',
+                           'stdout': 'ok: [web-01]'}], 'next': None},
+             {'results': [{'id': 2, 'event': 'runner_on_failed',
+                           'host_name': 'web-02', 'task': 'setup',
+                           'stdout': 'fatal: [web-02]: FAILED!'}],
+              'next': None}]
+    cursors = []
+
+    def mock_get_json(self, url, params, data):
+        return {'status': statuses.pop(0)}
+
+    def mock_events(self, job_url, last_id=0):
+        cursors.append(last_id)
+        return pages.pop(0)
+
+    def mock_stdout(self, url, output_format):
+        return 'the whole output'
+
+    monkeypatch.setattr('lib.api.APIv1._get_json', mock_get_json)
+    monkeypatch.setattr('lib.api.APIv1.job_events', mock_events)
+    monkeypatch.setattr('lib.api.APIv1.job_stdout', mock_stdout)
+    directory = str(tmpdir.join('hosts'))
+    guard = basic_guard()
+    # the index is written for failed jobs too
+    with pytest.raises(GuardError):
+        guard.monitor('/api/v1/jobs/1/', 'txt', host_logs=directory)
+    # only the new events are requested at every poll
+    assert cursors == [0, 1]
+    hosts = read_index(directory)['hosts']
+    # no recap, only the failures are known
+    assert hosts['web-01']['state'] == 'unknown'
+    assert hosts['web-02']['state'] == 'failed'
+    assert tmpdir.join('hosts', 'web-02.log').read() == (
+        'TASK [setup]\nfatal: [web-02]: FAILED!\n')
+
+
+def test_archive_hosts(monkeypatch, tmpdir):
+    requests = []
+
+    def mock_events(self, job_url, last_id=0):
+        requests.append((job_url, last_id))
+        if last_id:
+            return {'results': [], 'next': None}
+        return {'results': [{'id': 1, 'event': 'runner_on_ok',
+                             'host_name': 'web-01',
+                             'stdout': 'ok: [web-01]'}],
+                'next': '/next/'}
+
+    def mock_download(self, job_id, offset=0, chunk_size=None):
+        return offset, iter([b'ok: [web-01]\n'])
+
+    def mock_job_url(self, job_id):
+        return '/api/v1/jobs/{0}/'.format(job_id)
+
+    monkeypatch.setattr('lib.api.APIv1.job_events', mock_events)
+    monkeypatch.setattr('lib.api.APIv1.download_stdout', mock_download)
+    monkeypatch.setattr('lib.api.APIv1.job_url', mock_job_url)
+    monkeypatch.setattr('lib.api.APIv1.job_finished',
+                        lambda self, job_url: job_url != '/api/v1/jobs/8/')
+    directory = str(tmpdir.join('archive'))
+    guard = basic_guard()
+    results = guard.archive(job_ids=[7, 8], directory=directory,
+                            host_logs=True)
+    assert requests == [('/api/v1/jobs/7/', 0), ('/api/v1/jobs/7/', 1)]
+    assert read_index(os.path.join(directory, 'job-7.hosts')) == {
+        'job': '/api/v1/jobs/7/',
+        'hosts': {'web-01': {'file': 'web-01.log', 'events': 1,
+                             'changed': 0, 'failed': 0, 'state': 'unknown'}}}
+    # a running job is not split
+    assert results[1][1] == 'error: job 8 is not finished, its output ' \
+        'cannot be split by host yet'
+    assert not os.path.exists(os.path.join(directory, 'job-8.hosts'))
+    # already split
+    guard.archive(job_ids=[7], directory=directory, host_logs=True)
+    assert len(requests) == 2
+
+
+def test_output_store(monkeypatch, tmpdir, capsys):
+    def mock_finished(*args, **kwargs):
+        return True
+
+    def mock_stdout(self, job_url, output_format):
+        return u'output of {0}\nfatal: [web-01]: FAILED!\n'.format(job_url)
+
+    def mock_status(*args, **kwargs):
+        return 'successful'
+
+    def mock_download(self, job_id, offset=0, chunk_size=None):
+        return 0, iter([b'archived output\n'])
+
+    monkeypatch.setattr('lib.api.APIv1.job_finished', mock_finished)
+    monkeypatch.setattr('lib.api.APIv1.job_stdout', mock_stdout)
+    monkeypatch.setattr('lib.api.APIv1.job_status', mock_status)
+    monkeypatch.setattr('lib.api.APIv1.download_stdout', mock_download)
+    guard = basic_guard()
+    assert guard.output_store() is None
+    with pytest.raises(GuardError):
+        guard.grep('FAILED')
+    # nothing is stored without output_store
+    url = 'https://{0}/api/v1/{1}/'.format
+    guard.monitor(url(HOST, 'jobs/10'), 'txt')
+
+    guard.config.update('output_store', str(tmpdir.join('store')))
+    guard.monitor(url(HOST, 'jobs/11'), 'txt')
+    # the same job id on another tower does not clash
+    guard.monitor_many([url(HOST, 'jobs/12'), url(HOST, 'ad_hoc_commands/13'),
+                        url('eu.example.com', 'jobs/11')], 'ansi')
+    guard.archive(job_ids=[14], directory=str(tmpdir.join('archive')))
+    store = guard.output_store()
+    keys = ['11@{0}', '12@{0}', '14@{0}', 'ad_hoc_commands-13@{0}']
+    keys = [key.format(HOST) for key in keys]
+    assert store.keys() == ['11@eu.example.com'] + keys
+
+    results = guard.grep('failed', ignore_case=True, processes=1)
+    assert [key for key, _ in results] == ['11@eu.example.com'] + [
+        keys[0], keys[1], keys[3]]
+    results = guard.grep('archived', job_ids=[14, 11])
+    assert results == [(keys[2], [(1, u'archived output', True)])]
+    with pytest.raises(GuardError):
+        guard.grep('output', job_ids=[10])
+
+    with open(guard.stored_output(14), 'rb') as output_in:
+        assert output_in.read() == b'archived output\n'
+    with open(guard.stored_output('11@eu.example.com'), 'rb') as output_in:
+        assert b'eu.example.com' in output_in.read()
+    with pytest.raises(GuardError):
+        guard.stored_output(10)
+    capsys.readouterr()
+
+    # the job is over, a store that cannot be written is only a warning
+    def mock_put(*args):
+        raise StoreError('disk full')
+
+    monkeypatch.setattr('lib.store.OutputStore.put', mock_put)
+    guard.monitor(url(HOST, 'jobs/15'), 'txt')
+    assert 'Warning: output not stored: disk full' in capsys.readouterr()[0]
+
+
+def test_monitor_log_file(monkeypatch, capsys, tmpdir):
+    outputs = [u'\x1b[0;32mok: [web-01]\x1b[0m\n',
+               u'\x1b[0;32mok: [web-01]\x1b[0m\n'
+               u'\x1b[0;31mfatal: [web-02]\x1b[0m\n']
+    fetched = []
+    polls = []
+
+    def mock_finished(self, job_url):
+        polls.append(job_url)
+        return len(polls) >= 2
+
+    def mock_stdout(self, job_url, output_format):
+        fetched.append(output_format)
+        return outputs[len(polls) - 1]
+
+    def mock_status(*args, **kwargs):
+        return 'successful'
+
+    def mock_events(self, job_url, last_id=0):
+        if last_id:
+            return {'results': [], 'next': None}
+        return {'results': [{'id': 1, 'event': 'runner_on_ok',
+                             'host_name': 'web-01'}], 'next': None}
+
+    monkeypatch.setattr('lib.api.APIv1.job_finished', mock_finished)
+    monkeypatch.setattr('lib.api.APIv1.job_stdout', mock_stdout)
+    monkeypatch.setattr('lib.api.APIv1.job_status', mock_status)
+    monkeypatch.setattr('lib.api.APIv1.job_events', mock_events)
+    log_file = tmpdir.join('job.log')
+    guard = basic_guard()
+    guard.monitor('https://tower/api/v1/jobs/1/', 'ansi',
+                  log_file=str(log_file))
+    # a single download per poll serves both outputs
+    assert fetched == ['ansi', 'ansi']
+    out = capsys.readouterr()[0]
+    assert '\x1b[0;31mfatal: [web-02]' in out
+    assert log_file.read() == 'ok: [web-01]\nfatal: [web-02]\n'
+
+    # many jobs, the log gets the prefixed lines
+    log_file.remove()
+    del polls[:]
+    guard.monitor_many(['job-1'], 'ansi', labels=['first'],
+                       log_file=str(log_file))
+    assert log_file.read() == ('[first] ok: [web-01]\n'
+                               '[first] fatal: [web-02]\n')
+
+    # events are logged as json lines
+    log_file.remove()
+    guard.monitor('https://tower/api/v1/jobs/1/', 'events',
+                  log_file=str(log_file))
+    record = json.loads(log_file.read())
+    assert record['host'] == 'web-01'
+
+    with pytest.raises(GuardError):
+        guard.monitor('https://tower/api/v1/jobs/1/', 'ansi',
+                      log_file=str(tmpdir.join('missing', 'job.log')))
@@ -0,0 +1,130 @@
+"""
+Testing the host logs
+"""
+import os
+import pytest
+from lib.hostlogs import HostLogs, HostLogsError, host_file_name
+from lib.hostlogs import host_logs_path, read_index
+
+
+def event(event_id, name, host=None, task=None, stdout=u'', **fields):
+    raw = {'id': event_id, 'event': name, 'host_name': host, 'task': task,
+           'stdout': stdout}
+    raw.update(fields)
+    return raw
+
+
+EVENTS = [
+    event(1, 'playbook_on_start'),
+    event(2, 'runner_on_ok', 'web-01', 'setup', u'\x1b[0;32mok: [web-01]'
+          u'\x1b[0m'),
+    event(3, 'runner_on_ok', 'web-02', 'setup', u'ok: [web-02]'),
+    event(4, 'runner_on_ok', 'web-01', 'deploy', u'changed: [web-01]',
+          changed=True),
+    event(5, 'runner_on_failed', 'web-02', 'deploy',
+          u'fatal: [web-02]: FAILED!', failed=True),
+    event(6, 'runner_on_unreachable', 'db/01', 'setup',
+          u'fatal: [db/01]: UNREACHABLE!'),
+    event(7, 'runner_on_ok', 'web-01', 'deploy', u'ok: [web-01] => (x)'),
+    event(8, 'playbook_on_stats',
+          event_data={'ok': {'web-01': 3, 'web-02': 1, 'web-03': 1},
+                      'changed': {'web-01': 1}, 'failures': {'web-02': 1},
+                      'dark': {'db/01': 1}}),
+]
+
+
+def test_host_file_name():
+    assert host_file_name('web-01.example.com') == 'web-01.example.com.log'
+    assert host_file_name('db/01') == 'db_01.log'
+    assert host_file_name('../etc') == '_etc.log'
+    assert host_logs_path('archive', 12) == os.path.join('archive',
+                                                         'job-12.hosts')
+
+
+@pytest.mark.parametrize('max_open,buffer_size', [(1, 1), (64, 1),
+                                                   (1, 1024)])
+def test_host_logs(tmpdir, max_open, buffer_size):
+    directory = str(tmpdir.join('hosts'))
+    logs = HostLogs(directory, '/api/v1/jobs/12/', max_open=max_open,
+                    buffer_size=buffer_size)
+    for raw in EVENTS:
+        logs.write(raw)
+        # never more than max_open files
+        assert len(logs._files) <= max_open
+    # the index is written when all the events are in
+    assert read_index(directory) is None
+    logs.finish()
+
+    index = read_index(directory)
+    assert index['job'] == '/api/v1/jobs/12/'
+    hosts = index['hosts']
+    assert sorted(hosts) == ['db/01', 'web-01', 'web-02', 'web-03']
+    assert hosts['web-01'] == {'file': 'web-01.log', 'events': 3,
+                               'changed': 1, 'failed': 0, 'state': 'ok'}
+    assert hosts['web-02']['state'] == 'failed'
+    assert hosts['web-02']['failed'] == 1
+    assert hosts['db/01']['state'] == 'unreachable'
+    assert hosts['db/01']['file'] == 'db_01.log'
+    # in the recap, without output
+    assert hosts['web-03']['file'] is None
+    assert hosts['web-03']['state'] == 'ok'
+
+    # reopened files are appended to
+    assert tmpdir.join('hosts', 'web-01.log').read() == (
+        'TASK [setup]\nok: [web-01]\nTASK [deploy]\nchanged: [web-01]\n'
+        'ok: [web-01] => (x)\n')
+    assert tmpdir.join('hosts', 'web-02.log').read() == (
+        'TASK [setup]\nok: [web-02]\nTASK [deploy]\n'
+        'fatal: [web-02]: FAILED!\n')
+
+
+def test_host_logs_buffer(tmpdir):
+    logs = HostLogs(str(tmpdir), buffer_size=30)
+    logs.write(event(1, 'runner_on_ok', 'web-01', 'setup', u'ok: [web-01]'))
+    # buffered, no file opened yet
+    assert not tmpdir.join('web-01.log').check()
+    logs.write(event(2, 'runner_on_ok', 'web-02', 'setup', u'ok: [web-02]'))
+    # the buffers are full, every host is written at once
+    assert sorted(logs._files) == ['web-01', 'web-02']
+    assert not logs._buffers
+    logs.write(event(3, 'runner_on_ok', 'web-01', 'deploy', u'ok'))
+    logs.finish()
+    assert tmpdir.join('web-01.log').read() == (
+        'TASK [setup]\nok: [web-01]\nTASK [deploy]\nok\n')
+    assert tmpdir.join('web-02.log').read() == 'TASK [setup]\nok: [web-02]\n'
+    # no recap, the state of the hosts that did not fail is unknown
+    hosts = read_index(str(tmpdir))['hosts']
+    assert hosts['web-01']['state'] == 'unknown'
+
+
+def test_host_logs_names(tmpdir):
+    logs = HostLogs(str(tmpdir))
+    logs.write(event(1, 'runner_on_ok', 'db/01', 'setup', u'ok'))
+    logs.write(event(2, 'runner_on_ok', 'db:01', 'setup', u'ok'))
+    # old towers, events without stdout
+    raw = event(3, 'runner_on_ok', 'web-01', 'setup')
+    del raw['stdout']
+    logs.write(raw)
+    logs.finish()
+    hosts = read_index(str(tmpdir))['hosts']
+    assert hosts['db/01']['file'] == 'db_01.log'
+    assert hosts['db:01']['file'] == 'db_01-2.log'
+    assert '"event": "runner_on_ok"' in tmpdir.join('web-01.log').read()
+
+
+def test_host_logs_errors(tmpdir):
+    blocker = tmpdir.join('file')
+    blocker.write('')
+    with pytest.raises(HostLogsError):
+        HostLogs(str(blocker.join('hosts')))
+
+    logs = HostLogs(str(tmpdir.join('hosts')))
+    tmpdir.join('hosts', 'web-01.log').mkdir()
+    logs.write(event(1, 'runner_on_ok', 'web-01', 'setup', u'ok'))
+    with pytest.raises(HostLogsError):
+        logs.finish()
+    # closing after a failure does not raise
+    logs = HostLogs(str(tmpdir.join('hosts')), buffer_size=1)
+    with pytest.raises(HostLogsError):
+        logs.write(event(1, 'runner_on_ok', 'web-01', 'setup', u'ok'))
+    logs.close()
@@ -0,0 +1,59 @@
+import pytest
+from lib.nodes import NodePool, NodeError, RETRY_INTERVAL, PROBE_INTERVAL
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_single_node():
+    def probe(host):
+        raise AssertionError('single nodes are never probed')
+
+    pool = NodePool(['tower'], probe)
+    assert pool.pick() == 'tower'
+    assert pool.pick(exclude=['tower']) == 'tower'
+
+
+def test_pick():
+    pings = {'a': 0.10, 'b': 0.12, 'c': 0.50}
+    probes = []
+
+    def probe(host):
+        probes.append(host)
+        if host == 'down':
+            raise IOError('connection refused')
+        return pings[host]
+
+    clock = Clock()
+    pool = NodePool(['a', 'b', 'c', 'down'], probe, clock=clock)
+    # requests are spread over the fast nodes only
+    picked = set(pool.pick() for _ in range(10))
+    assert picked == set(['a', 'b'])
+    assert sorted(probes) == ['a', 'b', 'c', 'down']
+    assert pool.healthy() == ['a', 'b', 'c']
+    assert pool.pick(exclude=['a', 'b']) == 'c'
+
+    # nodes are probed again after a while
+    clock.now += PROBE_INTERVAL
+    pings['c'] = 0.01
+    pool.pick()
+    assert len(probes) == 8
+    assert pool.healthy()[0] == 'c'
+
+
+def test_failed():
+    clock = Clock()
+    pool = NodePool(['a', 'b'], lambda host: 0.1, clock=clock)
+    pool.pick()
+    pool.failed('a')
+    assert set(pool.pick() for _ in range(4)) == set(['b'])
+    with pytest.raises(NodeError):
+        pool.pick(exclude=['b'])
+    # failed nodes are tried again later
+    clock.now += RETRY_INTERVAL
+    assert 'a' in pool.healthy()
@@ -0,0 +1,77 @@
+import os
+import pytest
+from lib import pager
+from lib.pager import IndexedOutput, PagerError
+
+
+def write(tmpdir, name, data):
+    path = tmpdir.join(name)
+    path.write(data, mode='wb')
+    return str(path)
+
+
+def test_indexed_output(tmpdir):
+    lines = [u'line {0}\n'.format(number).encode('utf-8')
+             for number in range(1, 101)]
+    path = write(tmpdir, 'job-1.txt', b''.join(lines))
+    index = str(tmpdir.join('index', 'job-1.idx'))
+    with IndexedOutput(path, index) as output:
+        assert output.count == 100
+        assert output.lines(1, 1) == b'line 1\n'
+        assert output.lines(57, 57) == b'line 57\n'
+        assert output.lines(101, 101) == b''
+        assert output.lines(1, 2) == b'line 1\nline 2\n'
+        assert output.lines(99, 100) == b'line 99\nline 100\n'
+        assert output.lines(-99, 100) == b''.join(lines)
+        assert output.lines(10, 12) == b''.join(lines[9:12])
+        assert output.lines(99, 1000) == b''.join(lines[98:])
+        assert output.lines(5, 4) == b''
+    assert os.path.exists(index)
+
+
+def test_index_is_persistent(monkeypatch, tmpdir):
+    path = write(tmpdir, 'job-1.txt', b'a\nb\nc')
+    index = str(tmpdir.join('job-1.idx'))
+    IndexedOutput(path, index).close()
+    built = []
+
+    def mock_build(*args):
+        built.append(args)
+        return original(*args)
+
+    original = pager.build_index
+    monkeypatch.setattr('lib.pager.build_index', mock_build)
+    with IndexedOutput(path, index) as output:
+        # no trailing new line
+        assert output.count == 3
+        assert output.lines(3, 3) == b'c'
+    assert built == []
+
+    # the output changed, the index is built again
+    write(tmpdir, 'job-1.txt', b'a\nb\nc\nd\n')
+    with IndexedOutput(path, index) as output:
+        assert output.count == 4
+        assert output.lines(4, 4) == b'd\n'
+    assert len(built) == 1
+
+
+def test_big_index(monkeypatch, tmpdir):
+    monkeypatch.setattr('lib.pager.BATCH_SIZE', 7)
+    path = write(tmpdir, 'job-1.txt', b'x\n' * 50)
+    with IndexedOutput(path, str(tmpdir.join('job-1.idx'))) as output:
+        assert output.count == 50
+        assert output.lines(20, 22) == b'x\n' * 3
+
+
+def test_empty_output(tmpdir):
+    path = write(tmpdir, 'job-1.txt', b'')
+    with IndexedOutput(path, str(tmpdir.join('job-1.idx'))) as output:
+        assert output.count == 0
+        assert output.lines(-9, 0) == b''
+        assert output.lines(1, 1) == b''
+
+
+def test_errors(tmpdir):
+    with pytest.raises(PagerError):
+        IndexedOutput(str(tmpdir.join('missing.txt')),
+                      str(tmpdir.join('missing.idx')))
@@ -0,0 +1,117 @@
+import json
+from lib.recap import RecapParser
+
+
+OUTPUT = u"""PLAY [all] *********************************************************************
+
+TASK [setup] *******************************************************************
+ok: [web-01]
+ok: [web-02]
+\x1b[0;31mfatal: [web-03]: UNREACHABLE! => {"changed": false, "unreachable": true}\x1b[0m
+
+TASK [install package] *********************************************************
+changed: [web-01]
+fatal: [web-02]: FAILED! => {"changed": false, "failed": true,
+    "msg": "No package matching 'foo' found available"}
+ok: [web-04]
+
+PLAY RECAP *********************************************************************
+web-01                     : ok=2    changed=1    unreachable=0    failed=0
+web-02                     : ok=1    changed=0    unreachable=0    failed=1
+\x1b[0;31mweb-03\x1b[0m                     : ok=0    changed=0    unreachable=1    failed=0
+"""
+
+
+def feed_in_chunks(parser, text, size):
+    for start in range(0, len(text), size):
+        parser.feed(text[start:start + size])
+    parser.close()
+
+
+def test_recap_parser():
+    # the result must not depend on how the output is chunked
+    for size in (1, 7, 64, len(OUTPUT)):
+        parser = RecapParser()
+        feed_in_chunks(parser, OUTPUT, size)
+        assert parser.hosts['web-01'] == {'ok': 2, 'changed': 1,
+                                          'unreachable': 0, 'failed': 0}
+        assert parser.hosts['web-02']['failed'] == 1
+        assert parser.hosts['web-03']['unreachable'] == 1
+        assert parser.failed_hosts() == ['web-02', 'web-03']
+        assert len(parser.failures) == 2
+        unreachable, failed = parser.failures
+        assert unreachable['host'] == 'web-03'
+        assert unreachable['task'] == 'setup'
+        assert failed['host'] == 'web-02'
+        assert failed['task'] == 'install package'
+        assert len(failed['lines']) == 2
+
+
+def test_recap_parser_limits():
+    parser = RecapParser()
+    lines = []
+    for index in range(RecapParser.MAX_BLOCKS + 5):
+        lines.append(u'fatal: [host-{0}]: FAILED! => {{}}'.format(index))
+        lines.extend([u'    detail'] * (RecapParser.MAX_BLOCK_LINES + 5))
+    parser.feed(u'\n'.join(lines))
+    parser.close()
+    assert len(parser.failures) == RecapParser.MAX_BLOCKS
+    assert parser.dropped_failures == 5
+    for block in parser.failures:
+        assert len(block['lines']) == RecapParser.MAX_BLOCK_LINES
+
+
+def test_recap_parser_output():
+    parser = RecapParser()
+    parser.feed(OUTPUT)
+    parser.close()
+    summary = json.loads(parser.to_json())
+    assert summary['failed_hosts'] == ['web-02', 'web-03']
+    text = parser.to_text()
+    assert 'SUMMARY: 3 hosts' in text
+    assert 'failed hosts: web-02, web-03' in text
+    assert 'TASK [install package] on web-02' in text
+
+
+def test_recap_parser_events():
+    parser = RecapParser()
+    events = [{'event': 'runner_on_ok', 'host_name': 'web-01'},
+              {'event': 'runner_on_failed', 'host_name': 'web-02',
+               'task': 'install package',
+               'event_data': {'res': {'msg': 'No package matching'}}},
+              {'event': 'runner_on_failed', 'host_name': 'web-01',
+               'event_data': {'ignore_errors': True, 'res': {}}},
+              {'event': 'runner_on_unreachable', 'host_name': 'web-03',
+               'event_data': {'task': 'setup', 'res': {'unreachable': True}}},
+              {'event': 'playbook_on_stats',
+               'event_data': {'ok': {'web-01': 2, 'web-02': 1},
+                              'changed': {'web-01': 1},
+                              'dark': {'web-03': 1},
+                              'failures': {'web-02': 1}}}]
+    for event in events:
+        parser.feed_event(event)
+    parser.close()
+    assert parser.hosts['web-01'] == {'ok': 2, 'changed': 1, 'unreachable': 0,
+                                      'failed': 0, 'skipped': 0}
+    assert parser.failed_hosts() == ['web-02', 'web-03']
+    assert [block['host'] for block in parser.failures] == ['web-02', 'web-03']
+    failed, unreachable = parser.failures
+    assert failed['task'] == 'install package'
+    assert 'No package matching' in failed['lines'][0]
+    assert unreachable['task'] == 'setup'
+
+
+def test_recap_parser_merge():
+    first = RecapParser()
+    first.feed(OUTPUT)
+    first.close()
+    second = RecapParser()
+    second.feed(u'PLAY RECAP ***\nweb-09 : ok=1 changed=0 unreachable=0 '
+                u'failed=1\n')
+    second.close()
+    merged = RecapParser()
+    merged.merge(first)
+    merged.merge(second)
+    assert sorted(merged.hosts) == ['web-01', 'web-02', 'web-03', 'web-09']
+    assert merged.failed_hosts() == ['web-02', 'web-03', 'web-09']
+    assert len(merged.failures) == 2
@@ -0,0 +1,90 @@
+"""
+Testing the reporters
+"""
+import io
+import json
+from lib.recap import RecapParser
+from lib.reporter import Reporter, JSONReporter
+
+
+def records(stream):
+    return [json.loads(line) for line in
+            stream.getvalue().decode('ascii').splitlines()]
+
+
+def test_reporter(capsys):
+    reporter = Reporter()
+    reporter.launch('/api/v1/jobs/1/', 'Started job: /api/v1/jobs/1/')
+    reporter.status('/api/v1/jobs/1/', 'running')
+    reporter.output('/api/v1/jobs/1/', 'ok: [web-01]\n\n', 'ok: [web-01]')
+    reporter.output('/api/v1/jobs/1/', '\n', '')
+    reporter.event('/api/v1/jobs/1/', {'host': 'web-01', 'event': 'ok'})
+    reporter.timing('job', 3.0, job='/api/v1/jobs/1/')
+    reporter.table(('job', 'status'), [('1', 'successful')], 'job  status')
+    reporter.error('boom', 'Execution Error: boom')
+    reporter.echo('plain text')
+    reporter.close()
+    out, _ = capsys.readouterr()
+    assert out.splitlines() == [
+        'Started job: /api/v1/jobs/1/', 'ok: [web-01]',
+        '{"event": "ok", "host": "web-01"}', 'job  status',
+        'Execution Error: boom', 'plain text']
+
+
+def test_json_reporter(monkeypatch):
+    monkeypatch.setattr('lib.reporter.time.time', lambda: 10.0)
+    stream = io.BytesIO()
+    reporter = JSONReporter(stream)
+    reporter.launch('/api/v1/jobs/1/', 'Started job', label=None, limit='a')
+    reporter.output('/api/v1/jobs/1/', u'caf\xe9\n', 'ignored')
+    reporter.output('/api/v1/jobs/1/', u'', '')
+    reporter.echo('ignored')
+    # buffered until flush
+    assert stream.getvalue() == b''
+    reporter.flush()
+    assert records(stream) == [
+        {'type': 'launch', 'time': 10.0, 'job': '/api/v1/jobs/1/',
+         'limit': 'a'},
+        {'type': 'output', 'time': 10.0, 'job': '/api/v1/jobs/1/',
+         'text': u'caf\xe9\n'}]
+
+    parser = RecapParser()
+    parser.feed('PLAY RECAP\nweb-01 : ok=1 failed=0\n')
+    parser.close()
+    reporter.summary(parser, 'text')
+    reporter.table(('job', 'status'), [('1', 'failed')], 'ignored')
+    reporter.error('boom', 'Execution Error: boom')
+    reporter.close()
+    written = records(stream)[2:]
+    assert [record['type'] for record in written] == [
+        'summary', 'result', 'error', 'timing']
+    assert written[0]['summary']['hosts'] == {'web-01': {'ok': 1,
+                                                         'failed': 0}}
+    assert written[1] == {'type': 'result', 'time': 10.0, 'job': '1',
+                          'status': 'failed'}
+    assert written[2]['message'] == 'boom'
+    assert written[3] == {'type': 'timing', 'time': 10.0,
+                          'name': 'command', 'seconds': 0.0}
+
+
+def test_json_reporter_concurrency(monkeypatch):
+    monkeypatch.setattr('lib.reporter.time.time', lambda: 10.0)
+    stream = io.BytesIO()
+    reporter = JSONReporter(stream)
+    reporter.track_concurrency('tower.example.com',
+                               lambda: {'limit': 8, 'backoffs': 0})
+    reporter.close()
+    assert records(stream) == [
+        {'type': 'timing', 'time': 10.0, 'name': 'command', 'seconds': 0.0,
+         'concurrency': {'tower.example.com': {'limit': 8, 'backoffs': 0}}}]
+
+
+def test_json_reporter_buffer():
+    stream = io.BytesIO()
+    reporter = JSONReporter(stream, buffer_size=100)
+    reporter.message('short')
+    assert stream.getvalue() == b''
+    reporter.message('x' * 100)
+    # the buffer is written when it's full
+    assert [record['text'] for record in records(stream)] == ['short',
+                                                              'x' * 100]
@@ -0,0 +1,85 @@
+import pytest
+from lib.api import APIError
+from lib.scheduler import LaunchScheduler
+
+
+class MockAPI(object):
+    def __init__(self, nodes, running=0, waiting=0, queued=0):
+        self.nodes = nodes
+        self.running = running
+        self.waiting = waiting
+        self.queued = queued
+        self.groups = []
+
+    def instances(self):
+        return self.nodes
+
+    def instance_group_data(self, name):
+        self.groups.append(name)
+        return self.nodes[0]
+
+    def jobs_count(self, statuses):
+        counts = {'running': self.running, 'waiting': self.waiting,
+                  'pending': self.queued}
+        return sum(counts[status] for status in statuses)
+
+
+def test_capacity():
+    api = MockAPI([{'capacity': 50, 'consumed_capacity': 12},
+                   {'capacity': 50, 'consumed_capacity': 0}], queued=2,
+                  running=1, waiting=1)
+    scheduler = LaunchScheduler(api, job_impact=5)
+    # pending jobs are counted as used capacity, the running and waiting ones
+    # are already in the consumed capacity
+    assert scheduler.capacity() == (100, 22)
+
+    # older towers do not report the consumed capacity
+    api.nodes = [{'capacity': 50}]
+    api.running = 3
+    assert scheduler.capacity() == (50, 30)
+
+    scheduler = LaunchScheduler(api, instance_group='eu')
+    scheduler.capacity()
+    assert api.groups == ['eu']
+
+
+def test_slots():
+    api = MockAPI([{'capacity': 100, 'consumed_capacity': 40}])
+    assert LaunchScheduler(api, job_impact=10).slots() == 6
+    assert LaunchScheduler(api, share=0.5, job_impact=10).slots() == 1
+    assert LaunchScheduler(api, share=0.3, job_impact=10).slots() == 0
+    # idle tower smaller than a job
+    api.nodes = [{'capacity': 4, 'consumed_capacity': 0}]
+    assert LaunchScheduler(api, job_impact=10).slots() == 1
+
+
+def test_run(monkeypatch, capsys):
+    api = MockAPI([{'capacity': 30, 'consumed_capacity': 0}])
+    launched = []
+
+    def launch(item):
+        launched.append(item)
+        # launched jobs are queued in tower
+        api.queued += 1
+        return item * 2
+
+    def mock_sleep(seconds):
+        # time passes, tower runs the queued jobs
+        api.queued = 0
+
+    monkeypatch.setattr('lib.scheduler.sleep', mock_sleep)
+    scheduler = LaunchScheduler(api, job_impact=10)
+    assert scheduler.run(launch, range(7), workers=2) == \
+        [item * 2 for item in range(7)]
+    assert sorted(launched) == list(range(7))
+    assert 'Waiting for tower capacity' in capsys.readouterr()[0]
+
+
+def test_run_errors():
+    class BrokenAPI(MockAPI):
+        def instances(self):
+            raise APIError
+
+    scheduler = LaunchScheduler(BrokenAPI([]))
+    with pytest.raises(APIError):
+        scheduler.run(lambda item: item, [1])
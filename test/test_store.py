@@ -0,0 +1,116 @@
+import gzip
+import os
+import pytest
+from lib.store import OutputStore, StoreError, job_key, host_key
+
+
+OUTPUT = (u'PLAY [all] ****\n'
+          u'TASK [install] ****\n'
+          u'ok: [web-01]\n'
+          u'\x1b[0;31mfatal: [web-02]: FAILED! => No package matching\x1b[0m\n'
+          u'ok: [web-03]\n'
+          u'PLAY RECAP ****\n')
+
+
+def test_job_key():
+    assert job_key('https://tower//api/v1/jobs/12/') == '12@tower'
+    assert job_key('https://tower/api/v1/ad_hoc_commands/3') == \
+        'ad_hoc_commands-3@tower'
+    assert job_key('https://tower:8443/api/v1/jobs/12/') == '12@tower_8443'
+    assert job_key('/api/v1/jobs/12/') == '12'
+    with pytest.raises(StoreError):
+        job_key('https://tower/api/v1/')
+    assert host_key(12, 'eu.example.com') == '12@eu.example.com'
+    assert host_key('12@us.example.com', 'eu') == '12@us.example.com'
+
+
+def test_put(tmpdir):
+    store = OutputStore(str(tmpdir.join('store')))
+    assert store.keys() == []
+    assert not store.has('12')
+    digest = store.put('12', [OUTPUT.encode('utf-8')])
+    # the same output is stored once
+    chunks = [b'PLAY [all] ****\n', OUTPUT[16:].encode('utf-8')]
+    assert store.put('13', chunks) == digest
+    store.put('ad_hoc_commands-1', [b'uptime'])
+    store.put('2', [b''])
+    store.put('1@tower', [b''])
+    assert store.keys() == ['2', '12', '13', 'ad_hoc_commands-1', '1@tower']
+    objects = [name for _, _, names in os.walk(store.objects)
+               for name in names]
+    assert len(objects) == 3
+    with store.open('13') as output_in:
+        assert output_in.read() == OUTPUT.encode('utf-8')
+    with pytest.raises(StoreError):
+        store.open('14')
+
+
+def test_put_file(tmpdir):
+    store = OutputStore(str(tmpdir.join('store')))
+    plain = tmpdir.join('job-1.txt')
+    plain.write(b'plain output', mode='wb')
+    compressed = str(tmpdir.join('job-2.txt.gz'))
+    with gzip.open(compressed, 'wb') as output_out:
+        output_out.write(b'plain output')
+    assert store.put_file('1', str(plain)) == store.put_file('2', compressed)
+    with store.open('2') as output_in:
+        assert output_in.read() == b'plain output'
+    with pytest.raises(StoreError):
+        store.put_file('3', str(tmpdir.join('missing.txt')))
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_grep(tmpdir, processes):
+    store = OutputStore(str(tmpdir.join('store')))
+    store.put('12', [OUTPUT.encode('utf-8')])
+    store.put('13', [OUTPUT.encode('utf-8')])
+    store.put('14', [b'ok: [web-04]\n'])
+
+    results = store.grep('FAILED', processes=processes)
+    line = u'fatal: [web-02]: FAILED! => No package matching'
+    assert results == [('12', [(4, line, True)]), ('13', [(4, line, True)])]
+
+    results = store.grep(r'ok: \[web-0[13]\]', keys=['12'], context=1,
+                         processes=processes)
+    assert results == [('12', [(2, u'TASK [install] ****', False),
+                               (3, u'ok: [web-01]', True),
+                               (4, line, False),
+                               (5, u'ok: [web-03]', True),
+                               (6, u'PLAY RECAP ****', False)])]
+
+    results = store.grep('play \\[', keys=['12', '14'], ignore_case=True,
+                         processes=processes)
+    assert results == [('12', [(1, u'PLAY [all] ****', True)])]
+    assert store.grep('nothing here', processes=processes) == []
+
+
+def test_grep_groups(tmpdir):
+    store = OutputStore(str(tmpdir.join('store')))
+    store.put('1', [b'match\na\nb\nc\nd\nmatch\n'])
+    assert store.grep('match', context=1) == [
+        ('1', [(1, 'match', True), (2, 'a', False), None,
+               (5, 'd', False), (6, 'match', True)])]
+    assert store.grep('match') == [('1', [(1, 'match', True),
+                                          (6, 'match', True)])]
+
+
+def test_grep_errors(tmpdir):
+    store = OutputStore(str(tmpdir.join('store')))
+    store.put('1', [b'output'])
+    with pytest.raises(StoreError):
+        store.grep('(unbalanced')
+    with pytest.raises(StoreError):
+        store.grep('output', keys=['2'])
+
+
+def test_plain(tmpdir):
+    store = OutputStore(str(tmpdir.join('store')))
+    store.put('1', [b'line 1\nline 2\n'])
+    store.put('2', [b'line 1\nline 2\n'])
+    path = store.plain('1')
+    with open(path, 'rb') as plain_in:
+        assert plain_in.read() == b'line 1\nline 2\n'
+    # identical outputs share the copy
+    assert store.plain('2') == path
+    with pytest.raises(StoreError):
+        store.plain('3')
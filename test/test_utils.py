@@ -1,6 +1,8 @@
 import os
 import pytest
-from lib.utils import which, BadKarma
+from datetime import datetime
+from lib.utils import which, strip_ansi, format_table, seconds_since
+from lib.utils import BadKarma
 
 
 CURRENT_FILE = __file__
@@ -15,3 +17,24 @@ def test_which(monkeypatch):
         which('non-existing-executable')
 
 
+def test_strip_ansi():
+    assert strip_ansi(u'plain text') == u'plain text'
+    colored = u'\x1b[0;32mok: [web-01]\x1b[0m\n\x1b[1;31mfailed\x1b[0m'
+    assert strip_ansi(colored) == u'ok: [web-01]\nfailed'
+
+
+def test_format_table():
+    table = format_table(('job', 'status'), [('slice 1/2', 'successful'),
+                                             ('slice 2/2', 'failed')])
+    lines = table.splitlines()
+    assert lines[0] == 'job        status'
+    assert lines[1] == '---------  ----------'
+    assert lines[3] == 'slice 2/2  failed'
+
+
+def test_seconds_since():
+    now = datetime(2017, 3, 28, 10, 0, 0)
+    assert seconds_since('2017-03-28T09:59:00.5Z', now=now) == 59.5
+    assert seconds_since('2017-03-28T09:00:00Z', now=now) == 3600
+    assert seconds_since(None) is None
+    assert seconds_since('yesterday') is None
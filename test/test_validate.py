@@ -14,3 +14,19 @@ def test_job_name():
 def test_module_name():
     assert validate.module_name('command') == True
     assert validate.module_name(' command') == False
+
+
+def test_forks():
+    for forks in (0, 1, 50, 'auto'):
+        assert validate.forks(forks) == True
+
+    for forks in (-1, '10', 'Auto', None, True, 1.5):
+        assert validate.forks(forks) == False
+
+
+def test_verbosity():
+    for verbosity in range(5):
+        assert validate.verbosity(verbosity) == True
+
+    for verbosity in (-1, 5, '1', None, True):
+        assert validate.verbosity(verbosity) == False